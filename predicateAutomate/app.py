@@ -5,6 +5,10 @@ import sys
 from datetime import datetime
 import importlib
 from pathlib import Path
+from common.db import DBSession, close_pool
+from common.migrations import migrate
+from common.partitions import detach_partition
+from common.row_counts import forget_count
 
 logging.basicConfig(
     level=logging.INFO,
@@ -15,6 +19,13 @@ logger = logging.getLogger(__name__)
 
 CONFIG_FILE = Path(__file__).parent / 'config.json'
 
+# Drug table partitioned by LIST (country_of_origin)
+DRUG_DATA_TABLE = 'source.usa_drug_data'
+
+# Exit code a module's main() returns when its upstream source has not
+# changed since the last successful run (nothing was downloaded or loaded)
+SOURCE_UNCHANGED = 3
+
 MODULES = {
     'usa_drug': {
         'name': 'USA FDA Drug',
@@ -86,24 +97,25 @@ def is_module_enabled(module_key: str, config: dict) -> bool:
     return config['modules'][module_key].get('enabled', True)
 
 
-def run_module(module_key: str, config: dict = None) -> bool:
+def run_module_status(module_key: str, config: dict = None) -> str:
     """
-    Runs a specific module
+    Runs a specific module and reports how it finished
     
     Args:
         module_key: Key of the module to run
         config: Configuration dictionary (optional)
         
     Returns:
-        True if successful, False otherwise
+        'success', 'unchanged' (source not modified since last run),
+        'disabled' or 'failed'
     """
     if module_key not in MODULES:
         logger.error(f"Unknown module: {module_key}")
-        return False
+        return 'failed'
     
     if config and not is_module_enabled(module_key, config):
         logger.info(f"⊘ {MODULES[module_key]['name']} is DISABLED in config - skipping")
-        return True
+        return 'disabled'
     
     module_info = MODULES[module_key]
     module_path = Path(__file__).parent / module_info['path']
@@ -111,7 +123,7 @@ def run_module(module_key: str, config: dict = None) -> bool:
     if not module_path.exists():
         logger.warning(f"Module not found: {module_path}")
         logger.warning(f"Skipping {module_info['name']}")
-        return False
+        return 'failed'
     
     logger.info("=" * 80)
     logger.info(f"Running: {module_info['name']}")
@@ -127,18 +139,35 @@ def run_module(module_key: str, config: dict = None) -> bool:
 
         if result == 0:
             logger.info(f"✓ {module_info['name']} completed successfully")
-            return True
+            return 'success'
+        elif result == SOURCE_UNCHANGED:
+            logger.info(f"⊘ {module_info['name']}: source unchanged since last run")
+            return 'unchanged'
         else:
             logger.error(f"✗ {module_info['name']} failed")
-            return False
+            return 'failed'
             
     except Exception as e:
         logger.error(f"Error running {module_info['name']}: {e}", exc_info=True)
-        return False
+        return 'failed'
     finally:
         sys.path.pop(0)
 
 
+def run_module(module_key: str, config: dict = None) -> bool:
+    """
+    Runs a specific module
+    
+    Args:
+        module_key: Key of the module to run
+        config: Configuration dictionary (optional)
+        
+    Returns:
+        True if successful (or source unchanged), False otherwise
+    """
+    return run_module_status(module_key, config) != 'failed'
+
+
 def run_all_modules(config: dict = None) -> bool:
     """
     Runs all available modules sequentially (only enabled ones if config provided)
@@ -169,8 +198,7 @@ def run_all_modules(config: dict = None) -> bool:
         if config and not is_module_enabled(module_key, config):
             skipped.append(module_key)
             continue
-        success = run_module(module_key, config)
-        results[module_key] = success
+        results[module_key] = run_module_status(module_key, config)
     end_time = datetime.now()
     duration = end_time - start_time
     
@@ -178,9 +206,13 @@ def run_all_modules(config: dict = None) -> bool:
     logger.info("EXECUTION SUMMARY")
     logger.info("=" * 80)
     
-    for module_key, success in results.items():
-        status = "✓ SUCCESS" if success else "✗ FAILED"
-        logger.info(f"{MODULES[module_key]['name']}: {status}")
+    status_labels = {
+        'success': "✓ SUCCESS",
+        'unchanged': "⊘ SOURCE UNCHANGED",
+        'failed': "✗ FAILED",
+    }
+    for module_key, status in results.items():
+        logger.info(f"{MODULES[module_key]['name']}: {status_labels[status]}")
     
     if skipped:
         logger.info("\nSkipped (Disabled in config):")
@@ -188,14 +220,16 @@ def run_all_modules(config: dict = None) -> bool:
             logger.info(f"  ⊘ {MODULES[module_key]['name']}")
     
     total = len(results)
-    succeeded = sum(1 for s in results.values() if s)
-    failed = total - succeeded
+    unchanged = sum(1 for s in results.values() if s == 'unchanged')
+    failed = sum(1 for s in results.values() if s == 'failed')
+    succeeded = total - failed - unchanged
     
     logger.info("-" * 80)
     logger.info(f"Total Modules: {len(MODULES)}")
     logger.info(f"Enabled: {total}")
     logger.info(f"Skipped: {len(skipped)}")
     logger.info(f"Succeeded: {succeeded}")
+    logger.info(f"Source Unchanged: {unchanged}")
     logger.info(f"Failed: {failed}")
     logger.info(f"Duration: {duration}")
     logger.info("=" * 80)
@@ -203,6 +237,52 @@ def run_all_modules(config: dict = None) -> bool:
     return failed == 0
 
 
+def run_migrations() -> int:
+    """
+    Apply pending schema migrations from migrations/
+    
+    Returns:
+        Exit code: 0 on success, 1 if a migration failed
+    """
+    try:
+        applied = migrate()
+        logger.info(f"Migrations applied: {applied}")
+        return 0
+    except Exception as e:
+        logger.error(f"Migration failed: {e}", exc_info=True)
+        return 1
+    finally:
+        close_pool()
+
+
+def run_detach_partition(country_id: int, drop: bool = False) -> int:
+    """
+    Detach one country's partition of source.usa_drug_data, and drop it with
+    drop=True, instead of purging its rows with a large DELETE
+
+    Args:
+        country_id: country_of_origin value of the partition
+        drop: Drop the detached table as well
+
+    Returns:
+        Exit code: 0 on success, 1 on failure
+    """
+    db = DBSession()
+    try:
+        name = detach_partition(db.cursor, DRUG_DATA_TABLE, country_id, drop=drop)
+        if drop:
+            forget_count(db.cursor, name)
+        db.conn.commit()
+        return 0
+    except Exception as e:
+        logger.error(f"Could not detach partition {country_id} of {DRUG_DATA_TABLE}: {e}")
+        db.rollback()
+        return 1
+    finally:
+        db.release()
+        close_pool()
+
+
 def main():
     """Main entry point"""
     parser = argparse.ArgumentParser(
@@ -225,8 +305,28 @@ def main():
         action='store_true',
         help='Ignore config.json and run specified modules regardless of enabled status'
     )
+    parser.add_argument(
+        '--migrate',
+        action='store_true',
+        help='Apply pending schema migrations (creates indexes CONCURRENTLY) and exit'
+    )
+    parser.add_argument(
+        '--detach-partition',
+        type=int,
+        metavar='COUNTRY_ID',
+        help=f"Detach the {DRUG_DATA_TABLE} partition of a country_of_origin id and exit"
+    )
+    parser.add_argument(
+        '--drop',
+        action='store_true',
+        help='With --detach-partition, drop the detached table as well'
+    )
     
     args = parser.parse_args()
+    if args.migrate:
+        return run_migrations()
+    if args.detach_partition is not None:
+        return run_detach_partition(args.detach_partition, drop=args.drop)
     config = None if args.ignore_config else load_config()
     if args.list:
         print("\nAvailable Modules:")
@@ -257,6 +357,8 @@ def main():
     except Exception as e:
         logger.error(f"Fatal error: {e}", exc_info=True)
         return 1
+    finally:
+        close_pool()
 
 
 if __name__ == "__main__":
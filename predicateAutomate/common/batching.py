@@ -0,0 +1,89 @@
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+
+def estimate_size(values: Iterable[Any]) -> int:
+    """Rough payload size of a row in bytes: string lengths, 8 for anything else"""
+    size = 0
+    for value in values:
+        if value is None:
+            continue
+        size += len(value) if isinstance(value, (str, bytes)) else 8
+    return size
+
+
+class BatchAccumulator:
+    """
+    Collects records and hands them to a flush callback in bounded batches
+
+    A batch is flushed when it reaches max_rows records or max_bytes of
+    estimated payload, when its oldest record has waited max_seconds, and on
+    close(), so a trailing partial batch is never lost. Triggers are checked
+    as records are added; nothing runs in the background, so the callback
+    always runs on the caller's thread (and database connection).
+
+    Usage:
+        with BatchAccumulator(write, max_rows=1000, max_bytes=16 * 1024 * 1024,
+                              size_of=row_size) as batches:
+            for record in records:
+                batches.add(record)
+    """
+
+    def __init__(self, flush: Callable[[List[Any]], None], max_rows: int, max_bytes: int = 0,
+                 max_seconds: float = 0, size_of: Optional[Callable[[Any], int]] = None):
+        self._flush = flush
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.max_seconds = max_seconds
+        self.size_of = size_of
+        self.flush_counts = {'rows': 0, 'bytes': 0, 'time': 0, 'close': 0}
+        self._records: List[Any] = []
+        self._bytes = 0
+        self._started = 0.0
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    @property
+    def pending_bytes(self) -> int:
+        return self._bytes
+
+    def add(self, record: Any):
+        """Add one record, flushing if that fills the batch"""
+        if not self._records:
+            self._started = time.monotonic()
+        self._records.append(record)
+        if self.max_bytes and self.size_of is not None:
+            self._bytes += self.size_of(record)
+
+        if len(self._records) >= self.max_rows:
+            self.flush('rows')
+        elif self.max_bytes and self._bytes >= self.max_bytes:
+            self.flush('bytes')
+        elif self.max_seconds and time.monotonic() - self._started >= self.max_seconds:
+            self.flush('time')
+
+    def flush(self, reason: str = 'close'):
+        """Hand the pending records (if any) to the callback"""
+        if not self._records:
+            return
+        records = self._records
+        self._records = []
+        self._bytes = 0
+        self.flush_counts[reason] += 1
+        self._flush(records)
+
+    def close(self):
+        """Flush the trailing partial batch"""
+        self.flush('close')
+
+    def stats(self) -> Dict[str, int]:
+        return dict(self.flush_counts)
+
+    def __enter__(self) -> 'BatchAccumulator':
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        return False
@@ -0,0 +1,426 @@
+import logging
+import os
+import re
+import threading
+import time
+from typing import Dict, List, Optional, Sequence, Set
+import psycopg2
+import psycopg2.extensions
+import psycopg2.extras
+import psycopg2.pool
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Errors meaning the connection itself is gone (server restart, idle timeout,
+# network drop) rather than a problem with the statement
+CONNECTION_ERRORS = (psycopg2.OperationalError, psycopg2.InterfaceError)
+
+
+class DBConfig:
+    """Connection and pool settings shared by every country module"""
+    HOST = os.getenv('PG_HOST', 'localhost')
+    PORT = os.getenv('PG_PORT', '5432')
+    NAME = os.getenv('PG_DATABASE', 'quriousri_db')
+    USER = os.getenv('PG_USER', 'postgres')
+    PASSWORD = os.getenv('PG_PASSWORD', 'postgres')
+    CONNECT_TIMEOUT = int(os.getenv('PG_CONNECT_TIMEOUT', '10'))
+
+    POOL_MAX = int(os.getenv('DB_POOL_MAX', '8'))  # Connections the pool may open
+    POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '60'))  # Seconds a checkout waits for a free connection
+    HEALTH_CHECK_IDLE_SECONDS = int(os.getenv('DB_HEALTH_CHECK_IDLE_SECONDS', '30'))  # Ping pooled connections idle longer than this
+
+    # Session settings for bulk-load sessions. synchronous_commit=off may lose
+    # the last few commits on a server crash (never corrupts), which is fine
+    # for data that is reloaded from source on the next run.
+    BULK_SESSION_SETTINGS = {
+        'synchronous_commit': os.getenv('DB_BULK_SYNCHRONOUS_COMMIT', 'off'),
+        'work_mem': os.getenv('DB_BULK_WORK_MEM', '64MB'),
+    }
+
+
+class ConnectionPool:
+    """
+    Thread-safe pool of psycopg2 connections with health checks
+
+    No connection is opened until the first checkout, and returned
+    connections are kept open for the next one. Connections that sat idle
+    in the pool longer than HEALTH_CHECK_IDLE_SECONDS are pinged before
+    being handed out, and closed or broken connections are replaced
+    transparently. When all max_connections are checked out, getconn()
+    waits up to POOL_TIMEOUT seconds for one to come back instead of
+    failing at once.
+    """
+
+    def __init__(self, max_connections: int = None):
+        self.max_connections = max_connections or DBConfig.POOL_MAX
+        # Most recently returned last, so the warmest connection is reused
+        self._idle: List = []
+        self._returned_at: Dict[int, float] = {}
+        # Statement names PREPAREd on each connection, which live as long as it does
+        self._prepared: Dict[int, Set[str]] = {}
+        self._lock = threading.Lock()
+        self._closed = False
+        # One permit per connection that may be checked out
+        self._available = threading.BoundedSemaphore(self.max_connections)
+
+    def _connect(self):
+        return psycopg2.connect(
+            host=DBConfig.HOST,
+            port=DBConfig.PORT,
+            database=DBConfig.NAME,
+            user=DBConfig.USER,
+            password=DBConfig.PASSWORD,
+            connect_timeout=DBConfig.CONNECT_TIMEOUT,
+        )
+
+    def _is_healthy(self, conn) -> bool:
+        if conn.closed:
+            return False
+        with self._lock:
+            returned_at = self._returned_at.get(id(conn))
+        if returned_at is None or time.monotonic() - returned_at < DBConfig.HEALTH_CHECK_IDLE_SECONDS:
+            return True
+        try:
+            conn.rollback()
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except CONNECTION_ERRORS:
+            return False
+
+    def getconn(self, timeout: float = None):
+        """
+        Check out a healthy connection, replacing dead ones
+
+        Raises:
+            psycopg2.pool.PoolError: no connection was returned within
+                `timeout` seconds (default POOL_TIMEOUT)
+        """
+        timeout = DBConfig.POOL_TIMEOUT if timeout is None else timeout
+        if not self._available.acquire(timeout=timeout):
+            raise psycopg2.pool.PoolError(
+                f"No database connection free after {timeout:.0f}s "
+                f"(all {self.max_connections} checked out; raise DB_POOL_MAX)"
+            )
+        try:
+            while True:
+                with self._lock:
+                    conn = self._idle.pop() if self._idle else None
+                if conn is None:
+                    return self._connect()
+                if self._is_healthy(conn):
+                    return conn
+                logger.warning("Discarding dead pooled database connection, reconnecting")
+                self._close(conn)
+        except Exception:
+            self._available.release()
+            raise
+
+    def putconn(self, conn):
+        """Return a connection to the pool, ending any open transaction"""
+        try:
+            status = conn.info.transaction_status if not conn.closed else None
+            if status is None or status == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN or self._closed:
+                self._close(conn)
+                return
+            if status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+            with self._lock:
+                self._returned_at[id(conn)] = time.monotonic()
+                self._idle.append(conn)
+        except CONNECTION_ERRORS:
+            self._close(conn)
+        finally:
+            self._available.release()
+
+    def discard(self, conn):
+        """Close a broken checked-out connection and drop it from the pool"""
+        self._close(conn)
+        self._available.release()
+
+    def _close(self, conn):
+        with self._lock:
+            self._returned_at.pop(id(conn), None)
+            self._prepared.pop(id(conn), None)
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    def is_prepared(self, conn, name: str) -> bool:
+        """True if statement `name` was already PREPAREd on this connection"""
+        with self._lock:
+            return name in self._prepared.get(id(conn), ())
+
+    def mark_prepared(self, conn, name: str):
+        with self._lock:
+            self._prepared.setdefault(id(conn), set()).add(name)
+
+    def closeall(self):
+        """Close the idle connections; ones still checked out close when returned"""
+        with self._lock:
+            self._closed = True
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            self._close(conn)
+
+
+_pool: Optional[ConnectionPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ConnectionPool:
+    """Process-wide connection pool, created on first use"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ConnectionPool()
+        return _pool
+
+
+def close_pool():
+    """Close every pooled connection (end of run)"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.closeall()
+            _pool = None
+
+
+# Number of executions PostgreSQL plans individually (custom plans) before it
+# may switch a prepared statement to its cached generic plan
+CUSTOM_PLAN_EXECUTIONS = 5
+
+_PLACEHOLDER = re.compile(r'%%|%s')
+
+
+class PreparedStatement:
+    """
+    A hot fixed statement that is PREPAREd once per connection and run by name
+
+    Written with psycopg2 %s placeholders like any other query; they are
+    numbered $1..$n for PREPARE. Parameters are sent as literals, so a
+    placeholder that needs a type other than the one PostgreSQL infers gets
+    it from `types` (PREPARE's parameter type list) or an explicit cast.
+    Planning time is measured once with EXPLAIN (SUMMARY) on first use, so
+    stats() can estimate the planning time saved by executions that reused
+    a cached plan.
+    """
+
+    def __init__(self, name: str, query: str, types: Sequence[str] = ()):
+        self.name = name
+        self.query = query
+        self.types = tuple(types)
+        self.param_count = 0
+        self.server_query = _PLACEHOLDER.sub(self._positional, query)
+        self.executions = 0
+        self.planning_ms: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def _positional(self, match) -> str:
+        if match.group(0) == '%%':
+            return '%'
+        self.param_count += 1
+        return f"${self.param_count}"
+
+    def prepare_query(self) -> str:
+        types = f" ({', '.join(self.types)})" if self.types else ''
+        return f"PREPARE {self.name}{types} AS {self.server_query}"
+
+    def record_execution(self):
+        with self._lock:
+            self.executions += 1
+
+    def planning_ms_saved(self) -> float:
+        """Estimated planning time saved: measured planning time x cached-plan executions"""
+        if self.planning_ms is None:
+            return 0.0
+        return self.planning_ms * max(0, self.executions - CUSTOM_PLAN_EXECUTIONS)
+
+    def stats(self) -> Dict:
+        return {
+            'executions': self.executions,
+            'planning_ms': round(self.planning_ms, 3) if self.planning_ms is not None else None,
+            'planning_ms_saved': round(self.planning_ms_saved(), 1),
+        }
+
+
+_statements: Dict[str, PreparedStatement] = {}
+_statements_lock = threading.Lock()
+
+
+def register_statement(name: str, query: str, types: Sequence[str] = ()) -> PreparedStatement:
+    """
+    Register a hot statement for DBSession.execute_prepared()
+
+    Registering the same name again returns the existing statement, so
+    mappers can register their statements at construction time.
+
+    Args:
+        name: Statement name, unique across modules (e.g. 'usa_drug_data_p1_retire')
+        query: SQL with psycopg2 %s placeholders
+        types: Leading parameter types for PREPARE (the rest are inferred)
+
+    Raises:
+        ValueError: name is already registered with a different query
+    """
+    with _statements_lock:
+        statement = _statements.get(name)
+        if statement is None:
+            statement = _statements[name] = PreparedStatement(name, query, types)
+        elif statement.query != query or statement.types != tuple(types):
+            raise ValueError(f"Prepared statement {name} is already registered with a different query")
+        return statement
+
+
+def prepared_statement_stats() -> Dict[str, Dict]:
+    """Executions and estimated planning time saved, per registered statement"""
+    with _statements_lock:
+        return {name: statement.stats() for name, statement in _statements.items()}
+
+
+class DBSession:
+    """
+    One logical database session backed by the shared pool
+
+    The connection is checked out lazily on first access to .conn or
+    .cursor and goes back to the pool on release(), so a mapper can be
+    created (and verified with check()) long before it writes without
+    pinning an idle connection. Bulk sessions get BULK_SESSION_SETTINGS,
+    which are reset before the connection is returned.
+    """
+
+    def __init__(self, bulk: bool = False, cursor_factory=psycopg2.extras.RealDictCursor,
+                 pool: ConnectionPool = None):
+        self.bulk = bulk
+        self.cursor_factory = cursor_factory
+        self._pool = pool
+        self._conn = None
+        self._cursor = None
+
+    @property
+    def pool(self) -> ConnectionPool:
+        return self._pool or get_pool()
+
+    @property
+    def conn(self):
+        if self._conn is not None and self._conn.closed:
+            # Give the dead connection's slot back before taking a new one
+            self.pool.discard(self._conn)
+            self._conn = None
+        if self._conn is None:
+            self._checkout()
+        return self._conn
+
+    @property
+    def cursor(self):
+        if self._cursor is None or self._cursor.closed or self._conn is None or self._conn.closed:
+            self._cursor = self.conn.cursor(cursor_factory=self.cursor_factory)
+        return self._cursor
+
+    def _checkout(self):
+        conn = self.pool.getconn()
+        if self.bulk:
+            self._apply_settings(conn, DBConfig.BULK_SESSION_SETTINGS)
+        self._conn = conn
+        self._cursor = None
+
+    def _apply_settings(self, conn, settings: Dict[str, str]):
+        # Set outside a transaction so a later rollback cannot undo them
+        conn.autocommit = True
+        try:
+            with conn.cursor() as cursor:
+                for name, value in settings.items():
+                    cursor.execute("SELECT set_config(%s, %s, false)", (name, value))
+        finally:
+            conn.autocommit = False
+
+    def execute_prepared(self, name: str, params: Sequence):
+        """
+        Run a registered statement by name on this session's cursor
+
+        The statement is PREPAREd the first time it is used on the current
+        connection (prepared statements outlive transactions, so a rollback
+        does not undo it). Results are read from self.cursor as usual.
+
+        Args:
+            name: Name the statement was registered under
+            params: One value per %s placeholder, in order
+        """
+        statement = _statements[name]
+        if len(params) != statement.param_count:
+            raise ValueError(f"Prepared statement {name} takes {statement.param_count} parameters, got {len(params)}")
+        conn = self.conn
+        cursor = self.cursor
+        if not self.pool.is_prepared(conn, name):
+            cursor.execute(statement.prepare_query())
+            self.pool.mark_prepared(conn, name)
+            if statement.planning_ms is None:
+                statement.planning_ms = self._planning_ms(cursor, statement, params)
+
+        placeholders = ', '.join(['%s'] * len(params))
+        cursor.execute(f"EXECUTE {name} ({placeholders})" if params else f"EXECUTE {name}", params)
+        statement.record_execution()
+        return cursor
+
+    def _planning_ms(self, cursor, statement: PreparedStatement, params: Sequence) -> Optional[float]:
+        # EXPLAIN without ANALYZE plans the statement but does not run it; the
+        # savepoint keeps a failed EXPLAIN from aborting the caller's transaction
+        cursor.execute("SAVEPOINT measure_planning")
+        try:
+            cursor.execute(f"EXPLAIN (SUMMARY ON, FORMAT JSON) {statement.query}", params)
+            plan = cursor.fetchone()
+            plan = plan['QUERY PLAN'] if isinstance(plan, dict) else plan[0]
+            planning_ms = float(plan[0]['Planning Time'])
+        except (psycopg2.Error, KeyError, IndexError, TypeError, ValueError) as e:
+            logger.debug(f"Could not measure planning time of {statement.name}: {e}")
+            cursor.execute("ROLLBACK TO SAVEPOINT measure_planning")
+            planning_ms = None
+        cursor.execute("RELEASE SAVEPOINT measure_planning")
+        return planning_ms
+
+    def check(self) -> bool:
+        """Verify the database is reachable; logs and returns False if not"""
+        try:
+            self.cursor.execute("SELECT 1")
+            self.conn.rollback()
+            return True
+        except Exception as e:
+            logger.error(f"Failed to connect to database: {e}")
+            self.rollback()
+            return False
+
+    def rollback(self):
+        """Roll back the current transaction; a dead connection is discarded so the next use reconnects"""
+        if self._conn is None:
+            return
+        try:
+            self._conn.rollback()
+        except CONNECTION_ERRORS as e:
+            logger.warning(f"Database connection lost ({e}), will reconnect")
+            self.pool.discard(self._conn)
+            self._conn = None
+            self._cursor = None
+
+    def release(self):
+        """Return the connection to the pool"""
+        if self._conn is None:
+            return
+        conn = self._conn
+        self._conn = None
+        self._cursor = None
+        try:
+            if not conn.closed:
+                conn.rollback()
+                if self.bulk:
+                    conn.autocommit = True
+                    with conn.cursor() as cursor:
+                        cursor.execute("RESET ALL")
+                    conn.autocommit = False
+            self.pool.putconn(conn)
+        except CONNECTION_ERRORS:
+            self.pool.discard(conn)
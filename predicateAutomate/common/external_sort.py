@@ -0,0 +1,82 @@
+import heapq
+import os
+import shutil
+import tempfile
+from typing import Dict, Iterator, List, Optional, Tuple
+
+
+class ExternalSorter:
+    """
+    Sorts an unbounded stream of (key, payload) strings with bounded memory
+
+    Items are buffered up to chunk_rows, sorted and spilled to a temporary
+    run file; iterating merges the runs (and the last in-memory chunk) with
+    heapq.merge, reading one line per run at a time. Items with equal keys
+    come out in the order they were added.
+
+    Keys and payloads are stored as one text line each, so neither may
+    contain a newline and keys may not contain a tab (json.dumps output and
+    UUID strings are fine). Keys are compared as Python strings.
+
+    Usage:
+        with ExternalSorter(chunk_rows=50000) as sorter:
+            for record in records:
+                sorter.add(record['natural_key'], json.dumps(record))
+            for key, payload in sorter:
+                ...
+    """
+
+    def __init__(self, chunk_rows: int, directory: Optional[str] = None):
+        self.chunk_rows = chunk_rows
+        self.directory = directory
+        self.rows = 0
+        self._chunk: List[str] = []
+        self._runs: List[str] = []
+        self._tempdir = None
+
+    def add(self, key: str, payload: str):
+        # Zero-padded sequence number: lines sort by key, then insertion order
+        self._chunk.append(f"{key}\t{self.rows:012d}\t{payload}\n")
+        self.rows += 1
+        if len(self._chunk) >= self.chunk_rows:
+            self._spill()
+
+    def _spill(self):
+        if self._tempdir is None:
+            self._tempdir = tempfile.mkdtemp(prefix='external_sort_', dir=self.directory)
+        self._chunk.sort()
+        path = os.path.join(self._tempdir, f"run_{len(self._runs):05d}.txt")
+        with open(path, 'w', encoding='utf-8') as f:
+            f.writelines(self._chunk)
+        self._runs.append(path)
+        self._chunk = []
+
+    def __iter__(self) -> Iterator[Tuple[str, str]]:
+        """Yield (key, payload) in key order; call once, after the last add()"""
+        self._chunk.sort()
+        files = [open(path, 'r', encoding='utf-8') for path in self._runs]
+        try:
+            for line in heapq.merge(*files, self._chunk):
+                key, _, rest = line.partition('\t')
+                yield key, rest[13:-1]
+        finally:
+            for f in files:
+                f.close()
+
+    def stats(self) -> Dict:
+        return {'rows': self.rows, 'runs': len(self._runs) + (1 if self._chunk else 0)}
+
+    def close(self):
+        """Remove the run files"""
+        self._chunk = []
+        if self._tempdir is not None:
+            shutil.rmtree(self._tempdir, ignore_errors=True)
+            self._tempdir = None
+        self._runs = []
+
+    def __enter__(self) -> 'ExternalSorter':
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
@@ -0,0 +1,295 @@
+import hashlib
+import logging
+import re
+import time
+from pathlib import Path
+from typing import Dict, List, Sequence
+import psycopg2
+from common.db import DBSession
+
+logger = logging.getLogger(__name__)
+
+MIGRATIONS_DIR = Path(__file__).resolve().parent.parent / 'migrations'
+
+MIGRATIONS_TABLE = 'source.schema_migrations'
+
+# Serializes concurrent runners (two containers starting at once)
+MIGRATION_LOCK_ID = 7245019
+
+# First-line marker of migrations that must run outside a transaction block,
+# e.g. CREATE INDEX CONCURRENTLY
+NO_TRANSACTION_MARKER = '-- migrate:no-transaction'
+
+_FILE_NAME = re.compile(r'^(\d+)_(\w+)\.sql$')
+_CONCURRENT_INDEX = re.compile(
+    r'CREATE\s+(?:UNIQUE\s+)?INDEX\s+CONCURRENTLY\s+(?:IF\s+NOT\s+EXISTS\s+)?(\w+)\s+ON\s+(?:ONLY\s+)?([\w.]+)',
+    re.IGNORECASE
+)
+
+
+class Migration:
+    """One versioned SQL file from the migrations directory"""
+
+    def __init__(self, path: Path):
+        match = _FILE_NAME.match(path.name)
+        if not match:
+            raise ValueError(f"Migration file name must look like 0001_description.sql: {path.name}")
+        self.path = path
+        self.version = int(match.group(1))
+        self.name = match.group(2)
+        self.sql = path.read_text(encoding='utf-8')
+        self.checksum = hashlib.sha256(self.sql.encode('utf-8')).hexdigest()
+        self.transactional = not self.sql.lstrip().startswith(NO_TRANSACTION_MARKER)
+
+    def statements(self) -> List[str]:
+        return split_statements(self.sql)
+
+    def concurrent_indexes(self) -> List[str]:
+        """Schema-qualified names of the indexes this migration builds CONCURRENTLY"""
+        indexes = []
+        for index, table in _CONCURRENT_INDEX.findall(self.sql):
+            schema = table.rsplit('.', 1)[0] if '.' in table else 'public'
+            indexes.append(f"{schema}.{index}")
+        return indexes
+
+
+def load_migrations(directory: Path = MIGRATIONS_DIR) -> List[Migration]:
+    """
+    Read every NNNN_description.sql file in `directory`
+
+    Returns:
+        Migrations sorted by version
+
+    Raises:
+        ValueError: on a malformed file name or two files with one version
+    """
+    migrations = sorted(
+        (Migration(path) for path in Path(directory).glob('*.sql')),
+        key=lambda m: m.version
+    )
+    for previous, current in zip(migrations, migrations[1:]):
+        if previous.version == current.version:
+            raise ValueError(f"Duplicate migration version {current.version}: "
+                             f"{previous.path.name}, {current.path.name}")
+    return migrations
+
+
+def split_statements(sql: str) -> List[str]:
+    """
+    Split a SQL script on top-level semicolons
+
+    Semicolons inside string literals, quoted identifiers, dollar-quoted
+    bodies (DO $$ ... $$) and comments do not end a statement. Statements that are only comments are
+    dropped.
+    """
+    statements = []
+    current = []
+    i = 0
+    length = len(sql)
+    while i < length:
+        char = sql[i]
+        if sql.startswith('--', i):
+            end = sql.find('\n', i)
+            end = length if end == -1 else end
+            current.append(sql[i:end])
+            i = end
+            continue
+        if sql.startswith('/*', i):
+            end = sql.find('*/', i + 2)
+            end = length if end == -1 else end + 2
+            current.append(sql[i:end])
+            i = end
+            continue
+        if char in ("'", '"'):
+            # String literal or quoted identifier; a doubled quote is escaped
+            end = i + 1
+            while end < length:
+                if sql.startswith(char * 2, end):
+                    end += 2
+                    continue
+                if sql[end] == char:
+                    break
+                end += 1
+            current.append(sql[i:end + 1])
+            i = end + 1
+            continue
+        if char == '$':
+            tag = re.match(r'\$(\w*)\$', sql[i:])
+            if tag:
+                end = sql.find(tag.group(0), i + len(tag.group(0)))
+                end = length if end == -1 else end + len(tag.group(0))
+                current.append(sql[i:end])
+                i = end
+                continue
+        if char == ';':
+            statements.append(''.join(current))
+            current = []
+        else:
+            current.append(char)
+        i += 1
+    statements.append(''.join(current))
+    return [s.strip() for s in statements if _strip_comments(s).strip()]
+
+
+def _strip_comments(sql: str) -> str:
+    return re.sub(r'--[^\n]*|/\*.*?\*/', '', sql, flags=re.DOTALL)
+
+
+def _ensure_migrations_table(cursor):
+    cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS {MIGRATIONS_TABLE} (
+            version INTEGER PRIMARY KEY,
+            name VARCHAR(255) NOT NULL,
+            checksum VARCHAR(64) NOT NULL,
+            duration_ms INTEGER,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+
+def applied_migrations(cursor) -> Dict[int, Dict]:
+    """Rows of the migrations table keyed by version"""
+    cursor.execute(f"SELECT version, name, checksum, applied_at FROM {MIGRATIONS_TABLE} ORDER BY version")
+    return {row['version']: row for row in cursor.fetchall()}
+
+
+def _drop_invalid_indexes(cursor, indexes: Sequence[str]):
+    # A failed or interrupted CREATE INDEX CONCURRENTLY leaves an INVALID
+    # index behind, which IF NOT EXISTS would then silently keep
+    for index in indexes:
+        cursor.execute("""
+            SELECT NOT i.indisvalid AS invalid
+            FROM pg_index i
+            WHERE i.indexrelid = to_regclass(%s)
+        """, (index,))
+        row = cursor.fetchone()
+        if row and row['invalid']:
+            logger.warning(f"Dropping invalid index {index} left by an interrupted build")
+            cursor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {index}")
+
+
+def _apply(db: DBSession, migration: Migration):
+    conn = db.conn
+    cursor = db.cursor
+    if migration.transactional:
+        for statement in migration.statements():
+            cursor.execute(statement)
+        return
+
+    # Each statement commits on its own; statements must be idempotent
+    # (IF NOT EXISTS) so a rerun after a failure picks up where it stopped
+    conn.autocommit = True
+    try:
+        _drop_invalid_indexes(cursor, migration.concurrent_indexes())
+        for statement in migration.statements():
+            cursor.execute(statement)
+    finally:
+        conn.autocommit = False
+
+
+def migrate(directory: Path = MIGRATIONS_DIR) -> int:
+    """
+    Apply every migration in `directory` that is not yet recorded in
+    source.schema_migrations, in version order
+
+    A transactional migration and its version row commit together. A
+    no-transaction migration runs statement by statement in autocommit so
+    CREATE INDEX CONCURRENTLY can build indexes without blocking writers;
+    its version row is recorded once every statement succeeded.
+
+    Returns:
+        Number of migrations applied
+
+    Raises:
+        psycopg2.Error: the failing statement's error; earlier migrations
+            stay applied
+    """
+    migrations = load_migrations(directory)
+    db = DBSession()
+    try:
+        conn = db.conn
+        cursor = db.cursor
+        conn.autocommit = True
+        cursor.execute("SELECT pg_advisory_lock(%s)", (MIGRATION_LOCK_ID,))
+        conn.autocommit = False
+        try:
+            _ensure_migrations_table(cursor)
+            applied = applied_migrations(cursor)
+            conn.commit()
+
+            for migration in migrations:
+                row = applied.get(migration.version)
+                if row and row['checksum'] != migration.checksum:
+                    logger.warning(f"Migration {migration.path.name} changed after it was applied")
+
+            pending = [m for m in migrations if m.version not in applied]
+            if not pending:
+                logger.info(f"Schema is up to date ({len(applied)} migrations applied)")
+                return 0
+
+            for migration in pending:
+                mode = 'transaction' if migration.transactional else 'no transaction'
+                logger.info(f"Applying migration {migration.path.name} ({mode})")
+                started = time.monotonic()
+                _apply(db, migration)
+                duration_ms = int((time.monotonic() - started) * 1000)
+                cursor.execute(
+                    f"INSERT INTO {MIGRATIONS_TABLE} (version, name, checksum, duration_ms) VALUES (%s, %s, %s, %s)",
+                    (migration.version, migration.name, migration.checksum, duration_ms)
+                )
+                conn.commit()
+                logger.info(f"Applied migration {migration.path.name} in {duration_ms} ms")
+            return len(pending)
+        finally:
+            try:
+                conn.rollback()
+                conn.autocommit = True
+                cursor.execute("SELECT pg_advisory_unlock(%s)", (MIGRATION_LOCK_ID,))
+                conn.autocommit = False
+            except psycopg2.Error as e:
+                # The lock is released with the session anyway
+                logger.warning(f"Could not release migration lock: {e}")
+    finally:
+        db.release()
+
+
+def missing_indexes(cursor, indexes: Sequence[str]) -> List[str]:
+    """
+    Indexes (schema-qualified names) that do not exist or are not valid yet
+
+    An index still being built CONCURRENTLY, or one left invalid by a failed
+    build, cannot serve queries or ON CONFLICT and counts as missing.
+    """
+    if not indexes:
+        return []
+    cursor.execute("""
+        SELECT name
+        FROM unnest(%s::text[]) AS name
+        LEFT JOIN pg_index i ON i.indexrelid = to_regclass(name)
+        WHERE i.indexrelid IS NULL OR NOT i.indisvalid
+    """, (list(indexes),))
+    return [row['name'] if isinstance(row, dict) else row[0] for row in cursor.fetchall()]
+
+
+def verify_indexes(cursor, indexes: Sequence[str], owner: str) -> bool:
+    """
+    Check at startup that the indexes a mapper relies on exist
+
+    Args:
+        cursor: Open cursor (the caller ends the transaction)
+        indexes: Schema-qualified index names
+        owner: Who needs them, for the log message
+
+    Returns:
+        True if all exist and are valid; logs the missing ones otherwise
+    """
+    try:
+        missing = missing_indexes(cursor, indexes)
+    except psycopg2.Error as e:
+        logger.error(f"Could not verify indexes for {owner}: {e}")
+        return False
+    if missing:
+        logger.error(f"{owner} requires missing or invalid indexes: {', '.join(missing)}")
+        logger.error("Run `python app.py --migrate` to create them")
+        return False
+    return True
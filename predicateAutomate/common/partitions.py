@@ -0,0 +1,59 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def partition_name(parent: str, value) -> str:
+    """
+    Name of the LIST partition of `parent` holding `value`
+
+    e.g. partition_name('source.usa_drug_data', 1) -> 'source.usa_drug_data_p1'
+    """
+    return f"{parent}_p{value}"
+
+
+def _unqualified(table: str) -> str:
+    return table.rsplit('.', 1)[-1]
+
+
+def ensure_list_partition(cursor, parent: str, value) -> str:
+    """
+    Create the LIST partition for `value` if it does not exist yet
+
+    Args:
+        cursor: Cursor on the caller's transaction (caller commits)
+        parent: Partitioned table, e.g. 'source.usa_drug_data'
+        value: Partition key value (an integer id)
+
+    Returns:
+        Partition table name
+    """
+    name = partition_name(parent, value)
+    # Check first: creating a partition locks the parent even when it exists
+    cursor.execute("SELECT to_regclass(%s) IS NOT NULL AS found", (name,))
+    if not _first_value(cursor.fetchone()):
+        cursor.execute(f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {parent} FOR VALUES IN (%s)", (value,))
+        logger.info(f"Created partition {name}")
+    return name
+
+
+def detach_partition(cursor, parent: str, value, drop: bool = False) -> str:
+    """
+    Detach the partition for `value` (e.g. to purge one country's rows)
+
+    Detaching is a catalog change rather than a large DELETE; with
+    drop=True the detached table is removed as well.
+
+    Returns:
+        Partition table name
+    """
+    name = partition_name(parent, value)
+    cursor.execute(f"ALTER TABLE {parent} DETACH PARTITION {name}")
+    if drop:
+        cursor.execute(f"DROP TABLE {name}")
+    logger.info(f"{'Dropped' if drop else 'Detached'} partition {name}")
+    return name
+
+
+def _first_value(row):
+    return next(iter(row.values())) if isinstance(row, dict) else row[0]
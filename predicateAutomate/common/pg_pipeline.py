@@ -0,0 +1,100 @@
+import logging
+from typing import Any, List, Sequence, Tuple
+from common.db import DBConfig
+
+try:
+    import psycopg
+except ImportError:  # Optional: only DB_WRITE_MODE=pipeline needs psycopg 3
+    psycopg = None
+
+logger = logging.getLogger(__name__)
+
+
+class PipelineSession:
+    """
+    psycopg 3 connection driven in libpq pipeline mode
+
+    execute_pipelined() sends every statement before reading any result, so
+    N statements cost roughly one network round trip instead of N; results
+    come back in order and are matched to their statements. psycopg2 has no
+    pipeline mode, so this session opens its own connection (with the same
+    DBConfig settings) instead of using the shared pool. Identical statement
+    texts are prepared server-side automatically after a few executions.
+
+    The saving is within one call only: execute_pipelined() ends with a
+    blocking sync that waits for every result, and commit() is another round
+    trip, so consecutive batches are not overlapped with each other.
+    """
+
+    def __init__(self, bulk: bool = True):
+        if psycopg is None:
+            raise ImportError("DB_WRITE_MODE=pipeline requires psycopg 3: pip install 'psycopg[binary]'")
+        self.bulk = bulk
+        self._conn = None
+
+    @property
+    def conn(self):
+        if self._conn is None or self._conn.closed:
+            self._conn = psycopg.connect(
+                host=DBConfig.HOST,
+                port=DBConfig.PORT,
+                dbname=DBConfig.NAME,
+                user=DBConfig.USER,
+                password=DBConfig.PASSWORD,
+                connect_timeout=DBConfig.CONNECT_TIMEOUT,
+            )
+            if self.bulk:
+                self._apply_settings(DBConfig.BULK_SESSION_SETTINGS)
+        return self._conn
+
+    def _apply_settings(self, settings):
+        # Set outside a transaction so a later rollback cannot undo them
+        self._conn.autocommit = True
+        try:
+            for name, value in settings.items():
+                self._conn.execute("SELECT set_config(%s, %s, false)", (name, value))
+        finally:
+            self._conn.autocommit = False
+
+    def execute_pipelined(self, statements: Sequence[Tuple[str, Sequence[Any]]]) -> List[List[tuple]]:
+        """
+        Run statements in one pipeline inside the current transaction
+
+        Args:
+            statements: (query, params) pairs, sent in order
+
+        Returns:
+            Result rows of each statement, in statement order ([] for
+            statements that return nothing)
+
+        Raises:
+            psycopg.Error: the first failing statement's error; statements
+                after it in the pipeline are not executed
+        """
+        conn = self.conn
+        cursors = []
+        with conn.pipeline():
+            for query, params in statements:
+                cursor = conn.cursor()
+                cursor.execute(query, params)
+                cursors.append(cursor)
+        return [cursor.fetchall() if cursor.description else [] for cursor in cursors]
+
+    def commit(self):
+        self.conn.commit()
+
+    def rollback(self):
+        """Roll back the current transaction; a dead connection is dropped so the next use reconnects"""
+        if self._conn is None:
+            return
+        try:
+            self._conn.rollback()
+        except psycopg.OperationalError as e:
+            logger.warning(f"Pipeline connection lost ({e}), will reconnect")
+            self._conn.close()
+            self._conn = None
+
+    def close(self):
+        if self._conn is not None and not self._conn.closed:
+            self._conn.close()
+        self._conn = None
@@ -0,0 +1,167 @@
+import logging
+import threading
+from typing import Any, Callable, Sequence
+
+logger = logging.getLogger(__name__)
+
+COUNTER_TABLE = 'source.table_row_counts'
+
+ROW_COUNT_MODES = ('scan', 'estimate', 'counter')
+
+# Planner-style estimate: rows per page from the last ANALYZE/VACUUM scaled to
+# the table's current size, so growth since then is included. Tables never
+# analyzed (reltuples -1) fall back to the statistics collector's live tuples.
+ESTIMATE_QUERY = """
+    SELECT CASE
+        WHEN c.reltuples < 0 OR c.relpages = 0 THEN COALESCE(s.n_live_tup, 0)
+        ELSE c.reltuples / c.relpages * (pg_relation_size(c.oid) / current_setting('block_size')::int)
+    END::bigint AS count
+    FROM pg_class c
+    LEFT JOIN pg_stat_user_tables s ON s.relid = c.oid
+    WHERE c.oid = to_regclass(%s)
+"""
+
+# Slot 0 holds the seeded COUNT(*); writers add their inserts to their own
+# slot, so concurrent writers never wait on each other's counter row
+BASE_SLOT = 0
+
+INCREMENT_QUERY = f"""
+    INSERT INTO {COUNTER_TABLE} AS c (table_name, slot, row_count) VALUES (%s, %s, %s)
+    ON CONFLICT (table_name, slot)
+    DO UPDATE SET row_count = c.row_count + EXCLUDED.row_count, updated_at = CURRENT_TIMESTAMP
+"""
+
+# Seeded count plus every slot's inserts; no row until the base slot exists
+COUNT_QUERY = f"""
+    SELECT SUM(row_count) AS count
+    FROM {COUNTER_TABLE}
+    WHERE table_name = %s
+    HAVING bool_or(slot = {BASE_SLOT})
+"""
+
+
+def _first_value(row):
+    return next(iter(row.values())) if isinstance(row, dict) else row[0]
+
+
+def forget_count(cursor, table: str):
+    """
+    Drop the maintained count of `table` (e.g. after its partition was
+    dropped), so the next counter-mode read recounts it
+
+    Args:
+        cursor: Cursor on the caller's transaction (caller commits)
+    """
+    cursor.execute("SELECT to_regclass(%s) IS NOT NULL AS found", (COUNTER_TABLE,))
+    if _first_value(cursor.fetchone()):
+        cursor.execute(f"DELETE FROM {COUNTER_TABLE} WHERE table_name = %s", (table,))
+
+
+class RowCounter:
+    """
+    Row count of one table without a sequential scan per call
+
+    Modes:
+        scan: SELECT COUNT(*), exact but reads the whole table
+        estimate: pg_class.reltuples (scaled to the current table size) taken
+            once, plus the rows this run inserted
+        counter: exact count kept in source.table_row_counts; writers add
+            their inserts in the same transaction (in_transaction()), so the
+            counter commits or rolls back with the rows. Each writer thread
+            adds to its own slot row and reads sum the slots, so parallel
+            writers do not serialize on one row lock. The first read seeds
+            the base slot with one COUNT(*); deleting the table's rows forces
+            a recount.
+
+    One counter may be shared by several writers (ShardedWriter copies);
+    in_transaction() and committed() are thread-safe.
+    """
+
+    def __init__(self, table: str, mode: str):
+        if mode not in ROW_COUNT_MODES:
+            raise ValueError(f"ROW_COUNT_MODE must be one of {', '.join(ROW_COUNT_MODES)}, got {mode!r}")
+        self.table = table
+        self.mode = mode
+        self._baseline = None
+        self._inserted = 0
+        self._slots = {}
+        self._lock = threading.Lock()
+
+    @property
+    def required_indexes(self) -> tuple:
+        """Indexes this mode needs (the counter table's key in counter mode)"""
+        return (f"{COUNTER_TABLE}_pkey",) if self.mode == 'counter' else ()
+
+    def count(self, cursor) -> int:
+        """
+        Current row count in this counter's mode
+
+        Args:
+            cursor: Cursor on the caller's connection (the caller ends the
+                transaction; only a counter seed commits on its own)
+        """
+        if self.mode == 'scan':
+            cursor.execute(f"SELECT COUNT(*) AS count FROM {self.table}")
+            return int(_first_value(cursor.fetchone()))
+
+        if self.mode == 'estimate':
+            if self._baseline is None:
+                cursor.execute(ESTIMATE_QUERY, (self.table,))
+                row = cursor.fetchone()
+                self._baseline = int(_first_value(row)) if row else 0
+            with self._lock:
+                return self._baseline + self._inserted
+
+        return self._read_counter(cursor, seed=True)
+
+    def _read_counter(self, cursor, seed: bool) -> int:
+        cursor.execute(COUNT_QUERY, (self.table,))
+        row = cursor.fetchone()
+        if row is None:
+            if not seed:
+                raise RuntimeError(f"Row counter for {self.table} was not seeded")
+            self._seed(cursor)
+            return self._read_counter(cursor, seed=False)
+        return int(_first_value(row))
+
+    def _seed(self, cursor):
+        logger.info(f"Seeding row counter for {self.table} (one-time COUNT(*))")
+        # Lock out writers so no insert lands between the COUNT and the seed.
+        # Slot rows written before the seed are already in the COUNT(*).
+        cursor.execute(f"LOCK TABLE {self.table} IN SHARE MODE")
+        cursor.execute(f"SELECT 1 FROM {COUNTER_TABLE} WHERE table_name = %s AND slot = {BASE_SLOT}", (self.table,))
+        if cursor.fetchone() is None:
+            cursor.execute(f"DELETE FROM {COUNTER_TABLE} WHERE table_name = %s", (self.table,))
+            cursor.execute(f"""
+                INSERT INTO {COUNTER_TABLE} (table_name, slot, row_count)
+                SELECT %s, {BASE_SLOT}, COUNT(*) FROM {self.table}
+            """, (self.table,))
+        cursor.connection.commit()
+
+    def _slot(self) -> int:
+        # One slot per writer thread, numbered from 1 in order of first use, so
+        # the slot rows stay bounded by the number of writers across runs
+        thread = threading.get_ident()
+        with self._lock:
+            if thread not in self._slots:
+                self._slots[thread] = len(self._slots) + 1
+            return self._slots[thread]
+
+    def in_transaction(self, execute: Callable[[str, Sequence[Any]], Any], inserted: int):
+        """
+        Add a batch's inserts to the counter inside the writer's transaction
+        (counter mode only; call before the writer commits)
+
+        Args:
+            execute: Runs (query, params) on the writer's connection, e.g.
+                cursor.execute
+            inserted: Rows the batch inserted
+        """
+        if self.mode == 'counter' and inserted:
+            execute(INCREMENT_QUERY, (self.table, self._slot(), inserted))
+
+    def committed(self, inserted: int):
+        """Record a committed batch's inserts (the in-run delta of estimate mode)"""
+        if inserted:
+            with self._lock:
+                self._inserted += inserted
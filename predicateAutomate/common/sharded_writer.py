@@ -0,0 +1,66 @@
+import logging
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+
+class ShardedWriter:
+    """
+    Fans each batch out across N writers, each with its own DB connection
+
+    Rows are assigned to a shard by crc32 of a shard key (e.g.
+    registration_number), so every row of a given key is always written by
+    the same writer and no two writers ever touch the same row. Within a
+    shard, rows are sorted by a deterministic key so concurrent upserts take
+    index locks in a consistent order and cannot deadlock.
+
+    A writer is any object with write_batch(records) -> stats dict and
+    close(); mappers pass independent copies of themselves. write_batch()
+    here has the same signature, so a ShardedWriter can stand in for a
+    single mapper.
+    """
+
+    def __init__(self, writers: Sequence[Any], shard_key: Callable[[Any], Optional[str]],
+                 sort_key: Callable[[Any], Any]):
+        self.writers = list(writers)
+        self.shard_key = shard_key
+        self.sort_key = sort_key
+        self._executor = ThreadPoolExecutor(
+            max_workers=len(self.writers), thread_name_prefix='db-writer'
+        )
+
+    def shard_of(self, record: Any) -> int:
+        """Writer index for a record"""
+        key = self.shard_key(record)
+        return zlib.crc32(('' if key is None else str(key)).encode('utf-8')) % len(self.writers)
+
+    def write_batch(self, records: List[Any]) -> Dict[str, int]:
+        """
+        Split a batch by shard, write all shards in parallel and wait for them
+
+        Returns:
+            Stats dicts of all shards summed key by key
+        """
+        shards: List[List[Any]] = [[] for _ in self.writers]
+        for record in records:
+            shards[self.shard_of(record)].append(record)
+
+        futures = [
+            self._executor.submit(writer.write_batch, sorted(shard, key=self.sort_key))
+            for writer, shard in zip(self.writers, shards)
+            if shard
+        ]
+
+        totals: Dict[str, int] = {}
+        for future in futures:
+            for name, value in future.result().items():
+                totals[name] = totals.get(name, 0) + value
+        return totals
+
+    def close(self):
+        """Stop the writer threads and release every writer's connection"""
+        self._executor.shutdown(wait=True)
+        for writer in self.writers:
+            writer.close()
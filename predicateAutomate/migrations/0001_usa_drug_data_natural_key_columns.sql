@@ -0,0 +1,41 @@
+-- migrate:no-transaction
+-- natural_key: md5 of (registration_number, product_name, submission_type,
+-- submission_number, submission_date, strength) joined by \x1f with NULL as
+-- \x1e, the same value the mapper's transform_record computes. Existing rows
+-- are filled in id ranges of 10000, each committed on its own, so the table
+-- is never rewritten in one long transaction and a rerun continues where an
+-- interrupted fill stopped. `python db_mapper.py backfill-natural-keys` does
+-- the same fill and can run ahead of the migration.
+-- row_fingerprint: md5 over the mapped columns and json_data. Rows without
+-- one are refreshed on the next load.
+ALTER TABLE source.usa_drug_data ADD COLUMN IF NOT EXISTS natural_key UUID;
+
+ALTER TABLE source.usa_drug_data ADD COLUMN IF NOT EXISTS row_fingerprint UUID;
+
+DO $$
+DECLARE
+    next_id BIGINT;
+    last_id BIGINT;
+BEGIN
+    SELECT min(id), max(id) INTO next_id, last_id
+    FROM source.usa_drug_data
+    WHERE natural_key IS NULL;
+
+    WHILE next_id <= last_id LOOP
+        UPDATE source.usa_drug_data
+        SET natural_key = md5(concat_ws(E'\x1f',
+            coalesce(registration_number, E'\x1e'),
+            coalesce(product_name, E'\x1e'),
+            coalesce(submission_type, E'\x1e'),
+            coalesce(submission_number, E'\x1e'),
+            coalesce(to_char(submission_date, 'YYYY-MM-DD'), E'\x1e'),
+            coalesce(strength, E'\x1e')
+        ))::uuid
+        WHERE id >= next_id AND id < next_id + 10000 AND natural_key IS NULL;
+        COMMIT;
+        next_id := next_id + 10000;
+    END LOOP;
+END $$;
+
+-- The wide six-column key is replaced by the unique index on natural_key (0005)
+ALTER TABLE source.usa_drug_data DROP CONSTRAINT IF EXISTS uq_usa_drug_data_record;
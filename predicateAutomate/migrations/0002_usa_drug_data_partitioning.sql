@@ -0,0 +1,103 @@
+-- migrate:no-transaction
+-- Converts the unpartitioned source.usa_drug_data (all USA rows,
+-- country_of_origin = 1) into partition usa_drug_data_p1 of a parent
+-- partitioned by LIST (country_of_origin), without rebuilding its indexes
+-- under an exclusive lock:
+--   1. the partition bound and the new foreign key are added NOT VALID and
+--      validated, which scans the table while reads and writes go on;
+--   2. the conversion itself only renames and attaches, so it holds its
+--      exclusive lock for a catalog update;
+--   3. the existing lookup indexes become the partition's indexes of parent
+--      indexes created ON ONLY, and the key the parent needs is built
+--      CONCURRENTLY on the partition and attached.
+-- Fails (and changes nothing) if any row has a NULL or other
+-- country_of_origin. A table that is already partitioned is left as it is.
+DO $$
+BEGIN
+    IF (SELECT relkind FROM pg_class WHERE oid = 'source.usa_drug_data'::regclass) = 'r'
+       AND NOT EXISTS (SELECT 1 FROM pg_constraint
+                       WHERE conrelid = 'source.usa_drug_data'::regclass
+                         AND conname = 'usa_drug_data_p1_bound') THEN
+        ALTER TABLE source.usa_drug_data
+            ADD CONSTRAINT usa_drug_data_p1_bound CHECK (country_of_origin IS NOT NULL AND country_of_origin = 1) NOT VALID;
+        ALTER TABLE source.usa_drug_data
+            ADD CONSTRAINT usa_drug_data_p1_country_of_origin_fkey
+            FOREIGN KEY (country_of_origin) REFERENCES public.country (id) ON UPDATE CASCADE NOT VALID;
+    END IF;
+END $$;
+
+DO $$
+BEGIN
+    IF (SELECT relkind FROM pg_class WHERE oid = 'source.usa_drug_data'::regclass) = 'r' THEN
+        ALTER TABLE source.usa_drug_data VALIDATE CONSTRAINT usa_drug_data_p1_bound;
+        ALTER TABLE source.usa_drug_data VALIDATE CONSTRAINT usa_drug_data_p1_country_of_origin_fkey;
+    END IF;
+END $$;
+
+-- The validated CHECK lets SET NOT NULL and ATTACH PARTITION skip their
+-- scans, and the validated foreign key is adopted by the parent's
+DO $$
+BEGIN
+    IF (SELECT relkind FROM pg_class WHERE oid = 'source.usa_drug_data'::regclass) = 'r' THEN
+        ALTER TABLE source.usa_drug_data RENAME TO usa_drug_data_p1;
+        ALTER TABLE source.usa_drug_data_p1 DROP CONSTRAINT IF EXISTS usa_drug_data_pkey;
+        ALTER TABLE source.usa_drug_data_p1 DROP CONSTRAINT IF EXISTS usa_drug_data_country_of_origin_fkey;
+        ALTER TABLE source.usa_drug_data_p1 DROP CONSTRAINT IF EXISTS uq_usa_drug_data_record;
+        DROP INDEX IF EXISTS source.uq_usa_drug_data_natural_key;
+        ALTER INDEX IF EXISTS source.idx_usa_drug_data_product_name RENAME TO usa_drug_data_p1_product_name_idx;
+        ALTER INDEX IF EXISTS source.idx_usa_drug_data_country_of_origin RENAME TO usa_drug_data_p1_country_of_origin_idx;
+        ALTER INDEX IF EXISTS source.idx_usa_drug_data_reg_holder RENAME TO usa_drug_data_p1_registration_holder_idx;
+        ALTER INDEX IF EXISTS source.idx_usa_drug_data_manufacturer RENAME TO usa_drug_data_p1_manufacturer_idx;
+        ALTER INDEX IF EXISTS source.idx_usa_drug_data_generic_name RENAME TO usa_drug_data_p1_generic_name_idx;
+        ALTER TABLE source.usa_drug_data_p1 ALTER COLUMN country_of_origin SET NOT NULL;
+
+        CREATE TABLE source.usa_drug_data (
+            LIKE source.usa_drug_data_p1 INCLUDING DEFAULTS
+        ) PARTITION BY LIST (country_of_origin);
+        ALTER TABLE source.usa_drug_data
+            ADD FOREIGN KEY (country_of_origin) REFERENCES public.country (id) ON UPDATE CASCADE;
+        ALTER SEQUENCE source.usa_drug_data_id_seq OWNED BY source.usa_drug_data.id;
+        ALTER TABLE source.usa_drug_data ATTACH PARTITION source.usa_drug_data_p1 FOR VALUES IN (1);
+    END IF;
+END $$;
+
+CREATE TABLE IF NOT EXISTS source.usa_drug_data_p1 PARTITION OF source.usa_drug_data FOR VALUES IN (1);
+
+-- Only partition indexes the legacy table did not have are built; the
+-- others already exist under these names
+CREATE INDEX CONCURRENTLY IF NOT EXISTS usa_drug_data_p1_product_name_idx ON source.usa_drug_data_p1(product_name);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS usa_drug_data_p1_country_of_origin_idx ON source.usa_drug_data_p1(country_of_origin);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS usa_drug_data_p1_registration_holder_idx ON source.usa_drug_data_p1(registration_holder);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS usa_drug_data_p1_manufacturer_idx ON source.usa_drug_data_p1(manufacturer);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS usa_drug_data_p1_generic_name_idx ON source.usa_drug_data_p1(generic_name);
+
+CREATE INDEX IF NOT EXISTS idx_usa_drug_data_product_name ON ONLY source.usa_drug_data(product_name);
+CREATE INDEX IF NOT EXISTS idx_usa_drug_data_country_of_origin ON ONLY source.usa_drug_data(country_of_origin);
+CREATE INDEX IF NOT EXISTS idx_usa_drug_data_reg_holder ON ONLY source.usa_drug_data(registration_holder);
+CREATE INDEX IF NOT EXISTS idx_usa_drug_data_manufacturer ON ONLY source.usa_drug_data(manufacturer);
+CREATE INDEX IF NOT EXISTS idx_usa_drug_data_generic_name ON ONLY source.usa_drug_data(generic_name);
+
+-- A no-op for an index that is already attached
+ALTER INDEX source.idx_usa_drug_data_product_name ATTACH PARTITION source.usa_drug_data_p1_product_name_idx;
+ALTER INDEX source.idx_usa_drug_data_country_of_origin ATTACH PARTITION source.usa_drug_data_p1_country_of_origin_idx;
+ALTER INDEX source.idx_usa_drug_data_reg_holder ATTACH PARTITION source.usa_drug_data_p1_registration_holder_idx;
+ALTER INDEX source.idx_usa_drug_data_manufacturer ATTACH PARTITION source.usa_drug_data_p1_manufacturer_idx;
+ALTER INDEX source.idx_usa_drug_data_generic_name ATTACH PARTITION source.usa_drug_data_p1_generic_name_idx;
+
+-- The parent's primary key must include the partition column. Its
+-- partition index is built concurrently and turned into the partition's
+-- key, which the parent's key then adopts instead of building its own.
+CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS usa_drug_data_p1_pkey ON source.usa_drug_data_p1(country_of_origin, id);
+
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_constraint
+                   WHERE conrelid = 'source.usa_drug_data_p1'::regclass AND contype = 'p') THEN
+        ALTER TABLE source.usa_drug_data_p1
+            ADD CONSTRAINT usa_drug_data_p1_pkey PRIMARY KEY USING INDEX usa_drug_data_p1_pkey;
+    END IF;
+    IF NOT EXISTS (SELECT 1 FROM pg_constraint
+                   WHERE conrelid = 'source.usa_drug_data'::regclass AND contype = 'p') THEN
+        ALTER TABLE source.usa_drug_data ADD PRIMARY KEY (country_of_origin, id);
+    END IF;
+END $$;
@@ -0,0 +1,3 @@
+-- effective_time: label version date (YYYYMMDD); when a batch holds several
+-- records for one key, the newest is kept
+ALTER TABLE source.usa_drug_label ADD COLUMN IF NOT EXISTS effective_time VARCHAR(8);
@@ -0,0 +1,131 @@
+-- Normalized drug storage (DRUG_STORAGE_MODE=normalized): one row per
+-- application, product and submission, and each distinct openfda block stored
+-- once, instead of one wide row per submission x product pair.
+CREATE TABLE IF NOT EXISTS source.usa_drug_openfda (
+    openfda_hash UUID PRIMARY KEY,
+    openfda JSONB NOT NULL,
+    spl_id TEXT[],
+    spl_set_id TEXT[],
+    generic_name VARCHAR(255),
+    manufacturer VARCHAR(255),
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS source.usa_drug_application (
+    registration_number VARCHAR(100) PRIMARY KEY,
+    country_of_origin INTEGER REFERENCES public.country (id) ON UPDATE CASCADE ON DELETE SET NULL,
+    application_type VARCHAR(100),
+    registration_holder VARCHAR(255),
+    openfda_hash UUID REFERENCES source.usa_drug_openfda (openfda_hash),
+    created_by INTEGER,
+    row_fingerprint UUID,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS source.usa_drug_product (
+    registration_number VARCHAR(100) REFERENCES source.usa_drug_application (registration_number) ON DELETE CASCADE,
+    product_number VARCHAR(20),
+    product_name VARCHAR(255),
+    ingredient_name VARCHAR(1000),
+    reference_drug VARCHAR(255),
+    dosage_form VARCHAR(255),
+    strength VARCHAR(1000),
+    route_administration VARCHAR(255),
+    marketing_status VARCHAR(100),
+    product JSONB,
+    row_fingerprint UUID,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (registration_number, product_number)
+);
+
+CREATE TABLE IF NOT EXISTS source.usa_drug_submission (
+    registration_number VARCHAR(100) REFERENCES source.usa_drug_application (registration_number) ON DELETE CASCADE,
+    submission_type VARCHAR(100),
+    submission_number VARCHAR(100),
+    submission_date DATE,
+    submission JSONB,
+    row_fingerprint UUID,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    -- Same submission columns as the wide natural key; submission_date may be
+    -- NULL, so this is a NULLS NOT DISTINCT unique key rather than a primary key
+    CONSTRAINT uq_usa_drug_submission_key
+        UNIQUE NULLS NOT DISTINCT (registration_number, submission_type, submission_number, submission_date)
+);
+
+-- Tables created before submission_date joined the key
+DO $$
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1 FROM pg_constraint
+        WHERE conname = 'uq_usa_drug_submission_key'
+    ) THEN
+        ALTER TABLE source.usa_drug_submission DROP CONSTRAINT IF EXISTS usa_drug_submission_pkey;
+        ALTER TABLE source.usa_drug_submission
+        ADD CONSTRAINT uq_usa_drug_submission_key
+            UNIQUE NULLS NOT DISTINCT (registration_number, submission_type, submission_number, submission_date);
+    END IF;
+END $$;
+
+CREATE INDEX IF NOT EXISTS idx_usa_drug_application_openfda_hash ON source.usa_drug_application(openfda_hash);
+CREATE INDEX IF NOT EXISTS idx_usa_drug_application_reg_holder ON source.usa_drug_application(registration_holder);
+CREATE INDEX IF NOT EXISTS idx_usa_drug_product_product_name ON source.usa_drug_product(product_name);
+CREATE INDEX IF NOT EXISTS idx_usa_drug_openfda_generic_name ON source.usa_drug_openfda(generic_name);
+CREATE INDEX IF NOT EXISTS idx_usa_drug_openfda_manufacturer ON source.usa_drug_openfda(manufacturer);
+
+-- Same columns as source.usa_drug_data (except row_fingerprint), rebuilt
+-- from the normalized tables: one row per submission x product.
+-- id is the first 64 bits of natural_key, so it is stable across reloads.
+-- retired_at is always NULL: reconciliation only runs on the wide table.
+-- id and retired_at come last so CREATE OR REPLACE can add them to an
+-- existing view.
+CREATE OR REPLACE VIEW source.usa_drug_data_normalized AS
+SELECT
+    o.spl_id,
+    o.spl_set_id,
+    p.ingredient_name,
+    p.product_name,
+    a.country_of_origin,
+    a.application_type,
+    a.registration_number,
+    a.registration_holder,
+    o.manufacturer,
+    o.generic_name,
+    p.reference_drug,
+    p.dosage_form,
+    p.strength,
+    p.route_administration,
+    p.marketing_status,
+    s.submission_type,
+    s.submission_number,
+    s.submission_date,
+    jsonb_build_object(
+        'application_number', a.registration_number,
+        'product_number', p.product_number,
+        'submission', s.submission,
+        'product', p.product,
+        'openfda', o.openfda,
+        'sponsor_name', a.registration_holder
+    ) AS json_data,
+    GREATEST(a.created_at, p.created_at, s.created_at) AS created_at,
+    GREATEST(a.updated_at, p.updated_at, s.updated_at) AS updated_at,
+    a.created_by,
+    k.key_md5::uuid AS natural_key,
+    ('x' || left(k.key_md5, 16))::bit(64)::bigint AS id,
+    NULL::timestamp AS retired_at
+FROM source.usa_drug_application a
+JOIN source.usa_drug_product p ON p.registration_number = a.registration_number
+JOIN source.usa_drug_submission s ON s.registration_number = a.registration_number
+LEFT JOIN source.usa_drug_openfda o ON o.openfda_hash = a.openfda_hash
+CROSS JOIN LATERAL (
+    SELECT md5(concat_ws(E'\x1f',
+        coalesce(a.registration_number, E'\x1e'),
+        coalesce(p.product_name, E'\x1e'),
+        coalesce(s.submission_type, E'\x1e'),
+        coalesce(s.submission_number, E'\x1e'),
+        coalesce(to_char(s.submission_date, 'YYYY-MM-DD'), E'\x1e'),
+        coalesce(p.strength, E'\x1e')
+    )) AS key_md5
+) k;
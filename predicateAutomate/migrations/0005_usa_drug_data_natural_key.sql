@@ -0,0 +1,39 @@
+-- migrate:no-transaction
+-- Unique natural key of source.usa_drug_data: the ON CONFLICT target of every
+-- drug write. CREATE INDEX CONCURRENTLY is not supported on a partitioned
+-- table, so the parent index is created ON ONLY (a catalog entry, invalid
+-- until every partition has its index), the partition's index is built
+-- concurrently and then attached. Partitions created later get the index
+-- from the parent automatically.
+--
+-- Rows loaded before natural_key existed can share one: the old lookup
+-- also matched on dosage_form. Only the most recently updated row of each
+-- key is kept, as a load would have left it; otherwise the build fails and
+-- leaves an invalid index.
+DELETE FROM source.usa_drug_data d
+USING (
+    SELECT country_of_origin, id, row_number() OVER (
+        PARTITION BY country_of_origin, natural_key
+        ORDER BY updated_at DESC NULLS LAST, id DESC
+    ) AS newest
+    FROM source.usa_drug_data
+    WHERE (country_of_origin, natural_key) IN (
+        SELECT country_of_origin, natural_key
+        FROM source.usa_drug_data
+        WHERE natural_key IS NOT NULL
+        GROUP BY country_of_origin, natural_key
+        HAVING count(*) > 1
+    )
+) ranked
+WHERE d.country_of_origin = ranked.country_of_origin
+  AND d.id = ranked.id
+  AND ranked.newest > 1;
+
+CREATE UNIQUE INDEX IF NOT EXISTS uq_usa_drug_data_natural_key
+    ON ONLY source.usa_drug_data (country_of_origin, natural_key);
+
+CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS usa_drug_data_p1_country_of_origin_natural_key_idx
+    ON source.usa_drug_data_p1 (country_of_origin, natural_key);
+
+ALTER INDEX source.uq_usa_drug_data_natural_key
+    ATTACH PARTITION source.usa_drug_data_p1_country_of_origin_natural_key_idx;
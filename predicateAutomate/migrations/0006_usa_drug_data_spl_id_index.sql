@@ -0,0 +1,11 @@
+-- migrate:no-transaction
+-- GIN index so label lookups by SPL id (spl_id @> ARRAY[...]) do not scan the
+-- table. Built per partition as in 0005.
+CREATE INDEX IF NOT EXISTS idx_usa_drug_data_spl_id
+    ON ONLY source.usa_drug_data USING GIN (spl_id);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS usa_drug_data_p1_spl_id_idx
+    ON source.usa_drug_data_p1 USING GIN (spl_id);
+
+ALTER INDEX source.idx_usa_drug_data_spl_id
+    ATTACH PARTITION source.usa_drug_data_p1_spl_id_idx;
@@ -0,0 +1,9 @@
+-- migrate:no-transaction
+-- Unique key of source.usa_drug_label, the ON CONFLICT target of the label
+-- upsert. A unique index serves ON CONFLICT just like the constraint in
+-- schema.sql (same name, so either one satisfies IF NOT EXISTS). The old
+-- (spl_id, spl_set_id) index is a prefix of it and only slows writes.
+CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS uk_usa_drug_label_spl_ids
+    ON source.usa_drug_label (spl_id, spl_set_id, registration_number);
+
+DROP INDEX CONCURRENTLY IF EXISTS source.idx_usa_drug_label_spl_ids;
@@ -0,0 +1,12 @@
+-- Exact row counts for ROW_COUNT_MODE=counter. Slot 0 holds a table's
+-- seeded COUNT(*); each writer thread adds its batches' inserts to its own
+-- slot in the batch's transaction, so parallel writers never update the same
+-- row, and a read sums the slots. A table without a slot 0 row is seeded with
+-- one COUNT(*) on the next read, so deleting its rows forces a recount.
+CREATE TABLE IF NOT EXISTS source.table_row_counts (
+    table_name VARCHAR(255) NOT NULL,
+    slot INTEGER NOT NULL,
+    row_count BIGINT NOT NULL,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (table_name, slot)
+);
@@ -0,0 +1,15 @@
+-- migrate:no-transaction
+-- retired_at: set by reconciliation when an entry disappears from the FDA
+-- export, cleared when it comes back. Adding a nullable column without a
+-- default is a catalog-only change. The partial index keeps retired rows
+-- cheap to list without indexing the active ones.
+ALTER TABLE source.usa_drug_data ADD COLUMN IF NOT EXISTS retired_at TIMESTAMP;
+
+CREATE INDEX IF NOT EXISTS idx_usa_drug_data_retired_at
+    ON ONLY source.usa_drug_data (retired_at) WHERE retired_at IS NOT NULL;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS usa_drug_data_p1_retired_at_idx
+    ON source.usa_drug_data_p1 (retired_at) WHERE retired_at IS NOT NULL;
+
+ALTER INDEX source.idx_usa_drug_data_retired_at
+    ATTACH PARTITION source.usa_drug_data_p1_retired_at_idx;
@@ -2,22 +2,60 @@ echo "==================================================================="
 echo "Database Insertion Monitor"
 echo "==================================================================="
 echo ""
-echo "Initial count from logs: 168,845"
-echo "Target: Processing 26,000 FDA records (actual DB entries will be higher due to submissions×products)"
+
+# Reads cheap counts instead of a COUNT(*) every few seconds, which would
+# sequentially scan the table and compete with the load:
+#   ROW_COUNT_MODE=estimate  pg_class.reltuples scaled to the table's current size
+#   ROW_COUNT_MODE=counter   exact count from source.table_row_counts; only the
+#                            tables the mappers write (source.usa_drug_data_p1,
+#                            source.usa_drug_label, ...) are counted there, so
+#                            other tables fall back to the estimate
+TABLE=${MONITOR_TABLE:-drug.drug_predicate_assessments}
+MODE=${ROW_COUNT_MODE:-estimate}
+INTERVAL=${MONITOR_INTERVAL:-10}
+PSQL="psql -h ${PG_HOST:-localhost} -p ${PG_PORT:-5432} -U ${PG_USER:-postgres} -d ${PG_DATABASE:-quriousri_db} -t -A"
+
+COUNTER_QUERY="SELECT SUM(row_count) FROM source.table_row_counts WHERE table_name = '$TABLE'
+    HAVING bool_or(slot = 0);"
+ESTIMATE_QUERY="SELECT CASE WHEN c.reltuples < 0 OR c.relpages = 0 THEN COALESCE(s.n_live_tup, 0)
+    ELSE c.reltuples / c.relpages * (pg_relation_size(c.oid) / current_setting('block_size')::int) END::bigint
+    FROM pg_class c LEFT JOIN pg_stat_user_tables s ON s.relid = c.oid
+    WHERE c.oid = to_regclass('$TABLE');"
+
+if [ "$MODE" = "counter" ]; then
+    COUNT_QUERY=$COUNTER_QUERY
+    if [ -z "$($PSQL -c "$COUNT_QUERY" 2>/dev/null | xargs)" ]; then
+        echo "Note: no maintained counter for $TABLE, using the estimate instead"
+        MODE=estimate
+    fi
+fi
+if [ "$MODE" != "counter" ]; then
+    MODE=estimate
+    COUNT_QUERY=$ESTIMATE_QUERY
+fi
+
+initial_count=$($PSQL -c "$COUNT_QUERY" 2>/dev/null | xargs)
+if [ -z "$initial_count" ]; then
+    echo "Error: Could not read the $MODE count of $TABLE"
+    exit 1
+fi
+
+echo "Table: $TABLE ($MODE count)"
+echo "Initial count: $initial_count"
 echo ""
 echo "Press Ctrl+C to stop monitoring"
 echo ""
 
 while true; do
-    current_count=$(psql -h localhost -U postgres -d quriousri_db -t -c "SELECT COUNT(*) FROM drug.drug_predicate_assessments;" 2>/dev/null | xargs)
-    
+    current_count=$($PSQL -c "$COUNT_QUERY" 2>/dev/null | xargs)
+
     if [ -n "$current_count" ]; then
-        inserted=$((current_count - 168845))
+        inserted=$((current_count - initial_count))
         timestamp=$(date '+%Y-%m-%d %H:%M:%S')
         echo "[$timestamp] Current count: $current_count | Inserted: $inserted new records"
     else
         echo "Error: Could not query database"
     fi
-    
-    sleep 10
+
+    sleep "$INTERVAL"
 done
@@ -7,11 +7,29 @@ class Config:
     """Configuration class for USA FDA Drug fetcher"""
     FDA_BULK_DOWNLOAD_URL = "https://download.open.fda.gov/drug/drugsfda/drug-drugsfda-0001-of-0001.json.zip"
     FDA_LABEL_BASE_URL = 'https://download.open.fda.gov/drug/label/'
+    FDA_DOWNLOAD_MANIFEST_URL = 'https://api.fda.gov/download.json'
+    FDA_MANIFEST_FILE = os.getenv('FDA_MANIFEST_FILE')  # Serve the manifest from a local file (tests/offline)
     FDA_API_BASE_URL = "https://api.fda.gov/drug/drugsfda.json"
     BATCH_SIZE = 1000
+    BATCH_MAX_BYTES = int(os.getenv('BATCH_MAX_BYTES', str(16 * 1024 * 1024)))  # Flush a DB batch early once its payload reaches this size
+    BATCH_MAX_SECONDS = float(os.getenv('BATCH_MAX_SECONDS', '30'))  # Flush a DB batch whose oldest row has waited this long (0 = never)
+    LOAD_MODE = os.getenv('LOAD_MODE', 'batch')  # 'batch' (INSERT ... ON CONFLICT) or 'copy' (COPY into staging + merge)
+    COUNTRY_OF_ORIGIN = 1  # public.country id of the USA; selects the source.usa_drug_data partition
+    DRUG_STORAGE_MODE = os.getenv('DRUG_STORAGE_MODE', 'wide')  # 'wide' (source.usa_drug_data) or 'normalized' (application/product/submission/openfda tables)
+    NATURAL_KEY_INDEX = os.getenv('NATURAL_KEY_INDEX', 'true').lower() in ('1', 'true', 'yes')  # Preload existing natural keys to skip duplicates locally (batch mode)
+    RECONCILE = os.getenv('RECONCILE', 'true').lower() in ('1', 'true', 'yes')  # Full (non-trial) batch loads: merge-join the export against stored keys and retire withdrawn entries
+    RECONCILE_SORT_ROWS = int(os.getenv('RECONCILE_SORT_ROWS', '50000'))  # Entries sorted in memory per external-sort run file
+    DB_WRITE_MODE = os.getenv('DB_WRITE_MODE', 'standard')  # Batch-mode drug upserts: 'standard' (psycopg2), 'prepared' (psycopg2, PREPAREd fixed-width statements) or 'pipeline' (psycopg 3 libpq pipeline mode)
+    DB_PIPELINE_STATEMENT_ROWS = int(os.getenv('DB_PIPELINE_STATEMENT_ROWS', '100'))  # Rows per upsert statement in pipeline write mode
+    DB_PREPARED_STATEMENT_ROWS = int(os.getenv('DB_PREPARED_STATEMENT_ROWS', '100'))  # Rows per PREPAREd upsert statement in prepared write mode
+    DB_WRITERS = int(os.getenv('DB_WRITERS', '1'))  # Parallel DB writer connections; batches are sharded by registration number (spl_set_id for labels)
+    ROW_COUNT_MODE = os.getenv('ROW_COUNT_MODE', 'estimate')  # Before/after table counts: 'estimate' (pg_class + run inserts), 'counter' (exact, source.table_row_counts) or 'scan' (COUNT(*))
     MAX_RETRIES = 3
     RETRY_DELAY = 2  
     REQUEST_TIMEOUT = 300 
+    LABEL_DOWNLOAD_WORKERS = int(os.getenv('LABEL_DOWNLOAD_WORKERS', '4'))  # Concurrent label part downloads
+    PIPELINE_QUEUE_SIZE = int(os.getenv('PIPELINE_QUEUE_SIZE', '4'))  # Batches buffered between pipeline stages
+    LABEL_PARSE_PROCESSES = int(os.getenv('LABEL_PARSE_PROCESSES', str(os.cpu_count() or 1)))  # Label parse/transform worker processes; 0 = parse in-thread
     FDA_MAX_SKIP = 25000 
     TRIAL_LIMIT = 0  
     DB_HOST = os.getenv('PG_HOST', 'localhost')
@@ -23,6 +41,13 @@ class Config:
     OUTPUT_DIR = os.path.join(os.path.dirname(__file__), 'output')
     RAW_DATA_FILE = os.path.join(OUTPUT_DIR, 'fda_drugs_raw.json')
     PROCESSED_DATA_FILE = os.path.join(OUTPUT_DIR, 'fda_drugs_processed.json')
+    DOWNLOAD_STATE_FILE = os.path.join(OUTPUT_DIR, 'download_validators.json')
+    MANIFEST_CACHE_FILE = os.path.join(OUTPUT_DIR, 'download_manifest.json')
+    LABEL_REJECT_FILE = os.path.join(OUTPUT_DIR, 'usa_drug_label_rejects.jsonl')  # Label rows the database refused, with their error
+    
+    # Skip modules whose openFDA export has not changed since the last successful run
+    FORCE_DOWNLOAD = os.getenv('FORCE_DOWNLOAD', 'false').lower() in ('1', 'true', 'yes')
+    SOURCE_UNCHANGED_EXIT_CODE = 3  # Must match SOURCE_UNCHANGED in app.py
     
     LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
     
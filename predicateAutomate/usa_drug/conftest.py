@@ -0,0 +1,9 @@
+import os
+import sys
+
+# Tests import the module files directly (as main.py does) and the shared
+# package from predicateAutomate/common
+_HERE = os.path.dirname(os.path.abspath(__file__))
+for path in (_HERE, os.path.dirname(_HERE)):
+    if path not in sys.path:
+        sys.path.insert(0, path)
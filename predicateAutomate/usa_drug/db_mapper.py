@@ -2,45 +2,175 @@ import psycopg2
 import psycopg2.extras
 import json
 import logging
-from datetime import datetime
-from typing import List, Dict, Optional, Tuple
+import sys
+from typing import Iterable, Iterator, List, Dict, Optional, Tuple
 from config import Config
+from common.batching import BatchAccumulator, estimate_size
+from common.db import DBSession, prepared_statement_stats, register_statement
+from common.external_sort import ExternalSorter
+from common.migrations import verify_indexes
+from common.partitions import ensure_list_partition, partition_name
+from common.pg_pipeline import PipelineSession
+from common.row_counts import RowCounter
+from key_index import NaturalKeyIndex, content_fingerprint, natural_key, natural_key_sql
+from pg_copy import CopyStream
+from reconcile import RETIRE, UNCHANGED, iter_snapshot, merge_join, sort_snapshot, stream_stored_keys
+from common.sharded_writer import ShardedWriter
 
 logger = logging.getLogger(__name__)
 
 
 class FDADrugDBMapper:
     """Maps FDA drug data to source.usa_drug_data table"""
+
+    # Partitioned by LIST (country_of_origin); bulk writes go straight to this
+    # country's partition
+    TABLE = 'source.usa_drug_data'
+
+    # Indexes the writes rely on (ON CONFLICT target; the retired_at index
+    # also stands for the column the upserts reset); created by migrations
+    REQUIRED_INDEXES = ('source.uq_usa_drug_data_natural_key', 'source.idx_usa_drug_data_retired_at')
+
+    # Columns streamed into the COPY staging table, in COPY order
+    STAGE_COLUMNS = (
+        'country_of_origin',
+        'product_name',
+        'ingredient_name',
+        'registration_number',
+        'registration_holder',
+        'manufacturer',
+        'generic_name',
+        'reference_drug',
+        'dosage_form',
+        'strength',
+        'route_administration',
+        'marketing_status',
+        'application_type',
+        'submission_type',
+        'submission_number',
+        'submission_date',
+        'json_data',
+        'spl_id',
+        'spl_set_id',
+        'created_by',
+        'natural_key',
+        'row_fingerprint',
+    )
+
+    # Mapped columns covered by row_fingerprint (together with json_data's content)
+    FINGERPRINT_COLUMNS = tuple(
+        c for c in STAGE_COLUMNS
+        if c not in ('json_data', 'created_by', 'natural_key', 'row_fingerprint')
+    )
+
+    # Columns rewritten when an existing row's fingerprint changed (not the
+    # conflict key, which includes the partition column)
+    UPDATE_COLUMNS = tuple(
+        c for c in STAGE_COLUMNS
+        if c not in ('created_by', 'natural_key', 'country_of_origin')
+    )
+
+    NATURAL_KEY_COLUMNS = (
+        'registration_number',
+        'product_name',
+        'submission_type',
+        'submission_number',
+        'submission_date',
+        'strength',
+    )
+
+    # natural_key computed inside PostgreSQL, identical to transform_record's value
+    NATURAL_KEY_SQL = natural_key_sql([
+        'registration_number',
+        'product_name',
+        'submission_type',
+        'submission_number',
+        "to_char(submission_date, 'YYYY-MM-DD')",
+        'strength',
+    ])
+
+    # Placeholder casts for fixed-width upserts (psycopg 3 binds parameters
+    # server-side and PREPARE infers parameter types from the statement, so
+    # non-text columns are cast explicitly)
+    PARAM_CASTS = {
+        'submission_date': '::date',
+        'json_data': '::jsonb',
+        'spl_id': '::text[]',
+        'spl_set_id': '::text[]',
+        'natural_key': '::uuid',
+        'row_fingerprint': '::uuid',
+    }
+
+    # Raw records between progress log lines
+    PROGRESS_INTERVAL = 1000
     
-    def __init__(self):
-        self.conn = None
-        self.cursor = None
+    def __init__(self, batch_size=Config.BATCH_SIZE, load_mode=Config.LOAD_MODE,
+                 use_key_index=Config.NATURAL_KEY_INDEX, write_mode=Config.DB_WRITE_MODE):
+        self.db = DBSession(bulk=True)
+        self.batch_size = batch_size
+        self.load_mode = load_mode
+        self.write_mode = write_mode
+        self.pipeline_db = PipelineSession() if write_mode == 'pipeline' else None
+        self.partition = partition_name(self.TABLE, Config.COUNTRY_OF_ORIGIN)
+        # Retired rows are left out so an entry that reappears is rewritten
+        self.key_index = NaturalKeyIndex(self.partition, where='retired_at IS NULL') if use_key_index else None
+        self.row_counter = RowCounter(self.partition, Config.ROW_COUNT_MODE)
+        # Prepared statement names are per partition, e.g. usa_drug_data_p1_retire
+        statement_prefix = self.partition.split('.')[-1]
+        self.retire_statement = register_statement(
+            f"{statement_prefix}_retire",
+            f"""
+            UPDATE {self.partition}
+            SET retired_at = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP
+            WHERE country_of_origin = %s
+            AND natural_key = ANY(%s::uuid[])
+            AND retired_at IS NULL
+            """,
+            # psycopg2 sends the key list as ARRAY['...'] (text[]); the query casts it
+            types=('integer', 'text[]')
+        )
+        self.upsert_statement = None
+        self.prepared_statement_rows = Config.DB_PREPARED_STATEMENT_ROWS
+        if write_mode == 'prepared':
+            rows = self.prepared_statement_rows
+            self.upsert_statement = register_statement(
+                f"{statement_prefix}_upsert_{rows}", self._upsert_query(rows)
+            )
+        
+    @property
+    def conn(self):
+        """Pooled connection, checked out on first use"""
+        return self.db.conn
+
+    @property
+    def cursor(self):
+        return self.db.cursor
         
     def connect(self):
-        """Establish database connection"""
-        try:
-            self.conn = psycopg2.connect(
-                host=Config.DB_HOST,
-                port=Config.DB_PORT,
-                database=Config.DB_NAME,
-                user=Config.DB_USER,
-                password=Config.DB_PASSWORD
-            )
-            self.cursor = self.conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-            logger.info("Database connection established")
-            return True
-        except Exception as e:
-            logger.error(f"Failed to connect to database: {e}")
+        """
+        Verify the database is reachable (the connection itself is checked out
+        lazily) and that REQUIRED_INDEXES exist
+        """
+        if not self.db.check():
+            return False
+        required = self.REQUIRED_INDEXES + self.row_counter.required_indexes
+        indexes_ok = verify_indexes(self.cursor, required, type(self).__name__)
+        self.db.rollback()
+        if not indexes_ok:
             return False
+        logger.info("Database connection established")
+        return True
     
     def close(self):
-        """Close database connection"""
-        if self.cursor:
-            self.cursor.close()
-        if self.conn:
-            self.conn.close()
-        logger.info("Database connection closed")
-    
+        """Return the connection to the pool"""
+        self.db.release()
+        if self.pipeline_db is not None:
+            self.pipeline_db.close()
+        used = {name: stats for name, stats in prepared_statement_stats().items() if stats['executions']}
+        if used:
+            logger.info(f"Prepared statements: {used}")
+        logger.info("Database connection returned to pool")
+
     def parse_date(self, date_str: Optional[str]) -> Optional[str]:
         """
         Parse FDA date format (YYYYMMDD) to PostgreSQL date format (YYYY-MM-DD)
@@ -128,65 +258,6 @@ class FDADrugDBMapper:
         
         return ", ".join(names)
     
-    def check_duplicate(
-        self,
-        application_number: str,
-        product_name: str,
-        submission_type: str,
-        submission_number: str,
-        submission_date: Optional[str],
-        strength: str = None,
-        dosage_form: str = None,
-    ) -> bool:
-        """
-        Check if record already exists in database based on actual table columns
-        
-        Args:
-            application_number: Application number (registration_number)
-            product_name: Product/brand name
-            submission_type: Submission type
-            submission_number: Submission number
-            submission_date: Submission date in YYYY-MM-DD
-            strength: Strength (optional for more specific matching)
-            dosage_form: Dosage form (optional for more specific matching)
-            
-        Returns:
-            True if duplicate exists, False otherwise
-        """
-        try:
-            query = """
-                SELECT COUNT(*) as count
-                FROM source.usa_drug_data
-                WHERE registration_number = %s
-                AND product_name = %s
-                AND submission_type = %s
-                AND submission_number = %s
-                AND submission_date IS NOT DISTINCT FROM %s
-            """
-            params = [
-                application_number,
-                product_name,
-                submission_type,
-                submission_number,
-                submission_date
-            ]
-            
-            if strength:
-                query += " AND strength = %s"
-                params.append(strength)
-            if dosage_form:
-                query += " AND dosage_form = %s"
-                params.append(dosage_form)
-            
-            self.cursor.execute(query, params)
-            
-            result = self.cursor.fetchone()
-            return result['count'] > 0
-            
-        except Exception as e:
-            logger.error(f"Error checking duplicate: {e}")
-            return False
-    
     def transform_record(self, fda_record: Dict, product: Dict, submission: Dict) -> Dict:
         """
         Transform FDA record to drug_predicate_assessments format
@@ -248,7 +319,7 @@ class FDADrugDBMapper:
                 application_type_value = match.group(1)
         
         record = {
-            'country_of_origin': 1,
+            'country_of_origin': Config.COUNTRY_OF_ORIGIN,
             'product_name': product.get('brand_name', ''),
             'spl_id': spl_id,
             'spl_set_id': spl_set_id,
@@ -269,22 +340,33 @@ class FDADrugDBMapper:
             'json_data': json.dumps(json_data),
             'created_by': None
         }
+        record['natural_key'] = natural_key([record[c] for c in self.NATURAL_KEY_COLUMNS])
+        record['row_fingerprint'] = content_fingerprint(
+            [record[c] for c in self.FINGERPRINT_COLUMNS] + [json_data]
+        )
         
         return record
     
-    def upsert_record(self, record: Dict) -> Optional[Tuple[int, bool]]:
-        """Insert a record into source.usa_drug_data if it does not already exist.
-
-        Returns (record_id, True) when inserted, (record_id, False) when an existing
-        row is detected, or None on failure.
+    def batch_upsert_records(self, records: List[Dict]) -> Dict:
         """
+        Batch upsert records using PostgreSQL's ON CONFLICT clause
 
-        payload = record.copy()
-        payload['spl_id'] = payload.get('spl_id') or []
-        payload['spl_set_id'] = payload.get('spl_set_id') or []
+        Rows are matched on natural_key (a hash of registration_number,
+        product_name, submission_type, submission_number, submission_date and
+        strength). An existing row is rewritten only when its row_fingerprint
+        differs, i.e. when FDA changed a mapped column or the JSON payload.
+
+        Args:
+            records: List of transformed records
+
+        Returns:
+            Dict with inserted, updated and unchanged counts
+        """
+        if not records:
+            return {'inserted': 0, 'updated': 0, 'unchanged': 0}
 
         insert_query = """
-            INSERT INTO source.usa_drug_data (
+            INSERT INTO {table} AS target (
                 country_of_origin,
                 product_name,
                 ingredient_name,
@@ -306,181 +388,670 @@ class FDADrugDBMapper:
                 updated_at,
                 spl_id,
                 spl_set_id,
-                created_by
-            ) VALUES (
-                %(country_of_origin)s,
-                %(product_name)s,
-                %(ingredient_name)s,
-                %(registration_number)s,
-                %(registration_holder)s,
-                %(manufacturer)s,
-                %(generic_name)s,
-                %(reference_drug)s,
-                %(dosage_form)s,
-                %(strength)s,
-                %(route_administration)s,
-                %(marketing_status)s,
-                %(application_type)s,
-                %(submission_type)s,
-                %(submission_number)s,
-                %(submission_date)s,
-                %(json_data)s::jsonb,
-                CURRENT_TIMESTAMP,
-                CURRENT_TIMESTAMP,
-                %(spl_id)s,
-                %(spl_set_id)s,
-                %(created_by)s
+                created_by,
+                natural_key,
+                row_fingerprint
+            ) VALUES %s
+            ON CONFLICT (country_of_origin, natural_key)
+            DO UPDATE SET
+                {set_clause},
+                updated_at = CURRENT_TIMESTAMP,
+                retired_at = NULL
+            WHERE target.row_fingerprint IS DISTINCT FROM EXCLUDED.row_fingerprint
+                OR target.retired_at IS NOT NULL
+            RETURNING (xmax = 0) AS inserted
+        """.format(table=self.partition, set_clause=self._update_set_clause())
+
+        template = """(
+            %(country_of_origin)s,
+            %(product_name)s,
+            %(ingredient_name)s,
+            %(registration_number)s,
+            %(registration_holder)s,
+            %(manufacturer)s,
+            %(generic_name)s,
+            %(reference_drug)s,
+            %(dosage_form)s,
+            %(strength)s,
+            %(route_administration)s,
+            %(marketing_status)s,
+            %(application_type)s,
+            %(submission_type)s,
+            %(submission_number)s,
+            %(submission_date)s,
+            %(json_data)s::jsonb,
+            CURRENT_TIMESTAMP,
+            CURRENT_TIMESTAMP,
+            %(spl_id)s,
+            %(spl_set_id)s,
+            %(created_by)s,
+            %(natural_key)s,
+            %(row_fingerprint)s
+        )"""
+
+        # ON CONFLICT DO UPDATE cannot touch the same row twice in one
+        # statement, so keep only the last entry per natural_key
+        unique_records = {record['natural_key']: record for record in records}
+
+        payloads = []
+        for record in unique_records.values():
+            payload = record.copy()
+            payload['spl_id'] = payload.get('spl_id') or []
+            payload['spl_set_id'] = payload.get('spl_set_id') or []
+            payloads.append(payload)
+
+        results = psycopg2.extras.execute_values(
+            self.cursor,
+            insert_query,
+            payloads,
+            template=template,
+            page_size=self.batch_size,
+            fetch=True
+        )
+
+        inserted = sum(1 for result in results if result['inserted'])
+        updated = len(results) - inserted
+        return {
+            'inserted': inserted,
+            'updated': updated,
+            'unchanged': len(records) - inserted - updated,
+        }
+
+    def pipeline_upsert_records(self, records: List[Dict]) -> Dict:
+        """
+        Same upsert as batch_upsert_records, sent through libpq pipeline mode
+
+        The batch is split into statements of DB_PIPELINE_STATEMENT_ROWS rows
+        that are all sent before any result is read, so a batch costs about
+        one round trip instead of one per statement. Each statement's
+        RETURNING rows are matched back to it when the pipeline syncs. The
+        caller commits through self.pipeline_db.
+
+        Args:
+            records: List of transformed records
+
+        Returns:
+            Dict with inserted, updated and unchanged counts
+        """
+        if not records:
+            return {'inserted': 0, 'updated': 0, 'unchanged': 0}
+
+        # ON CONFLICT DO UPDATE cannot touch the same row twice in one
+        # statement, so keep only the last entry per natural_key
+        unique_records = list({record['natural_key']: record for record in records}.values())
+
+        statement_rows = Config.DB_PIPELINE_STATEMENT_ROWS
+        statements = []
+        for start in range(0, len(unique_records), statement_rows):
+            rows = unique_records[start:start + statement_rows]
+            params = []
+            for record in rows:
+                params.extend(self._param_value(record, c) for c in self.STAGE_COLUMNS)
+            statements.append((self._upsert_query(len(rows)), params))
+
+        results = self.pipeline_db.execute_pipelined(statements)
+
+        inserted = sum(1 for rows in results for row in rows if row[0])
+        updated = sum(len(rows) for rows in results) - inserted
+        return {
+            'inserted': inserted,
+            'updated': updated,
+            'unchanged': len(records) - inserted - updated,
+        }
+
+    def prepared_upsert_records(self, records: List[Dict]) -> Dict:
+        """
+        Same upsert as batch_upsert_records, run as a prepared statement
+
+        The batch is split into statements of DB_PREPARED_STATEMENT_ROWS rows.
+        Every full-width statement runs the same PREPAREd upsert by name, so
+        PostgreSQL parses and plans it once per connection instead of once per
+        statement; the shorter remainder is sent as plain SQL. The caller
+        commits.
+
+        Args:
+            records: List of transformed records
+
+        Returns:
+            Dict with inserted, updated and unchanged counts
+        """
+        if not records:
+            return {'inserted': 0, 'updated': 0, 'unchanged': 0}
+
+        # ON CONFLICT DO UPDATE cannot touch the same row twice in one
+        # statement, so keep only the last entry per natural_key
+        unique_records = list({record['natural_key']: record for record in records}.values())
+
+        statement_rows = self.prepared_statement_rows
+        results = []
+        for start in range(0, len(unique_records), statement_rows):
+            rows = unique_records[start:start + statement_rows]
+            params = []
+            for record in rows:
+                params.extend(self._param_value(record, c) for c in self.STAGE_COLUMNS)
+            if len(rows) == statement_rows:
+                self.db.execute_prepared(self.upsert_statement.name, params)
+            else:
+                self.cursor.execute(self._upsert_query(len(rows)), params)
+            results.extend(self.cursor.fetchall())
+
+        inserted = sum(1 for result in results if result['inserted'])
+        updated = len(results) - inserted
+        return {
+            'inserted': inserted,
+            'updated': updated,
+            'unchanged': len(records) - inserted - updated,
+        }
+
+    def _param_value(self, record: Dict, column: str):
+        if column in ('spl_id', 'spl_set_id'):
+            return record.get(column) or []
+        return record[column]
+
+    def _upsert_query(self, rows: int) -> str:
+        """Multi-row upsert with `rows` VALUES tuples of positional placeholders"""
+        columns = ', '.join(self.STAGE_COLUMNS)
+        row = '(' + ', '.join(
+            f"%s{self.PARAM_CASTS.get(c, '')}" for c in self.STAGE_COLUMNS
+        ) + ', CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)'
+        return f"""
+            INSERT INTO {self.partition} AS target ({columns}, created_at, updated_at)
+            VALUES {', '.join([row] * rows)}
+            ON CONFLICT (country_of_origin, natural_key)
+            DO UPDATE SET
+                {self._update_set_clause()},
+                updated_at = CURRENT_TIMESTAMP,
+                retired_at = NULL
+            WHERE target.row_fingerprint IS DISTINCT FROM EXCLUDED.row_fingerprint
+                OR target.retired_at IS NOT NULL
+            RETURNING (xmax = 0) AS inserted
+        """
+
+    def _update_set_clause(self) -> str:
+        """SET list rewriting UPDATE_COLUMNS from EXCLUDED"""
+        return ',\n                '.join(f"{c} = EXCLUDED.{c}" for c in self.UPDATE_COLUMNS)
+
+    def copy_upsert_records(self, records: Iterable[Dict]) -> Dict:
+        """
+        Stream records into a temp staging table with COPY and merge them into
+        source.usa_drug_data with a single INSERT ... ON CONFLICT DO UPDATE
+
+        Rows whose row_fingerprint matches the stored row are not rewritten.
+        The caller is responsible for committing.
+
+        Args:
+            records: Iterable of transformed records (consumed lazily)
+
+        Returns:
+            Dict with staged, inserted, updated and unchanged counts
+        """
+        columns = ', '.join(self.STAGE_COLUMNS)
+
+        self.cursor.execute(f"""
+            CREATE TEMP TABLE usa_drug_data_stage ON COMMIT DROP AS
+            SELECT {columns} FROM source.usa_drug_data WITH NO DATA
+        """)
+        # COPY numbers rows in input order, so a key staged twice keeps its
+        # last occurrence, as execute_values does
+        self.cursor.execute(
+            "ALTER TABLE usa_drug_data_stage ADD COLUMN ordinal BIGINT GENERATED ALWAYS AS IDENTITY"
+        )
+
+        stream = CopyStream(self._stage_row(record) for record in records)
+        self.cursor.copy_expert(
+            f"COPY usa_drug_data_stage ({columns}) FROM STDIN",
+            stream
+        )
+
+        self.cursor.execute(f"""
+            WITH merged AS (
+                INSERT INTO {self.partition} AS target ({columns}, created_at, updated_at)
+                SELECT DISTINCT ON (natural_key)
+                    {columns}, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP
+                FROM usa_drug_data_stage
+                ORDER BY natural_key, ordinal DESC
+                ON CONFLICT (country_of_origin, natural_key)
+                DO UPDATE SET
+                    {self._update_set_clause()},
+                    updated_at = CURRENT_TIMESTAMP,
+                    retired_at = NULL
+                WHERE target.row_fingerprint IS DISTINCT FROM EXCLUDED.row_fingerprint
+                    OR target.retired_at IS NOT NULL
+                RETURNING (xmax = 0) AS inserted
             )
-            RETURNING id
+            SELECT
+                COUNT(*) FILTER (WHERE inserted) AS inserted,
+                COUNT(*) FILTER (WHERE NOT inserted) AS updated
+            FROM merged
+        """)
+        result = self.cursor.fetchone()
+
+        staged = stream.rows_written
+        return {
+            'staged': staged,
+            'inserted': result['inserted'],
+            'updated': result['updated'],
+            'unchanged': staged - result['inserted'] - result['updated'],
+        }
+
+    def _stage_row(self, record: Dict) -> Tuple:
+        """Order a transformed record's values as STAGE_COLUMNS"""
+        payload = record.copy()
+        payload['spl_id'] = payload.get('spl_id') or []
+        payload['spl_set_id'] = payload.get('spl_set_id') or []
+        return tuple(payload.get(c) for c in self.STAGE_COLUMNS)
+
+    def _iter_transformed(self, fda_records: Iterable[Dict], stats: Dict) -> Iterator[Dict]:
+        """Yield transformed submission×product entries, counting into stats"""
+        for fda_record in fda_records:
+            stats['total_records'] += 1
+            submissions = fda_record.get('submissions', [])
+            products = fda_record.get('products', [])
+            for submission in submissions:
+                for product in products:
+                    stats['total_entries'] += 1
+                    try:
+                        yield self.transform_record(fda_record, product, submission)
+                    except Exception as e:
+                        logger.error(f"Error transforming record: {e}")
+                        stats['errors'] += 1
+
+    def bulk_load_fda_records(self, fda_records: Iterable[Dict]) -> Dict:
         """
+        Load FDA records through a COPY staging table and one set-based merge
+
+        Args:
+            fda_records: Iterable of raw FDA records
 
-        select_existing_query = """
-            SELECT id
-            FROM source.usa_drug_data
-            WHERE registration_number = %(registration_number)s
-              AND product_name = %(product_name)s
-              AND submission_type = %(submission_type)s
-              AND submission_number = %(submission_number)s
-              AND submission_date IS NOT DISTINCT FROM %(submission_date)s
-              AND strength IS NOT DISTINCT FROM %(strength)s
-            ORDER BY id
-            LIMIT 1
+        Returns:
+            Statistics dict
         """
+        stats = {
+            'total_records': 0,
+            'total_entries': 0,
+            'inserted': 0,
+            'updated': 0,
+            'unchanged': 0,
+            'retired': 0,
+            'errors': 0
+        }
 
         try:
-            is_duplicate = self.check_duplicate(
-                payload.get('registration_number'),
-                payload.get('product_name'),
-                payload.get('submission_type'),
-                payload.get('submission_number'),
-                payload.get('submission_date'),
-                payload.get('strength'),
-                payload.get('dosage_form'),
+            copy_stats = self.copy_upsert_records(self._iter_transformed(fda_records, stats))
+            self.row_counter.in_transaction(self.cursor.execute, copy_stats['inserted'])
+            self.conn.commit()
+            self.row_counter.committed(copy_stats['inserted'])
+            stats['inserted'] = copy_stats['inserted']
+            stats['updated'] = copy_stats['updated']
+            stats['unchanged'] = copy_stats['unchanged']
+            logger.info(
+                f"Bulk load: staged {copy_stats['staged']} entries | "
+                f"Inserted: {stats['inserted']} | "
+                f"Updated: {stats['updated']} | "
+                f"Unchanged: {stats['unchanged']}"
             )
+        except Exception as e:
+            logger.error(f"Error in bulk load: {e}")
+            stats['errors'] = stats['total_entries']
+            self.db.rollback()
 
-            if is_duplicate:
-                self.cursor.execute(select_existing_query, payload)
-                existing_row = self.cursor.fetchone()
-                if existing_row and existing_row.get('id') is not None:
-                    return existing_row['id'], False
-                return None
+        return stats
 
-            self.cursor.execute(insert_query, payload)
-            inserted_row = self.cursor.fetchone()
-            if inserted_row and inserted_row.get('id') is not None:
-                return inserted_row['id'], True
+    def write_batch(self, records: List[Dict]) -> Dict:
+        """
+        Upsert and commit one batch of transformed records
 
-            return None
-        except Exception as exc:
-            logger.error(
-                "Failed to upsert usa_drug_data record for application %s and product %s: %s",
-                payload.get('registration_number'),
-                payload.get('product_name'),
-                exc,
-            )
-            raise
-    
-    def process_fda_records(self, fda_records: List[Dict]) -> Dict:
+        A failed batch is rolled back and counted as errors. With
+        write_mode 'pipeline' the batch goes through pipeline_upsert_records
+        on the psycopg 3 session instead, and with 'prepared' through
+        prepared_upsert_records.
+
+        Returns:
+            Dict with inserted, updated, unchanged and errors counts
+        """
+        try:
+            if self.pipeline_db is not None:
+                batch_stats = self.pipeline_upsert_records(records)
+                self.row_counter.in_transaction(
+                    lambda query, params: self.pipeline_db.execute_pipelined([(query, params)]),
+                    batch_stats['inserted']
+                )
+                self.pipeline_db.commit()
+            else:
+                if self.upsert_statement is not None:
+                    batch_stats = self.prepared_upsert_records(records)
+                else:
+                    batch_stats = self.batch_upsert_records(records)
+                self.row_counter.in_transaction(self.cursor.execute, batch_stats['inserted'])
+                self.conn.commit()
+            self.row_counter.committed(batch_stats['inserted'])
+            if self.key_index is not None and self.key_index.loaded:
+                self.key_index.add(records)
+            batch_stats['errors'] = 0
+            return batch_stats
+        except Exception as e:
+            logger.error(f"Error processing batch: {e}")
+            if self.pipeline_db is not None:
+                self.pipeline_db.rollback()
+            else:
+                self.db.rollback()
+            return {'inserted': 0, 'updated': 0, 'unchanged': 0, 'errors': len(records)}
+
+    def sharded_writer(self, workers: int) -> ShardedWriter:
+        """
+        Parallel writer: batches are split by registration_number across
+        `workers` copies of this mapper, each with its own pooled connection
+
+        Rows are sorted by natural_key within each shard so concurrent
+        upserts lock index entries in a consistent order.
+        """
+        writers = []
+        for _ in range(workers):
+            writer = FDADrugDBMapper(batch_size=self.batch_size, load_mode=self.load_mode,
+                                     use_key_index=False, write_mode=self.write_mode)
+            writer.key_index = self.key_index
+            writer.row_counter = self.row_counter
+            writers.append(writer)
+        return ShardedWriter(
+            writers,
+            shard_key=lambda record: record['registration_number'],
+            sort_key=lambda record: record['natural_key'],
+        )
+
+    def _flush_batch(self, writer, batch: List[Dict], stats: Dict):
+        """Write one batch through writer and fold the outcome into stats"""
+        batch_stats = writer.write_batch(batch)
+        stats['inserted'] += batch_stats['inserted']
+        stats['updated'] += batch_stats['updated']
+        stats['unchanged'] += batch_stats['unchanged']
+        stats['errors'] += batch_stats['errors']
+
+    def process_fda_records(self, fda_records: Iterable[Dict], reconcile: bool = False) -> Dict:
         """
-        Process FDA records and insert into database
+        Process FDA records and insert into database using batch operations
         Each submission is linked with each product (cross join)
         
+        Records are consumed one at a time, so a stream is loaded with memory
+        bounded by batch_size rather than by the size of the export. With the
+        natural-key index enabled, existing keys and fingerprints are loaded
+        once up front and entries stored with the same fingerprint are counted
+        as unchanged locally; only new or changed entries are sent to the
+        database.
+        
+        With reconcile=True the records must be the complete export: instead
+        of the key index, the snapshot is sorted on disk and merge-joined
+        against the stored keys, and entries missing from the export are
+        retired as well (see _reconcile_batches).
+        
+        With DB_WRITERS > 1, batches of batch_size x DB_WRITERS entries are
+        split by registration_number and written by that many connections
+        in parallel.
+        
         Args:
-            fda_records: List of raw FDA records
+            fda_records: Iterable of raw FDA records (a list or a stream)
+            reconcile: Reconcile against the full export (batch load mode only)
             
         Returns:
             Statistics dict
         """
+        self.ensure_partition()
+        if self.load_mode == 'copy':
+            if reconcile:
+                logger.warning("Reconciliation is not available with LOAD_MODE=copy; loading without it")
+            return self.bulk_load_fda_records(fda_records)
+
         stats = {
-            'total_records': len(fda_records),
+            'total_records': 0,
             'total_entries': 0,
             'inserted': 0,
-            'duplicates': 0,
+            'updated': 0,
+            'unchanged': 0,
+            'retired': 0,
             'errors': 0
         }
         
-        total_records = len(fda_records)
-        progress_interval = max(1, total_records // 20)
+        key_index = None if reconcile else self.key_index
+        if key_index is not None and not key_index.loaded:
+            key_index.load(self.conn)
         
-        for idx, fda_record in enumerate(fda_records, 1):
-            if idx % progress_interval == 0 or idx == total_records:
-                logger.info(
-                    f"Progress: {idx}/{total_records} records ({idx*100//total_records}%) | "
-                    f"Entries: {stats['total_entries']} | "
-                    f"Inserted: {stats['inserted']} | "
-                    f"Duplicates: {stats['duplicates']} | "
-                    f"Errors: {stats['errors']}"
-                )
+        workers = max(1, Config.DB_WRITERS)
+        if reconcile:
+            self._check_reconcile_pool(workers)
+        writer = self.sharded_writer(workers) if workers > 1 else self
+        try:
+            batches = self.batch_accumulator(writer, workers, stats)
+            if reconcile:
+                self._reconcile_batches(fda_records, batches, stats)
+            else:
+                self._process_batches(fda_records, batches, stats)
+        finally:
+            if writer is not self:
+                writer.close()
+        
+        if key_index is not None:
+            logger.info(f"Natural key index: {key_index.stats()}")
+        
+        return stats
+    
+    def batch_accumulator(self, writer, workers: int, stats: Dict) -> BatchAccumulator:
+        """
+        Accumulator flushing batches through writer into stats, bounded by
+        batch_size rows and BATCH_MAX_BYTES of payload per writer and by
+        BATCH_MAX_SECONDS
+        """
+        return BatchAccumulator(
+            lambda batch: self._flush_batch(writer, batch, stats),
+            max_rows=self.batch_size * workers,
+            max_bytes=Config.BATCH_MAX_BYTES * workers,
+            max_seconds=Config.BATCH_MAX_SECONDS,
+            size_of=lambda record: estimate_size(record.values()),
+        )
+
+    def _process_batches(self, fda_records: Iterable[Dict], batches: BatchAccumulator, stats: Dict):
+        """Transform entries, skip ones the key index knows are current and queue the rest on batches"""
+        key_index = self.key_index
+        for fda_record in fda_records:
+            stats['total_records'] += 1
             submissions = fda_record.get('submissions', [])
             products = fda_record.get('products', [])
             for submission in submissions:
                 for product in products:
                     stats['total_entries'] += 1
-                    application_number = fda_record.get('application_number', '')
-                    product_name = product.get('brand_name', '')
-                    submission_type = submission.get('submission_type', '')
-                    submission_number = submission.get('submission_number', '')
-                    
-                    active_ingredients = product.get('active_ingredients', [])
-                    strength = self.format_strength(active_ingredients)
-                    dosage_form = product.get('dosage_form', '')
-                    
                     try:
                         record = self.transform_record(fda_record, product, submission)
-                        upsert_result = self.upsert_record(record)
-
-                        if not upsert_result:
-                            stats['errors'] += 1
-                            logger.error(
-                                "Failed to upsert record for %s - %s",
-                                record.get('registration_number'),
-                                record.get('product_name'),
-                            )
-                            self.conn.rollback()
-                            continue
-
-                        data_id, is_new = upsert_result
-
-                        if is_new:
-                            self.conn.commit()
-                            stats['inserted'] += 1
-                            logger.debug(
-                                "Inserted: %s - %s",
-                                record.get('product_name'),
-                                record.get('registration_number'),
-                            )
-                        else:
-                            stats['duplicates'] += 1
-                            logger.debug(
-                                "Duplicate skipped: %s - %s",
-                                record.get('product_name'),
-                                record.get('registration_number'),
-                            )
-
                     except Exception as e:
-                        logger.error(f"Error processing record: {e}")
+                        logger.error(f"Error transforming record: {e}")
                         stats['errors'] += 1
-                        self.conn.rollback()
+                        continue
+
+                    if key_index is not None and key_index.is_current(record):
+                        stats['unchanged'] += 1
+                        continue
+
+                    batches.add(record)
+
+            if stats['total_records'] % self.PROGRESS_INTERVAL == 0:
+                self._log_progress(stats)
         
-        return stats
+        batches.close()
+        self._log_progress(stats)
+        logger.info(f"Batch flushes by trigger: {batches.stats()}")
+    
+    def _check_reconcile_pool(self, workers: int):
+        """
+        Fail before reading the export if the pool cannot hold every
+        connection reconciliation keeps open at once: this mapper's own,
+        the stored-key reader, and one per writer when DB_WRITERS > 1.
+        Checkouts wait for a free connection, so an undersized pool would
+        otherwise stall each writer until DB_POOL_TIMEOUT.
+        """
+        needed = 2 + (workers if workers > 1 else 0)
+        available = self.db.pool.max_connections
+        if available < needed:
+            raise ValueError(
+                f"Reconciliation with DB_WRITERS={workers} needs DB_POOL_MAX >= {needed}, got {available}"
+            )
+
+    def _reconcile_batches(self, fda_records: Iterable[Dict], batches: BatchAccumulator, stats: Dict):
+        """
+        Merge-join the sorted export against the stored keys and apply the
+        insert, update and retire sets in bulk
+
+        Transformed entries are sorted by natural_key with an external sort
+        (RECONCILE_SORT_ROWS per in-memory run), then walked in step with this
+        partition's keys read in index order through a server-side cursor on
+        a separate connection. Memory stays constant: only one entry per side
+        plus the pending batches is held. New and changed entries go to
+        batches; entries stored but absent from the export get retired_at
+        set. Retiring is skipped when any entry failed to transform or the
+        export was empty, since missing keys would then not mean withdrawn.
+        """
+        planned = {'insert': 0, 'update': 0, 'unchanged': 0, 'retire': 0}
+        with ExternalSorter(Config.RECONCILE_SORT_ROWS) as sorter:
+            sort_snapshot(self._iter_transformed(fda_records, stats), sorter)
+            logger.info(f"Snapshot sorted: {sorter.stats()}")
+            retire = stats['errors'] == 0 and sorter.rows > 0
+            if not retire:
+                logger.warning("Incomplete or empty export: entries missing from it will not be retired")
+
+            retirements = BatchAccumulator(
+                lambda keys: self._flush_retirements(keys, stats),
+                max_rows=self.batch_size,
+                max_seconds=Config.BATCH_MAX_SECONDS,
+            )
+            reader = DBSession()
+            try:
+                stored = stream_stored_keys(
+                    reader.conn, self.partition, 'country_of_origin = %s', (Config.COUNTRY_OF_ORIGIN,)
+                )
+                for action, key, record in merge_join(iter_snapshot(sorter), stored):
+                    planned[action] += 1
+                    if action == UNCHANGED:
+                        stats['unchanged'] += 1
+                    elif action == RETIRE:
+                        if retire:
+                            retirements.add(key)
+                    else:
+                        batches.add(record)
+                batches.close()
+                retirements.close()
+            finally:
+                reader.release()
+
+        self._log_progress(stats)
+        logger.info(f"Reconciliation: {planned} (retire {'applied' if retire else 'skipped'})")
+        logger.info(f"Batch flushes by trigger: {batches.stats()}")
+
+    def _flush_retirements(self, keys: List[str], stats: Dict):
+        """Retire one batch of keys and fold the outcome into stats"""
+        try:
+            stats['retired'] += self.retire_keys(keys)
+        except Exception as e:
+            logger.error(f"Error retiring entries: {e}")
+            self.db.rollback()
+            stats['errors'] += len(keys)
+
+    def retire_keys(self, keys: List[str]) -> int:
+        """
+        Mark entries withdrawn from the FDA export: set retired_at on the
+        active rows with these natural keys and commit
+
+        Retired rows stay in the table; an upsert of the same key clears
+        retired_at again.
+
+        Returns:
+            Number of rows retired
+        """
+        self.db.execute_prepared(self.retire_statement.name, (Config.COUNTRY_OF_ORIGIN, keys))
+        retired = self.cursor.rowcount
+        self.conn.commit()
+        return retired
+
+    def _log_progress(self, stats: Dict):
+        logger.info(
+            f"Progress: {stats['total_records']} records | "
+            f"Entries: {stats['total_entries']} | "
+            f"Inserted: {stats['inserted']} | "
+            f"Updated: {stats['updated']} | "
+            f"Unchanged: {stats['unchanged']} | "
+            f"Retired: {stats['retired']} | "
+            f"Errors: {stats['errors']}"
+        )
     
+    def ensure_partition(self):
+        """Create this country's source.usa_drug_data partition if it is missing"""
+        ensure_list_partition(self.cursor, self.TABLE, Config.COUNTRY_OF_ORIGIN)
+        self.conn.commit()
+
     def get_table_count(self) -> int:
-        """Get total count in drug_predicate_assessments table"""
+        """
+        Count of this country's rows in source.usa_drug_data (its partition),
+        exact or estimated depending on ROW_COUNT_MODE
+        """
         try:
-            self.cursor.execute(
-                "SELECT COUNT(*) as count FROM source.usa_drug_data"
-            )
-            result = self.cursor.fetchone()
-            return result['count']
+            return self.row_counter.count(self.cursor)
         except Exception as e:
             logger.error(f"Error getting table count: {e}")
+            self.db.rollback()
+            return 0
+
+    def backfill_natural_keys(self, batch_size: int = 10000) -> int:
+        """
+        Fill natural_key for rows written before the column existed
+
+        Walks the table in id ranges and commits after each range, so a large
+        table is never locked or rewritten in a single transaction. The key is
+        computed in SQL with NATURAL_KEY_SQL, which matches transform_record.
+
+        Args:
+            batch_size: Number of ids per UPDATE
+
+        Returns:
+            Number of rows updated
+        """
+        self.cursor.execute(
+            "SELECT MIN(id) AS min_id, MAX(id) AS max_id FROM source.usa_drug_data WHERE natural_key IS NULL"
+        )
+        bounds = self.cursor.fetchone()
+        if bounds['min_id'] is None:
+            logger.info("All usa_drug_data rows already have a natural_key")
             return 0
 
+        updated = 0
+        for start_id in range(bounds['min_id'], bounds['max_id'] + 1, batch_size):
+            self.cursor.execute(f"""
+                UPDATE source.usa_drug_data
+                SET natural_key = {self.NATURAL_KEY_SQL}
+                WHERE id >= %s AND id < %s AND natural_key IS NULL
+            """, (start_id, start_id + batch_size))
+            updated += self.cursor.rowcount
+            self.conn.commit()
+            logger.info(f"Backfill: natural_key set on {updated} rows (through id {start_id + batch_size - 1})")
+
+        return updated
+
 
 def main():
-    """Test the mapper"""
+    """
+    Test the mapper
+
+    Usage:
+        python db_mapper.py                         # print the table count
+        python db_mapper.py backfill-natural-keys   # fill natural_key on existing rows
+    """
     mapper = FDADrugDBMapper()
     
+    if len(sys.argv) > 1 and sys.argv[1] == 'backfill-natural-keys':
+        # Meant to run before the migrations, so the indexes connect()
+        # requires need not exist yet
+        if mapper.db.check():
+            updated = mapper.backfill_natural_keys()
+            print(f"Backfilled natural_key on {updated} rows")
+        else:
+            print("Failed to connect to database")
+        mapper.close()
+        return
+    
     if mapper.connect():
         count = mapper.get_table_count()
         print(f"Current records in database: {count}")
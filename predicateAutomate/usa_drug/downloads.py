@@ -0,0 +1,315 @@
+import hashlib
+import json
+import logging
+import os
+from typing import Dict, Mapping, Optional
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+def file_sha256(path: str, chunk_size: int = 1024 * 1024) -> str:
+    """Return the hex SHA-256 digest of a local file"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class DownloadValidators:
+    """
+    Per-URL HTTP validators (ETag, Last-Modified, Content-Length, local hash)
+    remembered between runs so unchanged exports can be skipped
+
+    New validators are staged when a file is downloaded and only written to
+    disk by commit(), after the file has been loaded successfully. A failed
+    load therefore never marks a source as already processed.
+    """
+
+    def __init__(self, path: str = None):
+        self.path = path or Config.DOWNLOAD_STATE_FILE
+        self.state: Dict[str, Dict] = self._load()
+        self.pending: Dict[str, Dict] = {}
+
+    def _load(self) -> Dict[str, Dict]:
+        try:
+            if os.path.exists(self.path):
+                with open(self.path, 'r') as f:
+                    return json.load(f)
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable download state {self.path}: {e}")
+        return {}
+
+    def get(self, url: str) -> Dict:
+        """Validators stored for a URL by the last successful run"""
+        return self.state.get(url, {})
+
+    def conditional_headers(self, url: str) -> Dict[str, str]:
+        """Request headers that let the server answer 304 Not Modified"""
+        if Config.FORCE_DOWNLOAD:
+            return {}
+        stored = self.get(url)
+        headers = {}
+        if stored.get('etag'):
+            headers['If-None-Match'] = stored['etag']
+        if stored.get('last_modified'):
+            headers['If-Modified-Since'] = stored['last_modified']
+        return headers
+
+    def matches(self, url: str, headers: Mapping[str, str]) -> bool:
+        """
+        True when response headers describe the same file as the stored validators
+
+        ETag wins when both sides have one; otherwise Last-Modified and
+        Content-Length must both agree.
+        """
+        if Config.FORCE_DOWNLOAD:
+            return False
+        stored = self.get(url)
+        if not stored:
+            return False
+
+        etag = headers.get('ETag')
+        if etag and stored.get('etag'):
+            return etag == stored['etag']
+
+        last_modified = headers.get('Last-Modified')
+        content_length = headers.get('Content-Length')
+        return bool(
+            last_modified and content_length
+            and last_modified == stored.get('last_modified')
+            and content_length == stored.get('content_length')
+        )
+
+    def hash_matches(self, url: str, sha256: str) -> bool:
+        """True when a freshly downloaded file is byte-identical to the last one"""
+        return not Config.FORCE_DOWNLOAD and self.get(url).get('sha256') == sha256
+
+    def matches_export(self, url: str, export_date: Optional[str]) -> bool:
+        """True when the file was already processed for this manifest export date"""
+        if Config.FORCE_DOWNLOAD or not export_date:
+            return False
+        return self.get(url).get('export_date') == export_date
+
+    def stage(self, url: str, headers: Mapping[str, str], sha256: str, export_date: Optional[str] = None):
+        """Remember validators for a downloaded file until commit()"""
+        self.pending[url] = {
+            'etag': headers.get('ETag'),
+            'last_modified': headers.get('Last-Modified'),
+            'content_length': headers.get('Content-Length'),
+            'sha256': sha256,
+            'export_date': export_date,
+        }
+
+    def commit(self, url: Optional[str] = None):
+        """
+        Persist staged validators
+
+        Args:
+            url: Commit only this URL (default: everything staged)
+        """
+        urls = [url] if url else list(self.pending)
+        committed = False
+        for key in urls:
+            if key in self.pending:
+                self.state[key] = self.pending.pop(key)
+                committed = True
+        if not committed:
+            return
+
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.state, f, indent=2)
+        os.replace(tmp_path, self.path)
+        logger.info(f"Download validators saved to: {self.path}")
+
+
+class IncompleteDownloadError(IOError):
+    """Raised when a transfer ends before Content-Length bytes were received"""
+
+
+class ResumableDownloader:
+    """
+    Downloads large files into a '.part' file and resumes interrupted
+    transfers with HTTP Range requests
+
+    A small '.part.json' sidecar remembers the entity's validators, so a
+    resumed request carries If-Range and the server restarts from byte zero
+    if the export was replaced in the meantime. The finished file must match
+    the entity's Content-Length before it replaces the destination.
+    """
+
+    def __init__(self, session, validators: Optional[DownloadValidators] = None,
+                 timeout: int = None, chunk_size: int = 1024 * 1024):
+        self.session = session
+        self.validators = validators
+        self.timeout = timeout or Config.REQUEST_TIMEOUT
+        self.chunk_size = chunk_size
+
+    def _load_sidecar(self, path: str) -> Dict:
+        try:
+            with open(path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _discard_partial(self, part_path: str, sidecar_path: str):
+        for path in (part_path, sidecar_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def download(self, url: str, local_path: str) -> Optional[Dict[str, str]]:
+        """
+        Download url to local_path, resuming a previous partial transfer
+
+        Args:
+            url: File URL
+            local_path: Final destination path
+
+        Returns:
+            Validator headers of the complete entity (ETag, Last-Modified,
+            Content-Length), or None when the server reports the file as
+            unchanged since the last successful run
+
+        Raises:
+            requests.exceptions.RequestException / IncompleteDownloadError on
+            failure; the '.part' file is kept so the next attempt resumes
+        """
+        part_path = local_path + '.part'
+        sidecar_path = part_path + '.json'
+        sidecar = self._load_sidecar(sidecar_path)
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+
+        headers = self.validators.conditional_headers(url) if self.validators else {}
+        if offset and sidecar:
+            headers['Range'] = f"bytes={offset}-"
+            if_range = sidecar.get('ETag') or sidecar.get('Last-Modified')
+            if if_range:
+                headers['If-Range'] = if_range
+            logger.info(f"Resuming {os.path.basename(local_path)} from {offset / (1024*1024):.1f} MB")
+        elif offset:
+            # No sidecar means we cannot prove the partial file's identity
+            self._discard_partial(part_path, sidecar_path)
+            offset = 0
+
+        response = self.session.get(url, stream=True, timeout=self.timeout, headers=headers)
+        try:
+            if response.status_code == 304:
+                self._discard_partial(part_path, sidecar_path)
+                return None
+
+            if response.status_code == 416:
+                # Range starts at or past the end: the partial file may already be complete
+                expected = int(sidecar.get('Content-Length') or -1)
+                if offset == expected:
+                    return self._finish(part_path, sidecar_path, local_path, sidecar)
+                self._discard_partial(part_path, sidecar_path)
+                raise IncompleteDownloadError(f"Stale partial download for {url}, restarting")
+
+            response.raise_for_status()
+
+            if response.status_code == 206:
+                content_range = response.headers.get('Content-Range', '')
+                total = content_range.rsplit('/', 1)[-1]
+                mode = 'ab'
+            else:
+                if self.validators and self.validators.matches(url, response.headers):
+                    self._discard_partial(part_path, sidecar_path)
+                    return None
+                total = response.headers.get('Content-Length')
+                offset = 0
+                mode = 'wb'
+                sidecar = {
+                    'ETag': response.headers.get('ETag'),
+                    'Last-Modified': response.headers.get('Last-Modified'),
+                    'Content-Length': total if total and total.isdigit() else None,
+                }
+                with open(sidecar_path, 'w') as f:
+                    json.dump(sidecar, f)
+
+            expected = int(total) if total and total.isdigit() else None
+            downloaded = offset
+            next_report = downloaded + 10 * 1024 * 1024
+            with open(part_path, mode) as f:
+                for chunk in response.iter_content(chunk_size=self.chunk_size):
+                    if chunk:
+                        f.write(chunk)
+                        downloaded += len(chunk)
+                        if expected and downloaded >= next_report:
+                            progress = (downloaded / expected) * 100
+                            logger.info(f"Download progress: {progress:.1f}% ({downloaded / (1024*1024):.1f} MB)")
+                            next_report += 10 * 1024 * 1024
+        finally:
+            response.close()
+
+        return self._finish(part_path, sidecar_path, local_path, sidecar)
+
+    def _finish(self, part_path: str, sidecar_path: str, local_path: str, sidecar: Dict) -> Dict[str, str]:
+        """Check the partial file against Content-Length and move it into place"""
+        size = os.path.getsize(part_path)
+        expected = sidecar.get('Content-Length')
+        if expected is not None and size != int(expected):
+            raise IncompleteDownloadError(
+                f"Incomplete download of {os.path.basename(local_path)}: {size} of {expected} bytes"
+            )
+        entity_headers = {
+            'ETag': sidecar.get('ETag'),
+            'Last-Modified': sidecar.get('Last-Modified'),
+            'Content-Length': str(size),
+        }
+        # The finished file keeps its entity validators next to it so cached()
+        # can tell a complete, current copy from a stale or truncated one
+        with open(local_path + '.json', 'w') as f:
+            json.dump(entity_headers, f)
+        os.replace(part_path, local_path)
+        if os.path.exists(sidecar_path):
+            os.remove(sidecar_path)
+        return entity_headers
+
+    def cached(self, url: str, local_path: str) -> Optional[Dict[str, str]]:
+        """
+        Check a file left on disk by an earlier download() against the server
+
+        The copy is reused only when its size still matches the Content-Length
+        recorded when it finished, and a HEAD request shows the same entity
+        (ETag, or Last-Modified and Content-Length). Anything else is removed
+        so the caller downloads it again.
+
+        Returns:
+            Validator headers of the local copy, or None if it cannot be reused
+
+        Raises:
+            requests.exceptions.RequestException if the HEAD request fails
+        """
+        if not os.path.exists(local_path):
+            return None
+        stored = self._load_sidecar(local_path + '.json')
+        expected = stored.get('Content-Length')
+        if not expected or os.path.getsize(local_path) != int(expected):
+            logger.warning(f"{os.path.basename(local_path)} does not match its recorded size, discarding it")
+            self.remove(local_path)
+            return None
+
+        response = self.session.head(url, timeout=self.timeout, allow_redirects=True)
+        response.raise_for_status()
+        etag = response.headers.get('ETag')
+        if etag and stored.get('ETag'):
+            current = etag == stored['ETag']
+        else:
+            current = bool(
+                response.headers.get('Last-Modified')
+                and response.headers.get('Last-Modified') == stored.get('Last-Modified')
+                and response.headers.get('Content-Length') == expected
+            )
+        if not current:
+            logger.info(f"{os.path.basename(local_path)} was replaced on the server, discarding the local copy")
+            self.remove(local_path)
+            return None
+        return stored
+
+    def remove(self, local_path: str):
+        """Delete a downloaded file together with its validator sidecar"""
+        for path in (local_path, local_path + '.json'):
+            if os.path.exists(path):
+                os.remove(path)
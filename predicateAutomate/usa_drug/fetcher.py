@@ -1,12 +1,12 @@
 import requests
 import json
-import time
 import logging
-import zipfile
 import os
-from typing import Dict, List, Optional
+from typing import Dict, Iterable, Iterator, List, Optional
 from tenacity import retry, stop_after_attempt, wait_exponential
 from config import Config
+from json_stream import iter_zip_results
+from downloads import DownloadValidators, IncompleteDownloadError, ResumableDownloader, file_sha256
 
 logging.basicConfig(
     level=getattr(logging, Config.LOG_LEVEL),
@@ -23,134 +23,99 @@ class FDADrugFetcher:
         self.session = requests.Session()
         self.total_records = 0
         self.fetched_records = 0
+        self.source_unchanged = False
         
         # Ensure output directory exists
         Config.ensure_output_dir()
+        self.validators = DownloadValidators()
+        self.downloader = ResumableDownloader(self.session, self.validators)
         
-        # Paths for downloaded files
+        # Path for the downloaded archive
         self.zip_path = os.path.join(Config.OUTPUT_DIR, 'fda_drugs_bulk.zip')
-        self.json_path = os.path.join(Config.OUTPUT_DIR, 'fda_drugs_bulk.json')
         
     @retry(
         stop=stop_after_attempt(Config.MAX_RETRIES),
         wait=wait_exponential(multiplier=Config.RETRY_DELAY, min=1, max=10)
     )
-    def download_bulk_file(self) -> str:
+    def download_bulk_file(self) -> Optional[str]:
         """
-        Downloads the bulk ZIP file from FDA
+        Downloads the bulk ZIP file from FDA unless it is unchanged since the
+        last successful run
+        
+        Sends If-None-Match / If-Modified-Since from the stored validators and
+        also compares the response's ETag, Last-Modified, Content-Length and the
+        downloaded file's hash against them. Interrupted transfers resume from
+        the '.part' file on the next retry.
         
         Returns:
-            Path to downloaded ZIP file
+            Path to downloaded ZIP file, or None when the source is unchanged
         """
         try:
             logger.info(f"Downloading bulk file from: {self.download_url}")
             logger.info("This may take a few minutes for large files...")
             
-            response = self.session.get(
-                self.download_url,
-                stream=True,
-                timeout=Config.REQUEST_TIMEOUT
-            )
-            response.raise_for_status()
-            total_size = int(response.headers.get('content-length', 0))
-            downloaded = 0
-            with open(self.zip_path, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    if chunk:
-                        f.write(chunk)
-                        downloaded += len(chunk)
-                        if total_size > 0 and downloaded % (10 * 1024 * 1024) == 0:
-                            progress = (downloaded / total_size) * 100
-                            logger.info(f"Download progress: {progress:.1f}% ({downloaded / (1024*1024):.1f} MB)")
+            entity_headers = self.downloader.download(self.download_url, self.zip_path)
+            if entity_headers is None:
+                logger.info("Source unchanged since last successful run - skipping download")
+                self.source_unchanged = True
+                return None
             
             file_size_mb = os.path.getsize(self.zip_path) / (1024 * 1024)
             logger.info(f"Download complete: {file_size_mb:.1f} MB")
+            
+            sha256 = file_sha256(self.zip_path)
+            if self.validators.hash_matches(self.download_url, sha256):
+                logger.info("Downloaded file is identical to the last processed export")
+                # Same content under new ETag/Last-Modified: record them so the
+                # next run can skip the download with a conditional request
+                self.validators.stage(self.download_url, entity_headers, sha256,
+                                      self.validators.get(self.download_url).get('export_date'))
+                self.validators.commit(self.download_url)
+                self.cleanup_temp_files()
+                self.source_unchanged = True
+                return None
+            
+            self.validators.stage(self.download_url, entity_headers, sha256)
             logger.info(f"Saved to: {self.zip_path}")
             
             return self.zip_path
             
-        except requests.exceptions.RequestException as e:
+        except (requests.exceptions.RequestException, IncompleteDownloadError) as e:
             logger.error(f"Download failed: {e}")
             raise
     
-    def extract_json_from_zip(self) -> str:
-        """
-        Extracts JSON file from the downloaded ZIP
-        
-        Returns:
-            Path to extracted JSON file
-        """
-        try:
-            logger.info(f"Extracting ZIP file: {self.zip_path}")
-            
-            with zipfile.ZipFile(self.zip_path, 'r') as zip_ref:
-                # List all files in the ZIP
-                file_list = zip_ref.namelist()
-                logger.info(f"Files in ZIP: {file_list}")
-                
-                # Find the JSON file (should be drug-drugsfda-0001-of-0001.json)
-                json_files = [f for f in file_list if f.endswith('.json')]
-                
-                if not json_files:
-                    raise ValueError("No JSON file found in ZIP archive")
-                
-                json_filename = json_files[0]
-                logger.info(f"Extracting: {json_filename}")
-                
-                # Extract to output directory
-                zip_ref.extract(json_filename, Config.OUTPUT_DIR)
-                
-                # Rename to our standard name
-                extracted_path = os.path.join(Config.OUTPUT_DIR, json_filename)
-                os.rename(extracted_path, self.json_path)
-                
-                file_size_mb = os.path.getsize(self.json_path) / (1024 * 1024)
-                logger.info(f"JSON extracted: {file_size_mb:.1f} MB")
-                logger.info(f"Saved to: {self.json_path}")
-                
-                return self.json_path
-                
-        except Exception as e:
-            logger.error(f"Extraction failed: {e}")
-            raise
+    def commit_validators(self):
+        """Records the downloaded export as processed so unchanged reruns are skipped"""
+        self.validators.commit(self.download_url)
     
-    def load_json_data(self) -> Dict:
+    def iter_records(self) -> Iterator[Dict]:
         """
-        Loads the JSON data from extracted file
+        Streams records out of the downloaded ZIP file one at a time
         
-        Returns:
-            Parsed JSON data as dictionary
+        The JSON member is decompressed and parsed incrementally, so memory use
+        does not grow with the size of the export.
+        
+        Yields:
+            Raw FDA drug records
         """
         try:
-            logger.info(f"Loading JSON data from: {self.json_path}")
-            
-            with open(self.json_path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-            
-            logger.info("JSON data loaded successfully")
-            return data
-            
+            logger.info(f"Reading ZIP file: {self.zip_path}")
+            self.total_records = 0
+            for record in iter_zip_results(self.zip_path):
+                self.total_records += 1
+                yield record
+            self.fetched_records = self.total_records
+            logger.info(f"Streamed {self.total_records} records from ZIP")
         except Exception as e:
-            logger.error(f"Failed to load JSON: {e}")
+            logger.error(f"Failed to read records from ZIP: {e}")
             raise
     
-    def cleanup_temp_files(self, keep_json: bool = True):
-        """
-        Cleans up downloaded files
-        
-        Args:
-            keep_json: If True, keeps the extracted JSON file
-        """
+    def cleanup_temp_files(self):
+        """Removes the downloaded ZIP file"""
         try:
-            # Always remove ZIP file to save space
             if os.path.exists(self.zip_path):
-                os.remove(self.zip_path)
+                self.downloader.remove(self.zip_path)
                 logger.info(f"Cleaned up ZIP file: {self.zip_path}")
-            
-            # Optionally remove JSON file
-            if not keep_json and os.path.exists(self.json_path):
-                os.remove(self.json_path)
-                logger.info(f"Cleaned up JSON file: {self.json_path}")
                 
         except Exception as e:
             logger.warning(f"Cleanup warning: {e}")
@@ -165,6 +130,33 @@ class FDADrugFetcher:
         """
         return self.total_records
     
+    def iter_all_data(self) -> Iterator[Dict]:
+        """
+        Downloads the bulk file and streams its records
+        
+        The ZIP file is removed once the stream is exhausted or closed.
+        
+        Yields:
+            Raw FDA drug records
+        """
+        logger.info("=" * 80)
+        logger.info("STEP 1: Downloading bulk file")
+        logger.info("=" * 80)
+        if self.download_bulk_file() is None:
+            return
+        
+        logger.info("=" * 80)
+        logger.info("STEP 2: Streaming records from ZIP")
+        logger.info("=" * 80)
+        try:
+            yield from self.iter_records()
+            logger.info("=" * 80)
+            logger.info(f"SUCCESS: Streamed {self.total_records} records from bulk file")
+            logger.info("=" * 80)
+        finally:
+            logger.info("Cleaning up temporary files...")
+            self.cleanup_temp_files()
+    
     def fetch_all_data(self, save_intermediate: bool = True, max_skip: int = None) -> List[Dict]:
         """
         Downloads and processes bulk FDA drug data
@@ -180,38 +172,8 @@ class FDADrugFetcher:
             List of all drug records
         """
         try:
-            # Step 1: Download the ZIP file
-            logger.info("=" * 80)
-            logger.info("STEP 1: Downloading bulk file")
-            logger.info("=" * 80)
-            self.download_bulk_file()
-            
-            # Step 2: Extract JSON from ZIP
-            logger.info("=" * 80)
-            logger.info("STEP 2: Extracting JSON from ZIP")
-            logger.info("=" * 80)
-            self.extract_json_from_zip()
-            
-            # Step 3: Load and parse JSON data
-            logger.info("=" * 80)
-            logger.info("STEP 3: Loading JSON data")
-            logger.info("=" * 80)
-            data = self.load_json_data()
-            
-            # Extract results from the FDA data structure
-            all_records = data.get('results', [])
-            self.total_records = len(all_records)
-            self.fetched_records = self.total_records
-            
-            logger.info("=" * 80)
-            logger.info(f"SUCCESS: Loaded {self.total_records} records from bulk file")
+            all_records = list(self.iter_all_data())
             logger.info("No 25,000 record limit with bulk download!")
-            logger.info("=" * 80)
-            
-            # Step 4: Cleanup temporary files
-            logger.info("Cleaning up temporary files...")
-            self.cleanup_temp_files(keep_json=False)  # Remove JSON after loading
-            
             return all_records
             
         except Exception as e:
@@ -253,64 +215,87 @@ class FDADrugFetcher:
             logger.error(f"Failed to save data: {e}")
             raise
     
-    def get_statistics(self, records: List[Dict]) -> Dict:
+    def get_statistics(self, records: Iterable[Dict]) -> Dict:
         """
         Generates statistics about the fetched data
         
         Args:
-            records: List of drug records
+            records: Drug records (a list or a stream)
             
         Returns:
             Dictionary containing statistics
         """
+        statistics = RecordStatistics()
         try:
-            sponsors = set()
-            dosage_forms = set()
-            submission_types = set()
-            application_types = set()
-            
             for record in records:
-                # Get sponsor name
-                sponsor = record.get('sponsor_name', 'Unknown')
-                if sponsor:
-                    sponsors.add(sponsor)
-                
-                # Get submission info
-                submissions = record.get('submissions', [])
-                for submission in submissions:
-                    submission_type = submission.get('submission_type', 'Unknown')
-                    if submission_type:
-                        submission_types.add(submission_type)
-                
-                # Get product info
-                products = record.get('products', [])
-                for product in products:
-                    dosage_form = product.get('dosage_form', 'Unknown')
-                    if dosage_form:
-                        dosage_forms.add(dosage_form)
-                
-                # Get application info
-                app_type = record.get('application_type', 'Unknown')
-                if app_type:
-                    application_types.add(app_type)
-            
-            stats = {
-                'total_records': len(records),
-                'unique_sponsors': len(sponsors),
-                'unique_dosage_forms': len(dosage_forms),
-                'unique_submission_types': len(submission_types),
-                'unique_application_types': len(application_types),
-                'sponsor_list': sorted(list(sponsors))[:20],  # First 20 sponsors
-                'dosage_form_list': sorted(list(dosage_forms)),
-                'submission_type_list': sorted(list(submission_types)),
-                'application_type_list': sorted(list(application_types))
-            }
-            
-            return stats
+                statistics.add(record)
+            return statistics.result()
             
         except Exception as e:
             logger.error(f"Failed to generate statistics: {e}")
             return {
-                'total_records': len(records),
+                'total_records': statistics.total_records,
                 'error': str(e)
             }
+
+
+class RecordStatistics:
+    """
+    Incremental statistics over FDA drug records
+    
+    Records are fed one at a time with add(), so statistics can be gathered
+    during the same streaming pass that writes files and loads the database.
+    Only the sets of distinct values are kept, never the records themselves.
+    """
+    
+    def __init__(self):
+        self.total_records = 0
+        self.sponsors = set()
+        self.dosage_forms = set()
+        self.submission_types = set()
+        self.application_types = set()
+    
+    def add(self, record: Dict):
+        """Fold one raw drug record into the statistics"""
+        self.total_records += 1
+        
+        # Get sponsor name
+        sponsor = record.get('sponsor_name', 'Unknown')
+        if sponsor:
+            self.sponsors.add(sponsor)
+        
+        # Get submission info
+        submissions = record.get('submissions', [])
+        for submission in submissions:
+            submission_type = submission.get('submission_type', 'Unknown')
+            if submission_type:
+                self.submission_types.add(submission_type)
+        
+        # Get product info
+        products = record.get('products', [])
+        for product in products:
+            dosage_form = product.get('dosage_form', 'Unknown')
+            if dosage_form:
+                self.dosage_forms.add(dosage_form)
+        
+        # Get application info
+        app_type = record.get('application_type', 'Unknown')
+        if app_type:
+            self.application_types.add(app_type)
+    
+    def result(self) -> Dict:
+        """
+        Returns:
+            Dictionary containing statistics
+        """
+        return {
+            'total_records': self.total_records,
+            'unique_sponsors': len(self.sponsors),
+            'unique_dosage_forms': len(self.dosage_forms),
+            'unique_submission_types': len(self.submission_types),
+            'unique_application_types': len(self.application_types),
+            'sponsor_list': sorted(list(self.sponsors))[:20],  # First 20 sponsors
+            'dosage_form_list': sorted(list(self.dosage_forms)),
+            'submission_type_list': sorted(list(self.submission_types)),
+            'application_type_list': sorted(list(self.application_types))
+        }
@@ -0,0 +1,233 @@
+import io
+import json
+import logging
+import os
+import threading
+import zipfile
+from typing import Any, Dict, IO, Iterable, Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+_WHITESPACE = ' \t\n\r'
+
+# Characters that may end a number or literal, and the opening characters of
+# values whose own closing character ends them
+_DELIMITERS = ',]}' + _WHITESPACE
+_SELF_DELIMITED = '"[{'
+
+_append_lock = threading.Lock()
+
+
+class _JSONTextReader:
+    """Sliding text buffer over a stream that decodes one JSON value at a time"""
+
+    def __init__(self, fp: IO[str], chunk_size: int):
+        self.fp = fp
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+
+    def fill(self, min_size: int = 0) -> bool:
+        """Drop the consumed prefix and append at least one more chunk"""
+        if self.eof:
+            return False
+        chunk = self.fp.read(max(self.chunk_size, min_size))
+        if not chunk:
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        """Skip whitespace and return the next character ('' at end of input)"""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.fill():
+                return ''
+
+    def expect(self, char: str):
+        found = self.peek()
+        if found != char:
+            raise ValueError(f"Expected '{char}' at offset {self.pos}, found '{found or 'EOF'}'")
+        self.pos += 1
+
+    def decode(self) -> Any:
+        """Decode the next complete JSON value, reading more input as needed"""
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                # Value is cut off at the end of the buffer; read at least as
+                # much again so large values are not re-scanned quadratically
+                if not self.fill(len(self.buffer) - self.pos):
+                    raise
+                continue
+            if self.buffer[self.pos] not in _SELF_DELIMITED and not self.eof:
+                # A number or literal is only complete once a delimiter
+                # follows it: "2." or "1e" at the end of a chunk decodes as a
+                # shorter number that the next chunk continues
+                if (end == len(self.buffer) or self.buffer[end] not in _DELIMITERS) and self.fill():
+                    continue
+            self.pos = end
+            return value
+
+
+def iter_json_array(fp: IO[str], key: str = 'results', chunk_size: int = 1024 * 1024) -> Iterator[Any]:
+    """
+    Incrementally yield the items of a top-level array from a JSON document
+
+    Only the current item (plus one read chunk) is held in memory; other
+    top-level members such as 'meta' are decoded and discarded.
+
+    Args:
+        fp: Text stream positioned at the start of a JSON object
+        key: Name of the top-level member holding the array
+        chunk_size: Number of characters to read per chunk
+
+    Yields:
+        Decoded array items, in document order
+    """
+    reader = _JSONTextReader(fp, chunk_size)
+    reader.expect('{')
+
+    while True:
+        char = reader.peek()
+        if char == '}' or char == '':
+            return
+        if char == ',':
+            reader.pos += 1
+            continue
+
+        member = reader.decode()
+        reader.expect(':')
+
+        if member != key:
+            reader.decode()
+            continue
+
+        reader.expect('[')
+        while True:
+            char = reader.peek()
+            if char == ']':
+                reader.pos += 1
+                return
+            if char == ',':
+                reader.pos += 1
+                continue
+            if char == '':
+                raise ValueError(f"Unterminated '{key}' array")
+            yield reader.decode()
+
+
+def append_json_lines(path: str, items: Iterable[Any]):
+    """
+    Append items to a JSON Lines file, one JSON document per line
+
+    Safe to call from several threads; the file is opened per call, so it
+    suits low-volume logs such as reject files.
+    """
+    lines = ''.join(json.dumps(item, default=str) + '\n' for item in items)
+    with _append_lock:
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path, 'a', encoding='utf-8') as fp:
+            fp.write(lines)
+
+
+def find_json_member(zip_ref: zipfile.ZipFile) -> Optional[str]:
+    """Return the name of the first .json member of an archive, if any"""
+    json_files = [f for f in zip_ref.namelist() if f.endswith('.json')]
+    return json_files[0] if json_files else None
+
+
+def iter_zip_results(zip_path: str, key: str = 'results') -> Iterator[Dict]:
+    """
+    Stream records out of the JSON document inside an openFDA ZIP archive
+
+    The member is decompressed on the fly; nothing is extracted to disk.
+
+    Args:
+        zip_path: Path to the downloaded ZIP file
+        key: Name of the top-level member holding the records
+
+    Yields:
+        One record dict at a time
+    """
+    with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+        json_filename = find_json_member(zip_ref)
+        if not json_filename:
+            raise ValueError(f"No JSON file found in ZIP archive {zip_path}")
+
+        logger.info(f"Streaming records from: {json_filename}")
+        with zip_ref.open(json_filename) as raw:
+            with io.TextIOWrapper(raw, encoding='utf-8') as text:
+                yield from iter_json_array(text, key)
+
+
+class JSONArrayWriter:
+    """
+    Writes a JSON array one item at a time, so a large output file never has
+    to be built in memory
+
+    With key=None the document is a bare top-level array; otherwise it is an
+    object whose `key` member holds the array, followed by any members passed
+    to finish() (e.g. a 'meta' block with the final count). The document is
+    written to a '.tmp' file and only moved into place once finished, so an
+    interrupted run never leaves a truncated file behind.
+
+    Usage:
+        with JSONArrayWriter(path, key='results') as writer:
+            for record in records:
+                writer.write(record)
+            writer.finish(meta={'results': {'total': writer.count}})
+    """
+
+    def __init__(self, path: str, key: Optional[str] = None):
+        self.path = path
+        self.key = key
+        self.tmp_path = path + '.tmp'
+        self.count = 0
+        self._fp = open(self.tmp_path, 'w', encoding='utf-8')
+        self._fp.write('{' + json.dumps(key) + ': [' if key else '[')
+
+    def write(self, item: Any):
+        """Append one item to the array"""
+        self._fp.write(',\n' if self.count else '\n')
+        self._fp.write(json.dumps(item, default=str))
+        self.count += 1
+
+    def finish(self, **members: Any):
+        """Close the array, append trailing members and move the file into place"""
+        if self._fp.closed:
+            return
+        self._fp.write('\n]')
+        if self.key:
+            for name, value in members.items():
+                self._fp.write(',\n' + json.dumps(name) + ': ' + json.dumps(value, default=str))
+            self._fp.write('}')
+        self._fp.write('\n')
+        self._fp.close()
+        os.replace(self.tmp_path, self.path)
+
+    def abort(self):
+        """Discard the partial document"""
+        if not self._fp.closed:
+            self._fp.close()
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+    def __enter__(self) -> 'JSONArrayWriter':
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.finish()
+        else:
+            self.abort()
+        return False
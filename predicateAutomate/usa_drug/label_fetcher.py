@@ -1,12 +1,15 @@
 import requests
 import json
-import time
 import logging
-import zipfile
 import os
-from typing import Dict, List, Optional
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from requests.adapters import HTTPAdapter
 from tenacity import retry, stop_after_attempt, wait_exponential
 from config import Config
+from json_stream import iter_zip_results
+from downloads import DownloadValidators, ResumableDownloader, file_sha256
+from manifest import DownloadManifest
 
 logging.basicConfig(
     level=getattr(logging, Config.LOG_LEVEL),
@@ -18,145 +21,168 @@ logger = logging.getLogger(__name__)
 class FDALabelFetcher:
     """Fetches drug label data from FDA"""
     
-    def __init__(self):
+    def __init__(self, download_workers: int = Config.LABEL_DOWNLOAD_WORKERS):
         self.base_url = Config.FDA_LABEL_BASE_URL
+        self.download_workers = max(1, download_workers)
         self.session = requests.Session()
+        # One pooled connection per concurrent download
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.download_workers)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
         self.total_records = 0
         self.fetched_records = 0
         Config.ensure_output_dir()
         self.output_dir = os.path.join(Config.OUTPUT_DIR, 'fda_labels')
         os.makedirs(self.output_dir, exist_ok=True)
-
-    def get_metadata(self) -> Optional[int]:
-        """Get metadata about the dataset"""
-        try:
-            api_url = "https://api.fda.gov/drug/label.json?limit=1"
-            response = requests.get(api_url, timeout=30)
-            
-            if response.status_code == 200:
-                data = response.json()
-                total_records = data['meta']['results']['total']
-                logger.info(f"Total records in dataset: {total_records:,}")
-                return total_records
-        except Exception as e:
-            logger.error(f"Failed to get metadata: {e}")
-        return None
-
-    def calculate_required_files(self, total_records: int, records_per_file: int = 20000) -> int:
-        """Calculate how many files we need"""
-        import math
-        num_files = math.ceil(total_records / records_per_file)
-        logger.info(f"Estimated number of files: {num_files}")
-        return num_files
+        self.validators = DownloadValidators()
+        self.manifest = DownloadManifest(self.session, self.validators)
+        # Unchanged parts are detected from the manifest export date, so the GET is unconditional
+        self.downloader = ResumableDownloader(self.session)
 
     @retry(
         stop=stop_after_attempt(Config.MAX_RETRIES),
         wait=wait_exponential(multiplier=Config.RETRY_DELAY, min=1, max=10)
     )
-    def download_file(self, file_url: str, local_path: str) -> bool:
-        """Download a single file"""
+    def _download_with_resume(self, file_url: str, local_path: str) -> Dict[str, str]:
+        """Download attempt; each retry resumes from the '.part' file"""
+        return self.downloader.download(file_url, local_path)
+
+    def download_file(self, file_url: str, local_path: str, export_date: Optional[str] = None) -> bool:
+        """Download a single file, resuming interrupted transfers with Range requests"""
         try:
-            response = requests.get(file_url, stream=True, timeout=Config.REQUEST_TIMEOUT)
-            response.raise_for_status()
-            
-            total_size = int(response.headers.get('content-length', 0))
-            downloaded = 0
-            
-            with open(local_path, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    if chunk:
-                        f.write(chunk)
-                        downloaded += len(chunk)
+            entity_headers = self._download_with_resume(file_url, local_path)
             
             file_size = os.path.getsize(local_path) / 1024 / 1024
             logger.info(f"Downloaded ({file_size:.2f} MB)")
+            self.validators.stage(file_url, entity_headers, file_sha256(local_path), export_date)
             return True
         except Exception as e:
             logger.error(f"Failed to download {file_url}: {e}")
             return False
 
+    def iter_labels_from_zip(self, zip_path: str) -> Iterator[Dict]:
+        """Stream label records out of a ZIP file one at a time"""
+        count = 0
+        for record in iter_zip_results(zip_path):
+            count += 1
+            yield record
+        logger.info(f"Extracted {count} records from {os.path.basename(zip_path)}")
+
     def extract_labels_from_zip(self, zip_path: str) -> List[Dict]:
         """Extract and parse labels from a ZIP file"""
         try:
-            with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-                json_files = [f for f in zip_ref.namelist() if f.endswith('.json')]
-                
-                if not json_files:
-                    logger.warning(f"No JSON files found in {zip_path}")
-                    return []
-                
-                json_filename = json_files[0]
-                with zip_ref.open(json_filename) as json_file:
-                    data = json.load(json_file)
-                    records = data.get('results', [])
-                    logger.info(f"Extracted {len(records)} records from {json_filename}")
-                    return records
+            return list(self.iter_labels_from_zip(zip_path))
         except Exception as e:
             logger.error(f"Failed to extract labels from {zip_path}: {e}")
             return []
 
+    def discover_label_parts(self) -> List[Dict]:
+        """
+        List the label part files of the current export from the download manifest
+
+        Each part is a dict with part_num, filename, url, local_path, size_mb,
+        records and the export_date of the export it belongs to.
+        """
+        export_date = self.manifest.export_date('drug', 'label')
+        partitions = self.manifest.partitions('drug', 'label')
+        
+        parts = []
+        for part_num, partition in enumerate(partitions, 1):
+            file_url = partition['file']
+            filename = file_url.rsplit('/', 1)[-1]
+            parts.append({
+                'part_num': part_num,
+                'filename': filename,
+                'url': file_url,
+                'local_path': os.path.join(self.output_dir, filename),
+                'size_mb': partition.get('size_mb'),
+                'records': partition.get('records'),
+                'export_date': export_date,
+            })
+        
+        total_records = sum(int(p['records'] or 0) for p in parts)
+        logger.info(f"Export {export_date}: {len(parts)} label parts, {total_records:,} records")
+        return parts
+
+    def _download_part(self, part: Dict) -> bool:
+        """Download one part unless a complete, current copy is already on disk"""
+        if os.path.exists(part['local_path']):
+            try:
+                entity_headers = self.downloader.cached(part['url'], part['local_path'])
+            except requests.exceptions.RequestException as e:
+                logger.warning(f"[Part {part['part_num']}] Could not check the local copy ({e}), downloading again")
+                self.downloader.remove(part['local_path'])
+                entity_headers = None
+            if entity_headers is not None:
+                logger.info(f"[Part {part['part_num']}] Local copy is complete and current, extracting...")
+                self.validators.stage(
+                    part['url'], entity_headers, file_sha256(part['local_path']), part['export_date']
+                )
+                return True
+        logger.info(f"[Part {part['part_num']}] Downloading {part['filename']} ({part['size_mb']} MB)...")
+        return self.download_file(part['url'], part['local_path'], part['export_date'])
+
+    def download_parts(self, parts: Iterable[Dict], workers: int = None) -> Iterator[Tuple[Dict, bool]]:
+        """
+        Download parts concurrently over the pooled session
+
+        Parts are yielded as soon as each download finishes, in completion
+        order. At most `workers` parts are downloading or waiting to be
+        consumed at any time, so finished ZIPs do not pile up on disk faster
+        than the caller processes them. Each part retries on its own; a failed
+        part is yielded with ok=False and does not hold up the others.
+
+        Args:
+            parts: Parts from discover_label_parts()
+            workers: Number of concurrent downloads (default: download_workers)
+
+        Yields:
+            (part, ok) tuples
+        """
+        workers = max(1, workers or self.download_workers)
+        remaining = iter(parts)
+        in_flight = {}
+        executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='label-download')
+        
+        def submit_next() -> bool:
+            part = next(remaining, None)
+            if part is None:
+                return False
+            in_flight[executor.submit(self._download_part, part)] = part
+            return True
+        
+        try:
+            for _ in range(workers):
+                if not submit_next():
+                    break
+            
+            while in_flight:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    part = in_flight.pop(future)
+                    submit_next()
+                    yield part, future.result()
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
     def fetch_all_labels(self) -> List[Dict]:
-        """Smart download with metadata check"""
+        """Download every part listed in the download manifest"""
         logger.info("=" * 80)
         logger.info("Starting FDA Label Download")
         logger.info("=" * 80)
         
         all_records = []
-        
-        # Get metadata to determine number of files
-        total_records = self.get_metadata()
-        
-        if total_records:
-            estimated_files = self.calculate_required_files(total_records)
-        else:
-            logger.warning("Could not get metadata, will download until 404")
-            estimated_files = 100
-
         downloaded_count = 0
         
-        for part_num in range(1, estimated_files + 10):
-            # Try different file name patterns
-            patterns = [
-                f"drug-label-{part_num:04d}-of-{estimated_files:04d}.json.zip",
-                f"drug-label-{part_num:04d}-of-{estimated_files+5:04d}.json.zip",
-                f"drug-label-{part_num:04d}-of-{estimated_files+10:04d}.json.zip",
-            ]
-            
-            downloaded = False
-            for pattern in patterns:
-                file_url = self.base_url + pattern
-                local_path = os.path.join(self.output_dir, pattern)
-                
-                # Check if already exists
-                if os.path.exists(local_path):
-                    logger.info(f"[Part {part_num}] Already exists, extracting...")
-                    records = self.extract_labels_from_zip(local_path)
-                    all_records.extend(records)
-                    downloaded_count += 1
-                    downloaded = True
-                    break
-                
-                # Try to download
-                try:
-                    response = requests.head(file_url, timeout=10)
-                    if response.status_code == 200:
-                        logger.info(f"[Part {part_num}] Downloading {pattern}...")
-                        if self.download_file(file_url, local_path):
-                            records = self.extract_labels_from_zip(local_path)
-                            all_records.extend(records)
-                            downloaded_count += 1
-                            downloaded = True
-                            
-                            # Log progress
-                            logger.info(f"Progress: Downloaded {downloaded_count} files | Total records: {len(all_records):,}")
-                            break
-                except:
-                    continue
+        for part, ok in self.download_parts(self.discover_label_parts()):
+            if not ok:
+                continue
+            records = self.extract_labels_from_zip(part['local_path'])
+            all_records.extend(records)
+            downloaded_count += 1
             
-            # If no file found after estimated files, stop
-            if not downloaded and part_num > estimated_files:
-                logger.info(f"No more files found after part {part_num-1}")
-                break
+            # Log progress
+            logger.info(f"Progress: Downloaded {downloaded_count} files | Total records: {len(all_records):,}")
         
         logger.info("=" * 80)
         logger.info(f"Download Complete!")
@@ -1,11 +1,15 @@
-import json
+import itertools
 import logging
+import multiprocessing
 import sys
 import os
-import requests
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
+from typing import Dict, List, Tuple
 from label_fetcher import FDALabelFetcher
-from label_mapper import FDALabelMapper
+from label_mapper import FDALabelMapper, transform_label_part
+from common.batching import BatchAccumulator, estimate_size
+from pipeline import Pipeline
 from config import Config
 
 
@@ -20,6 +24,214 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
+def run_label_pipeline(fetcher: FDALabelFetcher, mapper: FDALabelMapper,
+                       parts: List[Dict], trial_mode: bool,
+                       parse_processes: int = Config.LABEL_PARSE_PROCESSES) -> Tuple[Dict, Dict, Pipeline]:
+    """
+    Load label parts through a staged pipeline
+
+    download -> parse -> transform -> upsert each run on their own thread with
+    bounded queues in between, so the download of part N+1, parsing of part N
+    and upserting of part N-1 overlap while memory stays bounded by
+    PIPELINE_QUEUE_SIZE batches per queue.
+
+    The upsert stage regroups rows into DB batches of at most batch_size rows
+    and BATCH_MAX_BYTES of payload (times DB_WRITERS), flushing each part's
+    tail when the part is done. With DB_WRITERS > 1 each batch is split by
+    spl_set_id across that many parallel writer connections.
+
+    With parse_processes > 0 whole parts are parsed and transformed in a
+    process pool instead (JSON decoding and transform_record are CPU-bound
+    and would otherwise share one core under the GIL): the parse stage
+    submits each downloaded part and the transform stage collects the
+    transformed rows in submission order, so up to PIPELINE_QUEUE_SIZE parts
+    are parsed at once. Trial mode always parses in-thread so the record
+    limit stays exact.
+
+    Args:
+        fetcher: Label fetcher (downloads parts in completion order)
+        mapper: Connected label mapper (used only by the upsert stage)
+        parts: Parts to load, from discover_label_parts()
+        trial_mode: Stop after Config.TRIAL_LIMIT records
+        parse_processes: Parse/transform worker processes (0 = in-thread)
+
+    Returns:
+        (record stats, part counts, finished pipeline)
+    """
+    all_stats = {
+        'total_records': 0,
+        'inserted': 0,
+        'updated': 0,
+        'unchanged': 0,
+        'skipped': 0,
+        'collapsed': 0,
+        'rejected': 0,
+        'errors': 0
+    }
+    part_counts = {'processed': 0, 'failed': 0}
+    part_errors = {}
+    records_read = [0]
+    current_part = [None]
+    workers = max(1, Config.DB_WRITERS)
+    chunk_size = mapper.batch_size * workers
+    
+    pipeline = Pipeline('download', fetcher.download_parts(parts), queue_size=Config.PIPELINE_QUEUE_SIZE)
+    
+    def remove_part_file(part):
+        # Delete ZIP file to save disk space
+        if os.path.exists(part['local_path']):
+            fetcher.downloader.remove(part['local_path'])
+            logger.info(f"Cleaned up ZIP file: {part['filename']}")
+    
+    def parse(item):
+        part, ok = item
+        if not ok:
+            part_counts['failed'] += 1
+            logger.error(f"[Part {part['part_num']}] Download failed after retries, skipping")
+            return
+        
+        try:
+            # Apply trial mode limit if enabled
+            if trial_mode and records_read[0] >= Config.TRIAL_LIMIT:
+                logger.info(f"TRIAL MODE: Reached limit of {Config.TRIAL_LIMIT} records")
+                pipeline.stop_source()
+                return
+            
+            records = fetcher.iter_labels_from_zip(part['local_path'])
+            if trial_mode:
+                records = itertools.islice(records, Config.TRIAL_LIMIT - records_read[0])
+            
+            logger.info(f"Processing records from part {part['part_num']}...")
+            chunk = []
+            for record in records:
+                chunk.append(record)
+                records_read[0] += 1
+                if len(chunk) >= chunk_size:
+                    yield {'part': part, 'records': chunk}
+                    chunk = []
+            if chunk:
+                yield {'part': part, 'records': chunk}
+            yield {'part': part, 'done': True}
+        except Exception as e:
+            logger.error(f"Failed to read part {part['part_num']}: {e}")
+            yield {'part': part, 'done': True, 'failed': True}
+        finally:
+            remove_part_file(part)
+    
+    def submit(item):
+        part, ok = item
+        if not ok:
+            part_counts['failed'] += 1
+            logger.error(f"[Part {part['part_num']}] Download failed after retries, skipping")
+            return
+        logger.info(f"Submitting part {part['part_num']} to parse workers...")
+        yield {'part': part, 'future': executor.submit(transform_label_part, part['local_path'])}
+    
+    def collect(item):
+        part = item['part']
+        try:
+            rows, read, skipped = item['future'].result()
+        except Exception as e:
+            logger.error(f"Failed to read part {part['part_num']}: {e}")
+            yield {'part': part, 'done': True, 'failed': True}
+            return
+        finally:
+            remove_part_file(part)
+        
+        yield {'part': part, 'records': [], 'read': read, 'skipped': skipped}
+        for start in range(0, len(rows), chunk_size):
+            yield {'part': part, 'records': rows[start:start + chunk_size], 'read': 0, 'skipped': 0}
+        yield {'part': part, 'done': True}
+    
+    def transform(item):
+        if 'records' in item:
+            records, skipped = mapper.transform_records(item['records'])
+            item = {
+                'part': item['part'],
+                'records': records,
+                'read': len(item['records']),
+                'skipped': skipped,
+            }
+        yield item
+    
+    def write(records):
+        batch_stats = writer.write_batch(records)
+        all_stats['inserted'] += batch_stats['inserted']
+        all_stats['updated'] += batch_stats['updated']
+        all_stats['unchanged'] += batch_stats['unchanged']
+        all_stats['collapsed'] += batch_stats['collapsed']
+        all_stats['rejected'] += batch_stats['rejected']
+        all_stats['errors'] += batch_stats['errors']
+        url = current_part[0]['url']
+        part_errors[url] = part_errors.get(url, 0) + batch_stats['errors']
+    
+    def upsert(item):
+        part = item['part']
+        if item.get('done'):
+            # A DB batch never spans parts: write this part's tail first
+            batches.close()
+            if item.get('failed'):
+                part_counts['failed'] += 1
+                return
+            part_counts['processed'] += 1
+            # Only an error-free, complete part is remembered as processed
+            if part_errors.get(part['url'], 0) == 0 and not trial_mode:
+                fetcher.validators.commit(part['url'])
+            logger.info(f"[Part {part['part_num']}] Done | Cumulative Stats: "
+                       f"Processed: {all_stats['total_records']} | "
+                       f"Inserted: {all_stats['inserted']} | "
+                       f"Updated: {all_stats['updated']} | "
+                       f"Unchanged: {all_stats['unchanged']} | "
+                       f"Skipped: {all_stats['skipped']} | "
+                       f"Collapsed: {all_stats['collapsed']} | "
+                       f"Rejected: {all_stats['rejected']} | "
+                       f"Errors: {all_stats['errors']}")
+            return
+        
+        all_stats['total_records'] += item['read']
+        all_stats['skipped'] += item['skipped']
+        current_part[0] = part
+        for record in item['records']:
+            batches.add(record)
+    
+    executor = None
+    if parse_processes > 0 and not trial_mode:
+        logger.info(f"Parsing parts with {parse_processes} worker processes")
+        # spawn rather than fork: workers start while download threads are running
+        executor = ProcessPoolExecutor(
+            max_workers=parse_processes,
+            mp_context=multiprocessing.get_context('spawn')
+        )
+        pipeline.add_stage('parse', submit)
+        pipeline.add_stage('transform', collect)
+    else:
+        pipeline.add_stage('parse', parse)
+        pipeline.add_stage('transform', transform)
+    pipeline.add_stage('upsert', upsert)
+    
+    writer = mapper.sharded_writer(workers) if workers > 1 else mapper
+    if workers > 1:
+        logger.info(f"Writing with {workers} parallel DB writers")
+    batches = BatchAccumulator(
+        write,
+        max_rows=chunk_size,
+        max_bytes=Config.BATCH_MAX_BYTES * workers,
+        max_seconds=Config.BATCH_MAX_SECONDS,
+        size_of=lambda record: estimate_size(mapper.row_values(record)),
+    )
+    try:
+        pipeline.run()
+        batches.close()
+        logger.info(f"Batch flushes by trigger: {batches.stats()}")
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+        if writer is not mapper:
+            writer.close()
+    
+    return all_stats, part_counts, pipeline
+
+
 def main():
     """Main execution function for FDA Label data fetching and processing"""
     start_time = datetime.now()
@@ -41,106 +253,42 @@ def main():
         try:
             initial_count = mapper.get_table_count()
             logger.info(f"Initial database count: {initial_count}")
+            # Don't hold a connection idle through the downloads; the upsert
+            # stage checks one out of the pool when the first batch arrives
+            mapper.close()
             
             # Step 1: Fetch and process incrementally
             fetcher = FDALabelFetcher()
             
             logger.info("Starting label data download and processing...")
             logger.info("=" * 80)
-            logger.info("Processing files incrementally to save memory")
+            logger.info("Pipelined download -> parse -> transform -> upsert")
             logger.info("=" * 80)
             
-            # Get metadata
-            total_estimated = fetcher.get_metadata()
-            if total_estimated:
-                estimated_files = fetcher.calculate_required_files(total_estimated)
-            else:
-                logger.warning("Could not get metadata, will download until 404")
-                estimated_files = 100
-            
-            # Process each file immediately after download
-            all_stats = {
-                'total_records': 0,
-                'inserted': 0,
-                'duplicates': 0,
-                'skipped': 0,
-                'errors': 0
-            }
+            unchanged_parts = 0
+            pending_parts = []
+            for part in fetcher.discover_label_parts():
+                if fetcher.validators.matches_export(part['url'], part['export_date']):
+                    logger.info(f"[Part {part['part_num']}] {part['filename']} already loaded for export {part['export_date']}, skipping")
+                    unchanged_parts += 1
+                    continue
+                pending_parts.append(part)
             
-            records_processed = 0
+            logger.info(f"Downloading {len(pending_parts)} parts with {fetcher.download_workers} workers...")
+            all_stats, part_counts, pipeline = run_label_pipeline(fetcher, mapper, pending_parts, trial_mode)
+            parts_processed = part_counts['processed']
+            failed_parts = part_counts['failed']
+            pipeline.log_report()
             
-            for part_num in range(1, estimated_files + 10):
-                # Try different file name patterns
-                patterns = [
-                    f"drug-label-{part_num:04d}-of-{estimated_files:04d}.json.zip",
-                    f"drug-label-{part_num:04d}-of-{estimated_files+5:04d}.json.zip",
-                    f"drug-label-{part_num:04d}-of-{estimated_files+10:04d}.json.zip",
-                ]
-                
-                file_records = None
-                for pattern in patterns:
-                    file_url = fetcher.base_url + pattern
-                    local_path = os.path.join(fetcher.output_dir, pattern)
-                    
-                    # Check if already exists
-                    if not os.path.exists(local_path):
-                        try:
-                            response = requests.head(file_url, timeout=10)
-                            if response.status_code == 200:
-                                logger.info(f"[Part {part_num}] Downloading {pattern}...")
-                                if fetcher.download_file(file_url, local_path):
-                                    file_records = fetcher.extract_labels_from_zip(local_path)
-                                    # Delete ZIP file immediately to save disk space
-                                    os.remove(local_path)
-                                    logger.info(f"Cleaned up ZIP file: {pattern}")
-                                    break
-                        except:
-                            continue
-                    else:
-                        logger.info(f"[Part {part_num}] Already exists, extracting...")
-                        file_records = fetcher.extract_labels_from_zip(local_path)
-                        os.remove(local_path)
-                        logger.info(f"Cleaned up ZIP file: {pattern}")
-                        break
-                
-                if not file_records and part_num > estimated_files:
-                    logger.info(f"No more files found after part {part_num-1}")
-                    break
-                
-                if not file_records:
-                    continue
-                
-                # Apply trial mode limit if enabled
-                if trial_mode and records_processed >= Config.TRIAL_LIMIT:
-                    logger.info(f"TRIAL MODE: Reached limit of {Config.TRIAL_LIMIT} records")
-                    break
-                
-                if trial_mode:
-                    remaining = Config.TRIAL_LIMIT - records_processed
-                    if len(file_records) > remaining:
-                        file_records = file_records[:remaining]
-                
-                # Process this batch immediately
-                logger.info(f"Processing batch of {len(file_records)} records from part {part_num}...")
-                batch_stats = mapper.process_fda_records(file_records)
-                
-                # Aggregate stats
-                all_stats['total_records'] += batch_stats['total_records']
-                all_stats['inserted'] += batch_stats['inserted']
-                all_stats['duplicates'] += batch_stats.get('duplicates', batch_stats.get('skipped', 0))
-                all_stats['skipped'] += batch_stats['skipped']
-                all_stats['errors'] += batch_stats['errors']
-                
-                records_processed += len(file_records)
-                
-                logger.info(f"Cumulative Stats: Processed: {all_stats['total_records']} | "
-                           f"Inserted: {all_stats['inserted']} | "
-                           f"Duplicates: {all_stats['duplicates']} | "
-                           f"Skipped: {all_stats['skipped']} | "
-                           f"Errors: {all_stats['errors']}")
-                
-                # Free memory
-                file_records = None
+            if parts_processed == 0 and failed_parts == 0 and unchanged_parts > 0:
+                logger.info("=" * 80)
+                logger.info("FDA Drug Label Data Fetcher - Source unchanged, nothing to do")
+                logger.info("=" * 80)
+                logger.info(f"Unchanged parts: {unchanged_parts}")
+                logger.info(f"Duration: {datetime.now() - start_time}")
+                logger.info("Set FORCE_DOWNLOAD=true to reprocess the current export")
+                logger.info("=" * 80)
+                return Config.SOURCE_UNCHANGED_EXIT_CODE
             
             final_count = mapper.get_table_count()
             
@@ -149,9 +297,18 @@ def main():
             logger.info("=" * 80)
             logger.info(f"Total Records Processed: {all_stats['total_records']}")
             logger.info(f"Successfully Inserted: {all_stats['inserted']}")
-            logger.info(f"Duplicates Skipped: {all_stats['duplicates']}")
+            logger.info(f"Updated: {all_stats['updated']}")
+            logger.info(f"Unchanged: {all_stats['unchanged']}")
             logger.info(f"Skipped (Insufficient Data): {all_stats['skipped']}")
+            logger.info(f"Collapsed (Duplicate Keys in Batch): {all_stats['collapsed']}")
+            logger.info(f"Rejected by Database: {all_stats['rejected']}")
+            if all_stats['rejected']:
+                logger.info(f"Rejected rows written to: {Config.LABEL_REJECT_FILE}")
             logger.info(f"Errors: {all_stats['errors']}")
+            logger.info(f"Parts Processed: {parts_processed}")
+            logger.info(f"Parts Unchanged (skipped): {unchanged_parts}")
+            logger.info(f"Parts Failed: {failed_parts}")
+            logger.info(f"Row Count Mode: {Config.ROW_COUNT_MODE}")
             logger.info(f"Database Count Before: {initial_count}")
             logger.info(f"Database Count After: {final_count}")
             logger.info(f"Net Increase: {final_count - initial_count}")
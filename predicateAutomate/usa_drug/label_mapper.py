@@ -1,46 +1,83 @@
-import psycopg2
-import psycopg2.extras
-import json
 import logging
+from collections import namedtuple
 from datetime import datetime
-from typing import List, Dict, Optional
+from typing import Iterable, List, Dict, Optional, Sequence, Tuple, Union
 from config import Config
+from common.batching import BatchAccumulator, estimate_size
+from common.db import CONNECTION_ERRORS, DBSession
+from common.migrations import verify_indexes
+from common.row_counts import RowCounter
+from json_stream import append_json_lines, iter_zip_results
+from pg_copy import CopyStream
+from common.sharded_writer import ShardedWriter
 
 logger = logging.getLogger(__name__)
 
+# Compact transformed label row; its fields are FDALabelMapper.STAGE_COLUMNS
+LabelRow = namedtuple('LabelRow', [
+    'spl_id',
+    'spl_set_id',
+    'registration_number',
+    'generic_name_label',
+    'manufacturer_label',
+    'brand_name',
+    'indications_and_usage',
+    'effective_time',
+])
+
 
 class FDALabelMapper:
     """Maps FDA drug label data to source.usa_drug_label table"""
+
+    # Columns streamed into the COPY staging table, in COPY order
+    STAGE_COLUMNS = LabelRow._fields
+
+    CONFLICT_KEY_COLUMNS = ('spl_id', 'spl_set_id', 'registration_number')
+
+    # Unique index behind CONFLICT_KEY_COLUMNS; created by migrations
+    REQUIRED_INDEXES = ('source.uk_usa_drug_label_spl_ids',)
+
+    @classmethod
+    def row_values(cls, record: Union[Dict, Sequence]) -> tuple:
+        """Column values of a transformed record (dict or LabelRow) in STAGE_COLUMNS order"""
+        if isinstance(record, dict):
+            return tuple(record[c] for c in cls.STAGE_COLUMNS)
+        return tuple(record)
     
-    def __init__(self, batch_size=1000):
-        self.conn = None
-        self.cursor = None
+    def __init__(self, batch_size=1000, load_mode=Config.LOAD_MODE):
+        self.db = DBSession(bulk=True)
         self.batch_size = batch_size
+        self.load_mode = load_mode
+        self.row_counter = RowCounter('source.usa_drug_label', Config.ROW_COUNT_MODE)
+        
+    @property
+    def conn(self):
+        """Pooled connection, checked out on first use"""
+        return self.db.conn
+
+    @property
+    def cursor(self):
+        return self.db.cursor
         
     def connect(self):
-        """Establish database connection"""
-        try:
-            self.conn = psycopg2.connect(
-                host=Config.DB_HOST,
-                port=Config.DB_PORT,
-                database=Config.DB_NAME,
-                user=Config.DB_USER,
-                password=Config.DB_PASSWORD
-            )
-            self.cursor = self.conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-            logger.info("Database connection established")
-            return True
-        except Exception as e:
-            logger.error(f"Failed to connect to database: {e}")
+        """
+        Verify the database is reachable (the connection itself is checked out
+        lazily) and that REQUIRED_INDEXES exist
+        """
+        if not self.db.check():
+            return False
+        required = self.REQUIRED_INDEXES + self.row_counter.required_indexes
+        indexes_ok = verify_indexes(self.cursor, required, type(self).__name__)
+        self.db.rollback()
+        if not indexes_ok:
             return False
+        logger.info("Database connection established")
+        return True
     
     def close(self):
-        """Close database connection"""
-        if self.cursor:
-            self.cursor.close()
-        if self.conn:
-            self.conn.close()
-        logger.info("Database connection closed")
+        """Return the connection to the pool"""
+        self.db.release()
+        logger.info("Database connection returned to pool")
 
     def transform_record(self, fda_record: Dict) -> Optional[Dict]:
         """
@@ -85,6 +122,10 @@ class FDALabelMapper:
                 brand_names = openfda['brand_name']
                 brand_name = brand_names[0] if isinstance(brand_names, list) and brand_names else brand_names
             
+            effective_time = fda_record.get('effective_time')
+            if effective_time and len(str(effective_time)) > 8:
+                effective_time = str(effective_time)[:8]
+            
             indications_and_usage = None
             if fda_record.get('indications_and_usage'):
                 indications = fda_record['indications_and_usage']
@@ -121,7 +162,8 @@ class FDALabelMapper:
                 'generic_name_label': generic_name_label,
                 'manufacturer_label': manufacturer_label,
                 'brand_name': brand_name,
-                'indications_and_usage': indications_and_usage
+                'indications_and_usage': indications_and_usage,
+                'effective_time': effective_time
             }
             
             return record
@@ -135,13 +177,13 @@ class FDALabelMapper:
         Batch upsert records using PostgreSQL's ON CONFLICT clause
         
         Args:
-            records: List of transformed records
+            records: List of transformed records (dicts or LabelRow tuples)
             
         Returns:
             Dict with inserted, updated, and error counts
         """
         if not records:
-            return {'inserted': 0, 'updated': 0, 'errors': 0}
+            return {'inserted': 0, 'updated': 0, 'unchanged': 0, 'errors': 0}
         
         # Use INSERT ... ON CONFLICT for true upsert
         upsert_query = """
@@ -152,7 +194,8 @@ class FDALabelMapper:
                 generic_name_label,
                 manufacturer_label,
                 brand_name,
-                indications_and_usage
+                indications_and_usage,
+                effective_time
             ) VALUES %s
             ON CONFLICT (spl_id, spl_set_id, registration_number)
             DO UPDATE SET
@@ -160,33 +203,24 @@ class FDALabelMapper:
                 manufacturer_label = EXCLUDED.manufacturer_label,
                 brand_name = EXCLUDED.brand_name,
                 indications_and_usage = EXCLUDED.indications_and_usage,
+                effective_time = EXCLUDED.effective_time,
                 updated_at = CURRENT_TIMESTAMP
             WHERE (
                 source.usa_drug_label.generic_name_label IS DISTINCT FROM EXCLUDED.generic_name_label OR
                 source.usa_drug_label.manufacturer_label IS DISTINCT FROM EXCLUDED.manufacturer_label OR
                 source.usa_drug_label.brand_name IS DISTINCT FROM EXCLUDED.brand_name OR
-                source.usa_drug_label.indications_and_usage IS DISTINCT FROM EXCLUDED.indications_and_usage
+                source.usa_drug_label.indications_and_usage IS DISTINCT FROM EXCLUDED.indications_and_usage OR
+                source.usa_drug_label.effective_time IS DISTINCT FROM EXCLUDED.effective_time
             )
             RETURNING spl_id, spl_set_id, registration_number,
                      (xmax = 0) AS inserted
         """
         
-        stats = {'inserted': 0, 'updated': 0, 'errors': 0}
+        stats = {'inserted': 0, 'updated': 0, 'unchanged': 0, 'errors': 0}
         
         try:
             # Prepare values for batch insert
-            values = [
-                (
-                    r['spl_id'],
-                    r['spl_set_id'],
-                    r['registration_number'],
-                    r['generic_name_label'],
-                    r['manufacturer_label'],
-                    r['brand_name'],
-                    r['indications_and_usage']
-                )
-                for r in records
-            ]
+            values = [self.row_values(r) for r in records]
             from psycopg2.extras import execute_values
             
             results = execute_values(
@@ -203,6 +237,7 @@ class FDALabelMapper:
                     stats['inserted'] += 1
                 else:
                     stats['updated'] += 1
+            stats['unchanged'] = len(records) - stats['inserted'] - stats['updated']
                     
         except Exception as e:
             logger.error(f"Error in batch upsert: {e}")
@@ -211,31 +246,277 @@ class FDALabelMapper:
             
         return stats
 
-    def process_fda_records(self, fda_records: List[Dict]) -> Dict:
+    def copy_upsert_records(self, records: Iterable[Dict]) -> Dict:
+        """
+        Stream records into a temp staging table with COPY and merge them into
+        source.usa_drug_label with a single INSERT ... ON CONFLICT DO UPDATE
+
+        The caller is responsible for committing.
+
+        Args:
+            records: Iterable of transformed records, dicts or LabelRow tuples (consumed lazily)
+
+        Returns:
+            Dict with staged, inserted, updated and unchanged counts
+        """
+        columns = ', '.join(self.STAGE_COLUMNS)
+        key_columns = ', '.join(self.CONFLICT_KEY_COLUMNS)
+
+        self.cursor.execute(f"""
+            CREATE TEMP TABLE usa_drug_label_stage ON COMMIT DROP AS
+            SELECT {columns} FROM source.usa_drug_label WITH NO DATA
+        """)
+
+        stream = CopyStream(self.row_values(record) for record in records)
+        self.cursor.copy_expert(
+            f"COPY usa_drug_label_stage ({columns}) FROM STDIN",
+            stream
+        )
+
+        self.cursor.execute(f"""
+            WITH merged AS (
+                INSERT INTO source.usa_drug_label ({columns})
+                SELECT DISTINCT ON ({key_columns}) {columns}
+                FROM usa_drug_label_stage
+                ORDER BY {key_columns}, effective_time DESC NULLS LAST
+                ON CONFLICT (spl_id, spl_set_id, registration_number)
+                DO UPDATE SET
+                    generic_name_label = EXCLUDED.generic_name_label,
+                    manufacturer_label = EXCLUDED.manufacturer_label,
+                    brand_name = EXCLUDED.brand_name,
+                    indications_and_usage = EXCLUDED.indications_and_usage,
+                    effective_time = EXCLUDED.effective_time,
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE (
+                    source.usa_drug_label.generic_name_label IS DISTINCT FROM EXCLUDED.generic_name_label OR
+                    source.usa_drug_label.manufacturer_label IS DISTINCT FROM EXCLUDED.manufacturer_label OR
+                    source.usa_drug_label.brand_name IS DISTINCT FROM EXCLUDED.brand_name OR
+                    source.usa_drug_label.indications_and_usage IS DISTINCT FROM EXCLUDED.indications_and_usage OR
+                    source.usa_drug_label.effective_time IS DISTINCT FROM EXCLUDED.effective_time
+                )
+                RETURNING (xmax = 0) AS inserted
+            )
+            SELECT
+                COUNT(*) FILTER (WHERE inserted) AS inserted,
+                COUNT(*) FILTER (WHERE NOT inserted) AS updated
+            FROM merged
+        """)
+        result = self.cursor.fetchone()
+
+        staged = stream.rows_written
+        return {
+            'staged': staged,
+            'inserted': result['inserted'],
+            'updated': result['updated'],
+            'unchanged': staged - result['inserted'] - result['updated'],
+        }
+
+    def transform_records(self, fda_records: Iterable[Dict]) -> Tuple[List[Dict], int]:
+        """
+        Transform a chunk of raw label records
+
+        Returns:
+            (transformed records, number of records skipped)
+        """
+        records = []
+        skipped = 0
+        for fda_record in fda_records:
+            record = self.transform_record(fda_record)
+            if record:
+                records.append(record)
+            else:
+                skipped += 1
+        return records, skipped
+
+    def write_batch(self, records: List[Union[Dict, LabelRow]]) -> Dict:
+        """
+        Upsert and commit one batch of transformed records
+
+        A batch the database rejects is bisected under savepoints until the
+        offending rows are isolated; those are appended to LABEL_REJECT_FILE
+        with their error and every other row still commits. One bad row costs
+        about 2 x log2(batch size) extra statements. If the connection itself
+        fails, the batch is rolled back and counted as errors.
+
+        Records sharing a conflict key are collapsed to the newest one first,
+        since ON CONFLICT DO UPDATE cannot touch the same row twice in one
+        statement.
+
+        Returns:
+            Dict with inserted, updated, unchanged, collapsed, rejected and
+            errors counts
+        """
+        records, collapsed = self.collapse_duplicates(records)
+        stats = {'inserted': 0, 'updated': 0, 'unchanged': 0, 'collapsed': collapsed, 'rejected': 0, 'errors': 0}
+        upsert = self.copy_upsert_records if self.load_mode == 'copy' else self.batch_upsert_records
+        try:
+            self._upsert_isolating_errors(records, upsert, stats)
+            self.row_counter.in_transaction(self.cursor.execute, stats['inserted'])
+            self.conn.commit()
+            self.row_counter.committed(stats['inserted'])
+            if stats['rejected']:
+                logger.warning(f"Rejected {stats['rejected']} rows, written to {Config.LABEL_REJECT_FILE}")
+            return stats
+        except Exception as e:
+            logger.error(f"Error processing batch: {e}")
+            self.db.rollback()
+            return {'inserted': 0, 'updated': 0, 'unchanged': 0, 'collapsed': collapsed, 'rejected': 0,
+                    'errors': len(records)}
+
+    def collapse_duplicates(self, records: List[Union[Dict, LabelRow]]) -> Tuple[List[Union[Dict, LabelRow]], int]:
+        """
+        Keep one record per conflict key: the one with the newest
+        effective_time (the later one on a tie)
+
+        Returns:
+            (records in first-seen key order, number of records dropped)
+        """
+        newest = {}
+        for record in records:
+            key = self.conflict_key(record)
+            kept = newest.get(key)
+            if kept is None or self._effective_time(record) >= self._effective_time(kept):
+                newest[key] = record
+        return list(newest.values()), len(records) - len(newest)
+
+    @staticmethod
+    def _effective_time(record: Union[Dict, LabelRow]) -> str:
+        effective_time = record['effective_time'] if isinstance(record, dict) else record.effective_time
+        return effective_time or ''
+
+    def _upsert_isolating_errors(self, records: List[Union[Dict, LabelRow]], upsert, stats: Dict):
+        """Run upsert under a savepoint; on failure roll back to it and retry each half with batch_upsert_records"""
+        self.cursor.execute("SAVEPOINT label_batch")
+        try:
+            batch_stats = upsert(records)
+        except CONNECTION_ERRORS:
+            raise
+        except Exception as e:
+            self.cursor.execute("ROLLBACK TO SAVEPOINT label_batch")
+            if len(records) == 1:
+                self._reject(records[0], e)
+                stats['rejected'] += 1
+            else:
+                middle = len(records) // 2
+                self._upsert_isolating_errors(records[:middle], self.batch_upsert_records, stats)
+                self._upsert_isolating_errors(records[middle:], self.batch_upsert_records, stats)
+            self.cursor.execute("RELEASE SAVEPOINT label_batch")
+            return
+        self.cursor.execute("RELEASE SAVEPOINT label_batch")
+        stats['inserted'] += batch_stats['inserted']
+        stats['updated'] += batch_stats['updated']
+        stats['unchanged'] += batch_stats['unchanged']
+
+    def _reject(self, record: Union[Dict, LabelRow], error: Exception):
+        """Quarantine a row the database refused to LABEL_REJECT_FILE"""
+        row = dict(zip(self.STAGE_COLUMNS, self.row_values(record)))
+        logger.error(f"Rejected label spl_id={row['spl_id']}: {str(error).strip()}")
+        append_json_lines(Config.LABEL_REJECT_FILE, [{
+            'rejected_at': datetime.now().isoformat(),
+            'error': str(error).strip(),
+            'pgcode': getattr(error, 'pgcode', None),
+            'record': row,
+        }])
+
+    def conflict_key(self, record: Union[Dict, LabelRow]) -> tuple:
+        """ON CONFLICT key of a transformed record, with NULLs as '' so keys sort"""
+        if isinstance(record, dict):
+            return tuple(record[c] or '' for c in self.CONFLICT_KEY_COLUMNS)
+        return tuple(getattr(record, c) or '' for c in self.CONFLICT_KEY_COLUMNS)
+
+    def sharded_writer(self, workers: int) -> ShardedWriter:
+        """
+        Parallel writer: batches are split by spl_set_id across `workers`
+        copies of this mapper, each with its own pooled connection
+
+        Rows are sorted by conflict key within each shard so concurrent
+        upserts lock index entries in a consistent order.
+        """
+        writers = [FDALabelMapper(batch_size=self.batch_size, load_mode=self.load_mode) for _ in range(workers)]
+        for writer in writers:
+            writer.row_counter = self.row_counter
+        return ShardedWriter(
+            writers,
+            shard_key=lambda record: self.conflict_key(record)[1],
+            sort_key=self.conflict_key,
+        )
+
+    def _flush_batch(self, writer, batch: List[Dict], stats: Dict):
+        """Write one batch through writer, folding the outcome into stats"""
+        batch_stats = writer.write_batch(batch)
+        stats['inserted'] += batch_stats['inserted']
+        stats['updated'] += batch_stats['updated']
+        stats['unchanged'] += batch_stats['unchanged']
+        stats['collapsed'] += batch_stats['collapsed']
+        stats['rejected'] += batch_stats['rejected']
+        stats['errors'] += batch_stats['errors']
+        
+        logger.info(
+            f"Progress: {stats['total_records']} records | "
+            f"Batch: +{batch_stats['inserted']} inserted, "
+            f"+{batch_stats['updated']} updated | "
+            f"Total - Inserted: {stats['inserted']}, "
+            f"Updated: {stats['updated']}, "
+            f"Skipped: {stats['skipped']}, "
+            f"Collapsed: {stats['collapsed']}, "
+            f"Rejected: {stats['rejected']}, "
+            f"Errors: {stats['errors']}"
+        )
+
+    def process_fda_records(self, fda_records: Iterable[Dict]) -> Dict:
         """
         Process FDA label records and insert into database using batch operations
         
+        With DB_WRITERS > 1, batches of batch_size x DB_WRITERS records are
+        split by spl_set_id and written by that many connections in parallel.
+        With LOAD_MODE=copy each batch is merged through a COPY staging table
+        (see write_batch).
+        
         Args:
-            fda_records: List of raw FDA label records
+            fda_records: Iterable of raw FDA label records (a list or a stream)
             
         Returns:
             Statistics dict
         """
         stats = {
-            'total_records': len(fda_records),
+            'total_records': 0,
             'inserted': 0,
             'updated': 0,
+            'unchanged': 0,
             'skipped': 0,
+            'collapsed': 0,
+            'rejected': 0,
             'errors': 0
         }
         
-        total_records = len(fda_records)
-        progress_interval = max(1, total_records // 20)
-        
-        # Process in batches
-        batch = []
+        workers = max(1, Config.DB_WRITERS)
+        writer = self.sharded_writer(workers) if workers > 1 else self
+        try:
+            self._process_batches(fda_records, self.batch_accumulator(writer, workers, stats), stats)
+        finally:
+            if writer is not self:
+                writer.close()
         
-        for idx, fda_record in enumerate(fda_records, 1):
+        return stats
+
+    def batch_accumulator(self, writer, workers: int, stats: Dict) -> BatchAccumulator:
+        """
+        Accumulator flushing batches through writer into stats, bounded by
+        batch_size rows and BATCH_MAX_BYTES of payload per writer and by
+        BATCH_MAX_SECONDS
+        """
+        return BatchAccumulator(
+            lambda batch: self._flush_batch(writer, batch, stats),
+            max_rows=self.batch_size * workers,
+            max_bytes=Config.BATCH_MAX_BYTES * workers,
+            max_seconds=Config.BATCH_MAX_SECONDS,
+            size_of=lambda record: estimate_size(self.row_values(record)),
+        )
+
+    def _process_batches(self, fda_records: Iterable[Dict], batches: BatchAccumulator, stats: Dict):
+        """Transform records and queue them on batches"""
+        for fda_record in fda_records:
+            stats['total_records'] += 1
             try:
                 record = self.transform_record(fda_record)
                 
@@ -243,55 +524,52 @@ class FDALabelMapper:
                     stats['skipped'] += 1
                     continue
                 
-                batch.append(record)
-                
-                # Process batch when it reaches batch_size or at the end
-                if len(batch) >= self.batch_size or idx == total_records:
-                    try:
-                        # Batch upsert
-                        batch_stats = self.batch_upsert_records(batch)
-                        stats['inserted'] += batch_stats['inserted']
-                        stats['updated'] += batch_stats['updated']
-                        stats['errors'] += batch_stats['errors']
-                        self.conn.commit()
-                        
-                        logger.info(
-                            f"Progress: {idx}/{total_records} records ({idx*100//total_records}%) | "
-                            f"Batch: +{batch_stats['inserted']} inserted, "
-                            f"+{batch_stats['updated']} updated | "
-                            f"Total - Inserted: {stats['inserted']}, "
-                            f"Updated: {stats['updated']}, "
-                            f"Skipped: {stats['skipped']}, "
-                            f"Errors: {stats['errors']}"
-                        )
-                        
-                        batch = []
-                        
-                    except Exception as e:
-                        logger.error(f"Error processing batch: {e}")
-                        stats['errors'] += len(batch)
-                        self.conn.rollback()
-                        batch = []
+                batches.add(record)
                         
             except Exception as e:
                 logger.error(f"Error transforming record: {e}")
                 stats['skipped'] += 1
         
-        return stats
+        batches.close()
 
     def get_table_count(self) -> int:
-        """Get total count in source.usa_drug_label table"""
+        """Count of source.usa_drug_label rows, exact or estimated depending on ROW_COUNT_MODE"""
         try:
-            self.cursor.execute(
-                "SELECT COUNT(*) as count FROM source.usa_drug_label"
-            )
-            result = self.cursor.fetchone()
-            return result['count']
+            return self.row_counter.count(self.cursor)
         except Exception as e:
             logger.error(f"Error getting table count: {e}")
+            self.db.rollback()
             return 0
 
 
+def transform_label_part(zip_path: str) -> Tuple[List[LabelRow], int, int]:
+    """
+    Parse and transform one downloaded label part
+
+    Module-level so it can run in a ProcessPoolExecutor worker: JSON decoding
+    and transform_record are CPU-bound, and only the compact LabelRow tuples
+    are pickled back to the parent, which owns the database connection.
+
+    Args:
+        zip_path: Path to the downloaded part ZIP file
+
+    Returns:
+        (transformed rows, records read, records skipped)
+    """
+    mapper = FDALabelMapper()
+    rows = []
+    read = 0
+    skipped = 0
+    for fda_record in iter_zip_results(zip_path):
+        read += 1
+        record = mapper.transform_record(fda_record)
+        if record:
+            rows.append(LabelRow(**record))
+        else:
+            skipped += 1
+    return rows, read, skipped
+
+
 def main():
     """Test the mapper"""
     mapper = FDALabelMapper(batch_size=1000)
@@ -1,10 +1,13 @@
+import itertools
 import json
 import logging
 import sys
 from datetime import datetime
-from fetcher import FDADrugFetcher
-from models import transform_to_flat_records
+from fetcher import FDADrugFetcher, RecordStatistics
+from json_stream import JSONArrayWriter
+from models import flatten_record
 from db_mapper import FDADrugDBMapper
+from normalized_mapper import FDADrugNormalizedMapper
 from config import Config
 
 
@@ -32,79 +35,115 @@ def main():
     try:
         fetcher = FDADrugFetcher()
         
-        # Download and fetch all data from bulk file
+        # Download the bulk file; records are then streamed from it in one pass
         logger.info("Starting bulk data download and processing...")
-        all_records = fetcher.fetch_all_data(
-            save_intermediate=True, 
-            max_skip=Config.FDA_MAX_SKIP  # Kept for compatibility, ignored in bulk download
-        )
-        
-        total_records = len(all_records)
-        logger.info(f"Total records downloaded: {total_records}")
-        
-        # Apply trial mode limit if enabled (after download)
-        if trial_mode:
-            logger.info(f"TRIAL MODE: Limiting processing to first {Config.TRIAL_LIMIT} records")
-            all_records = all_records[:Config.TRIAL_LIMIT]
-            logger.info(f"Processing {len(all_records)} records (trial mode)")
-        else:
-            logger.info(f"Processing all {len(all_records)} records (production mode)")
-        
-        logger.info("Saving raw data...")
-        raw_file = fetcher.save_data(all_records)
-        logger.info(f"Raw data saved to: {raw_file}")
-        
-        logger.info("Generating statistics...")
-        stats = fetcher.get_statistics(all_records)
-        logger.info(f"Statistics: {json.dumps(stats, indent=2, default=str)}")
-        
-        stats_file = Config.RAW_DATA_FILE.replace('.json', '_stats.json')
-        with open(stats_file, 'w') as f:
-            json.dump(stats, f, indent=2, default=str)
-        logger.info(f"Statistics saved to: {stats_file}")
-        
-        logger.info("Transforming to flat records...")
-        flat_records = transform_to_flat_records(all_records)
-        logger.info(f"Transformed {len(flat_records)} flat records")
-        
-        processed_file = Config.PROCESSED_DATA_FILE
-        with open(processed_file, 'w') as f:
-            json.dump([record.dict() for record in flat_records], f, indent=2, default=str)
-        logger.info(f"Processed data saved to: {processed_file}")
-        
-        logger.info("=" * 80)
-        logger.info("Starting Database Insertion")
-        logger.info("=" * 80)
-        
-        mapper = FDADrugDBMapper()
-        
-        if not mapper.connect():
-            logger.error("Failed to connect to database. Skipping database insertion.")
-        else:
+        source = fetcher.iter_all_data()
+        try:
+            first_record = next(source, None)
+            
+            if fetcher.source_unchanged:
+                logger.info("=" * 80)
+                logger.info("FDA Drug Data Fetcher - Source unchanged, nothing to do")
+                logger.info("=" * 80)
+                logger.info(f"Duration: {datetime.now() - start_time}")
+                logger.info("Set FORCE_DOWNLOAD=true to reprocess the current export")
+                logger.info("=" * 80)
+                return Config.SOURCE_UNCHANGED_EXIT_CODE
+            
+            records = itertools.chain([first_record] if first_record is not None else [], source)
+            
+            # Apply trial mode limit if enabled
+            if trial_mode:
+                logger.info(f"TRIAL MODE: Limiting processing to first {Config.TRIAL_LIMIT} records")
+                records = itertools.islice(records, Config.TRIAL_LIMIT)
+            else:
+                logger.info("Processing all records (production mode)")
+            
+            if Config.DRUG_STORAGE_MODE == 'normalized':
+                logger.info("Storage mode: normalized (application/product/submission/openfda tables)")
+                mapper = FDADrugNormalizedMapper()
+            else:
+                mapper = FDADrugDBMapper()
+            connected = mapper.connect()
+            if not connected:
+                logger.error("Failed to connect to database. Skipping database insertion.")
+            
             try:
-                initial_count = mapper.get_table_count()
-                logger.info(f"Initial database count: {initial_count}")
+                statistics = RecordStatistics()
+                raw_file = Config.RAW_DATA_FILE
+                processed_file = Config.PROCESSED_DATA_FILE
                 
-                logger.info(f"Processing {len(all_records)} FDA records...")
-                db_stats = mapper.process_fda_records(all_records)
+                with JSONArrayWriter(raw_file, key='results') as raw_writer, \
+                        JSONArrayWriter(processed_file) as processed_writer:
+                    
+                    def stream_records():
+                        # Single pass: statistics, raw copy and processed file are
+                        # produced per record while the DB batcher consumes it
+                        for record in records:
+                            statistics.add(record)
+                            raw_writer.write(record)
+                            for flat_record in flatten_record(record):
+                                processed_writer.write(flat_record.dict())
+                            yield record
+                    
+                    db_stats = None
+                    if connected:
+                        initial_count = mapper.get_table_count()
+                        logger.info(f"Initial database count: {initial_count}")
+                        
+                        logger.info("=" * 80)
+                        logger.info("Streaming records into the database")
+                        logger.info("=" * 80)
+                        # Only a complete export can show which entries were withdrawn
+                        reconcile = Config.RECONCILE and not trial_mode and Config.DRUG_STORAGE_MODE == 'wide'
+                        db_stats = mapper.process_fda_records(stream_records(), reconcile=reconcile)
+                    else:
+                        for _ in stream_records():
+                            pass
+                    
+                    raw_writer.finish(meta={'results': {'total': raw_writer.count}})
                 
-                final_count = mapper.get_table_count()
+                logger.info(f"Total records streamed: {statistics.total_records}")
+                logger.info(f"Raw data saved to: {raw_file}")
+                logger.info(f"Processed data saved to: {processed_file} ({processed_writer.count} flat records)")
                 
-                logger.info("=" * 80)
-                logger.info("Database Insertion Statistics")
-                logger.info("=" * 80)
-                logger.info(f"FDA Records Processed: {db_stats['total_records']}")
-                logger.info(f"Total Entries (Submissions×Products): {db_stats['total_entries']}")
-                logger.info(f"Successfully Inserted: {db_stats['inserted']}")
-                logger.info(f"Duplicates Skipped: {db_stats['duplicates']}")
-                logger.info(f"Errors: {db_stats['errors']}")
-                logger.info(f"Database Count Before: {initial_count}")
-                logger.info(f"Database Count After: {final_count}")
-                logger.info(f"Net Increase: {final_count - initial_count}")
-                logger.info("=" * 80)
+                stats = statistics.result()
+                logger.info(f"Statistics: {json.dumps(stats, indent=2, default=str)}")
                 
+                stats_file = Config.RAW_DATA_FILE.replace('.json', '_stats.json')
+                with open(stats_file, 'w') as f:
+                    json.dump(stats, f, indent=2, default=str)
+                logger.info(f"Statistics saved to: {stats_file}")
+                
+                if db_stats is not None:
+                    final_count = mapper.get_table_count()
+                    
+                    logger.info("=" * 80)
+                    logger.info("Database Insertion Statistics")
+                    logger.info("=" * 80)
+                    logger.info(f"FDA Records Processed: {db_stats['total_records']}")
+                    logger.info(f"Total Entries (Submissions×Products): {db_stats['total_entries']}")
+                    logger.info(f"Successfully Inserted: {db_stats['inserted']}")
+                    logger.info(f"Updated: {db_stats['updated']}")
+                    logger.info(f"Unchanged: {db_stats['unchanged']}")
+                    logger.info(f"Retired (withdrawn from export): {db_stats['retired']}")
+                    logger.info(f"Errors: {db_stats['errors']}")
+                    logger.info(f"Row Count Mode: {Config.ROW_COUNT_MODE}")
+                    logger.info(f"Database Count Before: {initial_count}")
+                    logger.info(f"Database Count After: {final_count}")
+                    logger.info(f"Net Increase: {final_count - initial_count}")
+                    logger.info("=" * 80)
+                    
+                    # Only a complete, error-free load marks this export as processed
+                    if db_stats['errors'] == 0 and not trial_mode:
+                        fetcher.commit_validators()
+            
             finally:
-                mapper.close()
+                if connected:
+                    mapper.close()
+        finally:
+            # Closing the stream removes the downloaded ZIP file
+            source.close()
         
         end_time = datetime.now()
         duration = end_time - start_time
@@ -112,8 +151,8 @@ def main():
         logger.info("=" * 80)
         logger.info("FDA Drug Data Fetcher - Completed Successfully")
         logger.info("=" * 80)
-        logger.info(f"Total records fetched: {len(all_records)}")
-        logger.info(f"Total flat records: {len(flat_records)}")
+        logger.info(f"Total records fetched: {statistics.total_records}")
+        logger.info(f"Total flat records: {processed_writer.count}")
         logger.info(f"Unique sponsors: {stats['unique_sponsors']}")
         logger.info(f"Unique dosage forms: {stats['unique_dosage_forms']}")
         logger.info(f"Duration: {duration}")
@@ -137,4 +176,3 @@ def main():
 
 if __name__ == "__main__":
     sys.exit(main())
-
@@ -0,0 +1,91 @@
+import json
+import logging
+import os
+from typing import Dict, List, Optional
+import requests
+from config import Config
+from downloads import DownloadValidators, file_sha256
+
+logger = logging.getLogger(__name__)
+
+
+class DownloadManifest:
+    """
+    openFDA download manifest (download.json): exact part URLs, sizes,
+    record counts and export date for every bulk endpoint
+
+    The manifest is fetched at most once per instance with a conditional
+    request and cached in OUTPUT_DIR; if openFDA is unreachable the cached
+    copy is used. Setting FDA_MANIFEST_FILE (or passing fixture_path) serves
+    the manifest from a local file instead, e.g. usa_drug/fixtures/download.json
+    for tests and offline runs.
+    """
+
+    def __init__(self, session: requests.Session = None, validators: DownloadValidators = None,
+                 url: str = None, cache_path: str = None, fixture_path: str = None):
+        self.session = session or requests.Session()
+        self.validators = validators or DownloadValidators()
+        self.url = url or Config.FDA_DOWNLOAD_MANIFEST_URL
+        self.cache_path = cache_path or Config.MANIFEST_CACHE_FILE
+        self.fixture_path = fixture_path or Config.FDA_MANIFEST_FILE
+        self._data: Optional[Dict] = None
+
+    def _read(self, path: str) -> Dict:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def _fetch(self) -> Dict:
+        validators = self.validators
+        headers = validators.conditional_headers(self.url) if os.path.exists(self.cache_path) else {}
+        try:
+            response = self.session.get(self.url, timeout=30, headers=headers)
+            if response.status_code == 304:
+                logger.info("Download manifest unchanged, using cached copy")
+                return self._read(self.cache_path)
+            response.raise_for_status()
+            data = response.json()
+        except (requests.exceptions.RequestException, ValueError) as e:
+            if os.path.exists(self.cache_path):
+                logger.warning(f"Could not fetch download manifest ({e}), using cached copy")
+                return self._read(self.cache_path)
+            raise
+
+        Config.ensure_output_dir()
+        tmp_path = self.cache_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self.cache_path)
+        validators.stage(self.url, response.headers, file_sha256(self.cache_path))
+        validators.commit(self.url)
+        return data
+
+    def load(self) -> Dict:
+        """Return the manifest, fetching it on first use"""
+        if self._data is None:
+            if self.fixture_path:
+                logger.info(f"Loading download manifest from fixture: {self.fixture_path}")
+                self._data = self._read(self.fixture_path)
+            else:
+                logger.info(f"Fetching download manifest: {self.url}")
+                self._data = self._fetch()
+        return self._data
+
+    def endpoint(self, category: str, name: str) -> Dict:
+        """Manifest entry for an endpoint, e.g. endpoint('drug', 'label')"""
+        try:
+            return self.load()['results'][category][name]
+        except KeyError:
+            raise ValueError(f"Endpoint {category}/{name} not found in download manifest")
+
+    def export_date(self, category: str, name: str) -> Optional[str]:
+        """Date openFDA generated the endpoint's current export"""
+        return self.endpoint(category, name).get('export_date')
+
+    def partitions(self, category: str, name: str) -> List[Dict]:
+        """
+        Part files of an endpoint, in part order
+
+        Returns:
+            List of dicts with file (URL), size_mb, records and display_name
+        """
+        return list(self.endpoint(category, name).get('partitions', []))
@@ -1,4 +1,4 @@
-from typing import List, Optional
+from typing import Iterator, List, Optional
 from pydantic import BaseModel, Field
 from datetime import datetime
 
@@ -79,6 +79,46 @@ class ProcessedDrugData(BaseModel):
         }
 
 
+def flatten_record(record: dict) -> Iterator[ProcessedDrugData]:
+    """
+    Flattens one nested FDA record into one ProcessedDrugData per product
+    
+    Args:
+        record: Raw FDA drug record
+        
+    Yields:
+        Flattened ProcessedDrugData records
+    """
+    application_number = record.get('application_number', '')
+    sponsor_name = record.get('sponsor_name', '')
+    
+    submissions = record.get('submissions', [])
+    latest_submission = submissions[0] if submissions else {}
+    
+    products = record.get('products', [])
+    for product in products:
+        try:
+            yield ProcessedDrugData(
+                application_number=application_number,
+                sponsor_name=sponsor_name,
+                product_number=product.get('product_number', ''),
+                brand_name=product.get('brand_name', ''),
+                dosage_form=product.get('dosage_form', ''),
+                route=product.get('route') or None,
+                marketing_status=product.get('marketing_status', ''),
+                reference_drug=(product.get('reference_drug', 'No') == 'Yes'),
+                reference_standard=(product.get('reference_standard', 'No') == 'Yes'),
+                te_code=product.get('te_code'),
+                active_ingredients=product.get('active_ingredients', []),
+                latest_submission_type=latest_submission.get('submission_type'),
+                latest_submission_status=latest_submission.get('submission_status'),
+                latest_submission_date=latest_submission.get('submission_status_date')
+            )
+        except Exception as e:
+            print(f"Error processing product {product.get('product_number')}: {e}")
+            continue
+
+
 def transform_to_flat_records(fda_records: List[dict]) -> List[ProcessedDrugData]:
     """
     Transforms nested FDA records into flat records for database insertion
@@ -92,35 +132,6 @@ def transform_to_flat_records(fda_records: List[dict]) -> List[ProcessedDrugData
     flat_records = []
     
     for record in fda_records:
-        application_number = record.get('application_number', '')
-        sponsor_name = record.get('sponsor_name', '')
-        
-        submissions = record.get('submissions', [])
-        latest_submission = submissions[0] if submissions else {}
-        
-        products = record.get('products', [])
-        for product in products:
-            try:
-                flat_record = ProcessedDrugData(
-                    application_number=application_number,
-                    sponsor_name=sponsor_name,
-                    product_number=product.get('product_number', ''),
-                    brand_name=product.get('brand_name', ''),
-                    dosage_form=product.get('dosage_form', ''),
-                    route=product.get('route') or None,
-                    marketing_status=product.get('marketing_status', ''),
-                    reference_drug=(product.get('reference_drug', 'No') == 'Yes'),
-                    reference_standard=(product.get('reference_standard', 'No') == 'Yes'),
-                    te_code=product.get('te_code'),
-                    active_ingredients=product.get('active_ingredients', []),
-                    latest_submission_type=latest_submission.get('submission_type'),
-                    latest_submission_status=latest_submission.get('submission_status'),
-                    latest_submission_date=latest_submission.get('submission_status_date')
-                )
-                flat_records.append(flat_record)
-            except Exception as e:
-                print(f"Error processing product {product.get('product_number')}: {e}")
-                continue
+        flat_records.extend(flatten_record(record))
     
     return flat_records
-
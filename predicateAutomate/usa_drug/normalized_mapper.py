@@ -0,0 +1,398 @@
+import json
+import logging
+import re
+from typing import Dict, Iterable, List, Optional, Sequence
+import psycopg2.extras
+from config import Config
+from common.batching import BatchAccumulator, estimate_size
+from common.row_counts import RowCounter
+from common.sharded_writer import ShardedWriter
+from db_mapper import FDADrugDBMapper
+from key_index import content_fingerprint
+
+logger = logging.getLogger(__name__)
+
+
+class NormalizedTable:
+    """Column layout of one normalized table and how its rows are upserted"""
+
+    def __init__(self, name: str, columns: Sequence[str], key_columns: Sequence[str],
+                 casts: Dict[str, str] = None, fingerprinted: bool = True, key_index: str = None):
+        self.name = name
+        self.columns = tuple(columns)
+        self.key_columns = tuple(key_columns)
+        # Unique index on key_columns (the ON CONFLICT target)
+        self.key_index = key_index or f"{name}_pkey"
+        self.casts = casts or {}
+        self.fingerprinted = fingerprinted
+
+    def upsert_query(self) -> str:
+        columns = ', '.join(self.columns)
+        keys = ', '.join(self.key_columns)
+        if not self.fingerprinted:
+            # Content-addressed rows never change: only insert missing ones
+            return f"""
+                INSERT INTO {self.name} ({columns}) VALUES %s
+                ON CONFLICT ({keys}) DO NOTHING
+                RETURNING true AS inserted
+            """
+        set_clause = ',\n                '.join(
+            f"{c} = EXCLUDED.{c}" for c in self.columns if c not in self.key_columns
+        )
+        return f"""
+            INSERT INTO {self.name} ({columns}) VALUES %s
+            ON CONFLICT ({keys})
+            DO UPDATE SET
+                {set_clause},
+                updated_at = CURRENT_TIMESTAMP
+            WHERE {self.name}.row_fingerprint IS DISTINCT FROM EXCLUDED.row_fingerprint
+            RETURNING (xmax = 0) AS inserted
+        """
+
+    def template(self) -> str:
+        return '(' + ', '.join(f"%({c})s{self.casts.get(c, '')}" for c in self.columns) + ')'
+
+
+class FDADrugNormalizedMapper(FDADrugDBMapper):
+    """
+    Maps FDA drug data to the normalized source.usa_drug_application,
+    usa_drug_product, usa_drug_submission and usa_drug_openfda tables
+
+    The wide layout writes one row (and one json_data blob with the whole
+    openfda block) per submission x product pair; here each application,
+    product and submission is stored once and each distinct openfda block is
+    stored once, keyed by its content hash. source.usa_drug_data_normalized
+    presents the result with the columns of source.usa_drug_data. Field
+    formatting and connection handling are inherited from FDADrugDBMapper.
+    """
+
+    OPENFDA = NormalizedTable(
+        'source.usa_drug_openfda',
+        ['openfda_hash', 'openfda', 'spl_id', 'spl_set_id', 'generic_name', 'manufacturer'],
+        ['openfda_hash'],
+        casts={'openfda_hash': '::uuid', 'openfda': '::jsonb', 'spl_id': '::text[]', 'spl_set_id': '::text[]'},
+        fingerprinted=False,
+    )
+    APPLICATION = NormalizedTable(
+        'source.usa_drug_application',
+        ['registration_number', 'country_of_origin', 'application_type', 'registration_holder',
+         'openfda_hash', 'created_by', 'row_fingerprint'],
+        ['registration_number'],
+        casts={'openfda_hash': '::uuid', 'row_fingerprint': '::uuid'},
+    )
+    PRODUCT = NormalizedTable(
+        'source.usa_drug_product',
+        ['registration_number', 'product_number', 'product_name', 'ingredient_name', 'reference_drug',
+         'dosage_form', 'strength', 'route_administration', 'marketing_status', 'product', 'row_fingerprint'],
+        ['registration_number', 'product_number'],
+        casts={'product': '::jsonb', 'row_fingerprint': '::uuid'},
+    )
+    SUBMISSION = NormalizedTable(
+        'source.usa_drug_submission',
+        ['registration_number', 'submission_type', 'submission_number', 'submission_date',
+         'submission', 'row_fingerprint'],
+        # submission_date is part of the wide natural key too; it may be NULL,
+        # so the key is a NULLS NOT DISTINCT unique constraint, not a primary key
+        ['registration_number', 'submission_type', 'submission_number', 'submission_date'],
+        casts={'submission_date': '::date', 'submission': '::jsonb', 'row_fingerprint': '::uuid'},
+        key_index='source.uq_usa_drug_submission_key',
+    )
+
+    # (table, key of its rows in a transformed application), in FK order
+    TABLES = (
+        (OPENFDA, 'openfda'),
+        (APPLICATION, 'application'),
+        (PRODUCT, 'products'),
+        (SUBMISSION, 'submissions'),
+    )
+
+    # Key indexes are the ON CONFLICT targets
+    REQUIRED_INDEXES = tuple(table.key_index for table, _ in TABLES)
+
+    def __init__(self, batch_size=Config.BATCH_SIZE):
+        super().__init__(batch_size=batch_size, load_mode='batch', use_key_index=False, write_mode='standard')
+        self.table_stats: Dict[str, Dict] = {}
+        self.row_counters = {table.name: RowCounter(table.name, Config.ROW_COUNT_MODE) for table, _ in self.TABLES}
+
+    def transform_application(self, fda_record: Dict) -> Dict:
+        """
+        Transform one FDA application into its normalized rows
+
+        Args:
+            fda_record: Raw FDA record
+
+        Returns:
+            Dict with 'openfda' (0 or 1 rows), 'application' (1 row),
+            'products' and 'submissions' row lists, and 'entries' (the number
+            of submission x product pairs the wide layout would store)
+        """
+        application_number = fda_record.get('application_number', '')
+        sponsor_name = fda_record.get('sponsor_name', '')
+        openfda = fda_record.get('openfda', {}) or {}
+
+        openfda_rows = []
+        openfda_hash = None
+        if openfda:
+            openfda_hash = content_fingerprint(openfda)
+            openfda_rows.append({
+                'openfda_hash': openfda_hash,
+                'openfda': json.dumps(openfda),
+                'spl_id': self._as_list(openfda.get('spl_id')),
+                'spl_set_id': self._as_list(openfda.get('spl_set_id')),
+                'generic_name': self._first(openfda.get('generic_name')),
+                'manufacturer': self._first(openfda.get('manufacturer_name')),
+            })
+
+        application_type = None
+        match = re.match(r'^([A-Z]+)', application_number or '')
+        if match:
+            application_type = match.group(1)
+
+        application = {
+            'registration_number': application_number,
+            'country_of_origin': Config.COUNTRY_OF_ORIGIN,
+            'application_type': application_type,
+            'registration_holder': sponsor_name,
+            'openfda_hash': openfda_hash,
+            'created_by': None,
+        }
+        application['row_fingerprint'] = content_fingerprint(application)
+
+        products = []
+        for product in fda_record.get('products', []):
+            active_ingredients = product.get('active_ingredients', [])
+            row = {
+                'registration_number': application_number,
+                'product_number': product.get('product_number', ''),
+                'product_name': product.get('brand_name', ''),
+                'ingredient_name': self.format_ingredient_names(active_ingredients),
+                'reference_drug': product.get('reference_drug', 'No'),
+                'dosage_form': product.get('dosage_form', ''),
+                'strength': self.format_strength(active_ingredients),
+                'route_administration': product.get('route', ''),
+                'marketing_status': product.get('marketing_status', ''),
+                'product': json.dumps(product),
+            }
+            row['row_fingerprint'] = content_fingerprint(row)
+            products.append(row)
+
+        submissions = []
+        for submission in fda_record.get('submissions', []):
+            row = {
+                'registration_number': application_number,
+                'submission_type': submission.get('submission_type', ''),
+                'submission_number': submission.get('submission_number', ''),
+                'submission_date': self.format_submission_date(submission.get('submission_status_date')),
+                'submission': json.dumps(submission),
+            }
+            row['row_fingerprint'] = content_fingerprint(row)
+            submissions.append(row)
+
+        return {
+            'openfda': openfda_rows,
+            'application': [application],
+            'products': products,
+            'submissions': submissions,
+            'entries': len(products) * len(submissions),
+        }
+
+    @staticmethod
+    def _first(values) -> Optional[str]:
+        if isinstance(values, list):
+            return values[0] if values else None
+        return values or None
+
+    @staticmethod
+    def _as_list(values) -> List:
+        if not values:
+            return []
+        return values if isinstance(values, list) else [values]
+
+    def upsert_rows(self, table: NormalizedTable, rows: List[Dict]) -> Dict:
+        """
+        Upsert rows into one normalized table (caller commits)
+
+        Returns:
+            Dict with inserted, updated and unchanged counts
+        """
+        if not rows:
+            return {'inserted': 0, 'updated': 0, 'unchanged': 0}
+
+        # ON CONFLICT DO UPDATE cannot touch the same row twice in one
+        # statement, so keep only the last row per key
+        unique_rows = {tuple(row[c] for c in table.key_columns): row for row in rows}
+
+        results = psycopg2.extras.execute_values(
+            self.cursor,
+            table.upsert_query(),
+            list(unique_rows.values()),
+            template=table.template(),
+            page_size=self.batch_size,
+            fetch=True
+        )
+        inserted = sum(1 for result in results if result['inserted'])
+        updated = len(results) - inserted
+        return {
+            'inserted': inserted,
+            'updated': updated,
+            'unchanged': len(rows) - inserted - updated,
+        }
+
+    def write_batch(self, records: List[Dict]) -> Dict:
+        """
+        Upsert and commit the normalized rows of a batch of applications
+
+        A failed batch is rolled back and counted as errors.
+
+        Returns:
+            Dict with inserted, updated, unchanged and errors counts summed
+            over all four tables, plus '<table>:<count>' entries per table
+            (flat ints, so ShardedWriter can sum them)
+        """
+        totals = {'inserted': 0, 'updated': 0, 'unchanged': 0, 'errors': 0}
+        try:
+            per_table = {}
+            for table, key in self.TABLES:
+                rows = [row for record in records for row in record[key]]
+                if not table.fingerprinted:
+                    # Shared rows: insert in key order so parallel writers cannot deadlock
+                    rows.sort(key=lambda row: tuple(row[c] for c in table.key_columns))
+                for name, value in self.upsert_rows(table, rows).items():
+                    totals[name] += value
+                    per_table[f"{table.name}:{name}"] = value
+                self.row_counters[table.name].in_transaction(self.cursor.execute, per_table[f"{table.name}:inserted"])
+            self.conn.commit()
+            for name, counter in self.row_counters.items():
+                counter.committed(per_table[f"{name}:inserted"])
+            totals.update(per_table)
+            return totals
+        except Exception as e:
+            logger.error(f"Error processing batch: {e}")
+            self.db.rollback()
+            totals['errors'] = sum(
+                len(rows) for record in records for rows in (record['application'], record['products'], record['submissions'])
+            )
+            return totals
+
+    def _flush_batch(self, writer, batch: List[Dict], stats: Dict):
+        """Write one batch through writer, folding totals into stats and per-table counts into table_stats"""
+        batch_stats = writer.write_batch(batch)
+        for name, value in batch_stats.items():
+            if ':' in name:
+                table, count = name.split(':')
+                table_counts = self.table_stats.setdefault(table, {'inserted': 0, 'updated': 0, 'unchanged': 0})
+                table_counts[count] += value
+            else:
+                stats[name] += value
+
+    def sharded_writer(self, workers: int) -> ShardedWriter:
+        """
+        Parallel writer: applications are split by registration_number across
+        `workers` copies of this mapper, each with its own pooled connection
+        """
+        writers = [FDADrugNormalizedMapper(batch_size=self.batch_size) for _ in range(workers)]
+        for writer in writers:
+            writer.row_counters = self.row_counters
+        return ShardedWriter(
+            writers,
+            shard_key=lambda record: record['application'][0]['registration_number'],
+            sort_key=lambda record: record['application'][0]['registration_number'],
+        )
+
+    def process_fda_records(self, fda_records: Iterable[Dict], reconcile: bool = False) -> Dict:
+        """
+        Process FDA records into the normalized tables
+
+        Counts in the returned stats are rows across all four tables;
+        total_entries is the number of submission x product pairs, as in
+        the wide layout.
+
+        Args:
+            fda_records: Iterable of raw FDA records (a list or a stream)
+            reconcile: Not supported for the normalized tables (no retired
+                state); only accepted for signature compatibility
+
+        Returns:
+            Statistics dict
+        """
+        if reconcile:
+            logger.warning("Reconciliation is only available for DRUG_STORAGE_MODE=wide; loading without it")
+        stats = {
+            'total_records': 0,
+            'total_entries': 0,
+            'inserted': 0,
+            'updated': 0,
+            'unchanged': 0,
+            'retired': 0,
+            'errors': 0
+        }
+        self.table_stats = {}
+
+        workers = max(1, Config.DB_WRITERS)
+        writer = self.sharded_writer(workers) if workers > 1 else self
+        batches = BatchAccumulator(
+            lambda batch: self._flush_batch(writer, batch, stats),
+            max_rows=self.batch_size * workers,
+            max_bytes=Config.BATCH_MAX_BYTES * workers,
+            max_seconds=Config.BATCH_MAX_SECONDS,
+            size_of=self._payload_size,
+        )
+        try:
+            for fda_record in fda_records:
+                stats['total_records'] += 1
+                try:
+                    record = self.transform_application(fda_record)
+                except Exception as e:
+                    logger.error(f"Error transforming record: {e}")
+                    stats['errors'] += 1
+                    continue
+                stats['total_entries'] += record['entries']
+                batches.add(record)
+
+                if stats['total_records'] % self.PROGRESS_INTERVAL == 0:
+                    self._log_progress(stats)
+
+            batches.close()
+            self._log_progress(stats)
+        finally:
+            if writer is not self:
+                writer.close()
+
+        for name, table_stats in self.table_stats.items():
+            logger.info(f"{name}: {table_stats}")
+        return stats
+
+    @staticmethod
+    def _payload_size(record: Dict) -> int:
+        return sum(
+            estimate_size(row.values())
+            for key in ('openfda', 'application', 'products', 'submissions')
+            for row in record[key]
+        )
+
+    def get_table_count(self) -> int:
+        """
+        With ROW_COUNT_MODE=scan, the number of rows source.usa_drug_data_normalized
+        presents (submission x product pairs); otherwise the rows stored across
+        the four tables (estimated or counted), the unit of the inserted stats
+        """
+        try:
+            if Config.ROW_COUNT_MODE != 'scan':
+                return sum(counter.count(self.cursor) for counter in self.row_counters.values())
+            self.cursor.execute("""
+                SELECT COALESCE(SUM(p.products * s.submissions), 0) AS count
+                FROM (
+                    SELECT registration_number, COUNT(*) AS products
+                    FROM source.usa_drug_product GROUP BY registration_number
+                ) p
+                JOIN (
+                    SELECT registration_number, COUNT(*) AS submissions
+                    FROM source.usa_drug_submission GROUP BY registration_number
+                ) s USING (registration_number)
+            """)
+            result = self.cursor.fetchone()
+            return int(result['count'])
+        except Exception as e:
+            logger.error(f"Error getting table count: {e}")
+            self.db.rollback()
+            return 0
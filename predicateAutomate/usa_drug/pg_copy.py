@@ -0,0 +1,87 @@
+import json
+from typing import Any, Iterable, Iterator, Optional, Sequence
+
+
+def _escape_array_element(value: Any) -> str:
+    """Quote a single element for a PostgreSQL array literal"""
+    if value is None:
+        return 'NULL'
+    text = str(value).replace('\\', '\\\\').replace('"', '\\"')
+    return f'"{text}"'
+
+
+def format_copy_value(value: Any) -> str:
+    """
+    Format a Python value for COPY ... FROM STDIN in PostgreSQL text format
+
+    Args:
+        value: Column value (None, str, int, bool, list or dict)
+
+    Returns:
+        Escaped field text
+    """
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        text = 't' if value else 'f'
+    elif isinstance(value, (list, tuple)):
+        text = '{' + ','.join(_escape_array_element(v) for v in value) + '}'
+    elif isinstance(value, dict):
+        text = json.dumps(value)
+    else:
+        text = str(value)
+    return (
+        text.replace('\\', '\\\\')
+            .replace('\t', '\\t')
+            .replace('\n', '\\n')
+            .replace('\r', '\\r')
+    )
+
+
+def format_copy_row(values: Sequence[Any]) -> str:
+    """Format one row as a tab separated COPY text line"""
+    return '\t'.join(format_copy_value(v) for v in values) + '\n'
+
+
+class CopyStream:
+    """
+    File-like reader over an iterable of rows, for cursor.copy_expert
+
+    Rows are formatted lazily as psycopg2 pulls data, so the whole load never
+    has to be held in memory.
+    """
+
+    def __init__(self, rows: Iterable[Sequence[Any]]):
+        self._lines: Iterator[str] = (format_copy_row(row) for row in rows)
+        self._buffer = ''
+        self.rows_written = 0
+
+    def read(self, size: Optional[int] = -1) -> str:
+        if size is None or size < 0:
+            size = float('inf')
+        chunks = [self._buffer]
+        length = len(self._buffer)
+        while length < size:
+            line = next(self._lines, None)
+            if line is None:
+                break
+            self.rows_written += 1
+            chunks.append(line)
+            length += len(line)
+        data = ''.join(chunks)
+        if size == float('inf'):
+            self._buffer = ''
+            return data
+        self._buffer = data[size:]
+        return data[:size]
+
+    def readline(self, size: Optional[int] = -1) -> str:
+        if not self._buffer:
+            line = next(self._lines, None)
+            if line is None:
+                return ''
+            self.rows_written += 1
+            self._buffer = line
+        line, sep, rest = self._buffer.partition('\n')
+        self._buffer = rest
+        return line + sep
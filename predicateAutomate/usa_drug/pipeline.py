@@ -0,0 +1,194 @@
+import logging
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+_DONE = object()
+
+
+class Stage:
+    """
+    One pipeline stage, run by a single worker thread
+
+    Time is split three ways: busy (running the stage function or pulling
+    from the source), idle (waiting for input from upstream) and blocked
+    (waiting for room in the downstream queue, i.e. backpressure).
+    """
+
+    def __init__(self, name: str, fn: Optional[Callable[[Any], Optional[Iterable]]] = None):
+        self.name = name
+        self.fn = fn
+        self.busy_seconds = 0.0
+        self.idle_seconds = 0.0
+        self.blocked_seconds = 0.0
+        self.items_in = 0
+        self.items_out = 0
+
+    def summary(self) -> Dict:
+        return {
+            'stage': self.name,
+            'items_in': self.items_in,
+            'items_out': self.items_out,
+            'busy_seconds': round(self.busy_seconds, 2),
+            'idle_seconds': round(self.idle_seconds, 2),
+            'blocked_seconds': round(self.blocked_seconds, 2),
+        }
+
+
+class Pipeline:
+    """
+    Staged producer/consumer pipeline with bounded queues between stages
+
+    The first stage pulls items from a source iterable; every later stage
+    applies a function to each inbound item and forwards whatever it yields.
+    Stages run concurrently (one thread each), so e.g. part N+1 downloads
+    while part N is parsed and part N-1 is written to the database. Bounded
+    queues give backpressure: a fast stage blocks instead of buffering
+    unbounded work in memory.
+
+    If any stage raises, the pipeline stops and run() re-raises the error.
+    """
+
+    def __init__(self, source_name: str, source: Iterable, queue_size: int = 4):
+        self.source = source
+        self.queue_size = queue_size
+        self.stages: List[Stage] = [Stage(source_name)]
+        self._stop = threading.Event()
+        self._error: Optional[BaseException] = None
+
+    def add_stage(self, name: str, fn: Callable[[Any], Optional[Iterable]]) -> 'Pipeline':
+        """
+        Append a stage
+
+        Args:
+            name: Stage name used in the report
+            fn: Called once per inbound item; returns an iterable of items for
+                the next stage (or None to forward nothing)
+        """
+        self.stages.append(Stage(name, fn))
+        return self
+
+    def stop_source(self):
+        """Stop pulling new items from the source; queued work still drains"""
+        self._stop.set()
+
+    def _put(self, stage: Stage, outbox: Optional[queue.Queue], item: Any):
+        stage.items_out += 1
+        if outbox is None:
+            return
+        started = time.perf_counter()
+        while True:
+            try:
+                outbox.put(item, timeout=0.5)
+                break
+            except queue.Full:
+                if self._error is not None:
+                    break
+        stage.blocked_seconds += time.perf_counter() - started
+
+    def _run_source(self, stage: Stage, outbox: Optional[queue.Queue]):
+        try:
+            iterator = iter(self.source)
+            while not self._stop.is_set() and self._error is None:
+                started = time.perf_counter()
+                item = next(iterator, _DONE)
+                stage.busy_seconds += time.perf_counter() - started
+                if item is _DONE:
+                    break
+                stage.items_in += 1
+                self._put(stage, outbox, item)
+        except BaseException as e:
+            self._fail(stage, e)
+        finally:
+            close = getattr(self.source, 'close', None)
+            if close:
+                close()
+            if outbox is not None:
+                outbox.put(_DONE)
+
+    def _run_stage(self, stage: Stage, inbox: queue.Queue, outbox: Optional[queue.Queue]):
+        try:
+            while True:
+                started = time.perf_counter()
+                item = inbox.get()
+                stage.idle_seconds += time.perf_counter() - started
+                if item is _DONE:
+                    break
+                if self._error is not None:
+                    continue  # drain upstream so it can finish
+                stage.items_in += 1
+
+                started = time.perf_counter()
+                results = stage.fn(item)
+                outputs = iter(results) if results is not None else iter(())
+                while True:
+                    result = next(outputs, _DONE)
+                    stage.busy_seconds += time.perf_counter() - started
+                    if result is _DONE:
+                        break
+                    self._put(stage, outbox, result)
+                    started = time.perf_counter()
+        except BaseException as e:
+            self._fail(stage, e)
+            # Keep draining so upstream threads are never stuck on a full queue
+            while item is not _DONE:
+                item = inbox.get()
+        finally:
+            if outbox is not None:
+                outbox.put(_DONE)
+
+    def _fail(self, stage: Stage, error: BaseException):
+        logger.error(f"Pipeline stage '{stage.name}' failed: {error}")
+        if self._error is None:
+            self._error = error
+        self._stop.set()
+
+    def run(self) -> List[Dict]:
+        """
+        Run all stages to completion
+
+        Returns:
+            Per-stage timing summaries, in stage order
+        """
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in self.stages[1:]]
+        threads = [
+            threading.Thread(
+                target=self._run_source,
+                args=(self.stages[0], queues[0] if queues else None),
+                name=f"pipeline-{self.stages[0].name}",
+                daemon=True,
+            )
+        ]
+        for idx, stage in enumerate(self.stages[1:], 1):
+            outbox = queues[idx] if idx < len(queues) else None
+            threads.append(threading.Thread(
+                target=self._run_stage,
+                args=(stage, queues[idx - 1], outbox),
+                name=f"pipeline-{stage.name}",
+                daemon=True,
+            ))
+
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        if self._error is not None:
+            raise self._error
+        return [stage.summary() for stage in self.stages]
+
+    def log_report(self):
+        """Log busy/idle/blocked time per stage; the busiest stage is the bottleneck"""
+        logger.info("Pipeline stage timings:")
+        for stage in self.stages:
+            logger.info(
+                f"  {stage.name:<10} in: {stage.items_in:<6} out: {stage.items_out:<6} "
+                f"busy: {stage.busy_seconds:8.1f}s  "
+                f"idle: {stage.idle_seconds:8.1f}s  "
+                f"blocked: {stage.blocked_seconds:8.1f}s"
+            )
+        bottleneck = max(self.stages, key=lambda s: s.busy_seconds)
+        logger.info(f"  Bottleneck: {bottleneck.name}")
@@ -0,0 +1,110 @@
+import json
+import logging
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+from common.external_sort import ExternalSorter
+
+logger = logging.getLogger(__name__)
+
+INSERT = 'insert'
+UPDATE = 'update'
+UNCHANGED = 'unchanged'
+RETIRE = 'retire'
+
+
+def sort_snapshot(records: Iterable[Dict], sorter: ExternalSorter, key_column: str = 'natural_key') -> int:
+    """
+    Feed every transformed record into an external sorter, keyed by natural key
+
+    Returns:
+        Number of records added
+    """
+    count = 0
+    for record in records:
+        sorter.add(record[key_column], json.dumps(record))
+        count += 1
+    return count
+
+
+def iter_snapshot(sorter: ExternalSorter) -> Iterator[Tuple[str, Dict]]:
+    """
+    Read a sorted snapshot back as (natural_key, record) in key order
+
+    When several records share a key, only the last one added is kept (as
+    the batch upsert does).
+    """
+    pending_key, pending = None, None
+    for key, payload in sorter:
+        if pending_key is not None and key != pending_key:
+            yield pending_key, json.loads(pending)
+        pending_key, pending = key, payload
+    if pending_key is not None:
+        yield pending_key, json.loads(pending)
+
+
+def stream_stored_keys(conn, table: str, where: str = 'TRUE', params: tuple = (),
+                       fetch_size: int = 10000) -> Iterator[Tuple[str, Optional[str], bool]]:
+    """
+    Stream a table's natural keys in key order through a server-side cursor
+
+    uuid values order as their lowercase text form, so the keys arrive in
+    the same order as ExternalSorter sorts the snapshot's key strings.
+
+    Args:
+        conn: psycopg2 connection used only for this read (the named cursor
+            lives in its transaction)
+        table: Table with natural_key, row_fingerprint and retired_at columns
+        where: Extra filter, e.g. the partition key
+
+    Returns:
+        Iterator of (natural_key, row_fingerprint, retired)
+    """
+    with conn.cursor(name='reconcile_stored_keys') as cursor:
+        cursor.itersize = fetch_size
+        cursor.execute(f"""
+            SELECT natural_key::text, row_fingerprint::text, retired_at IS NOT NULL
+            FROM {table}
+            WHERE natural_key IS NOT NULL AND {where}
+            ORDER BY natural_key
+        """, params)
+        for row in cursor:
+            yield row[0], row[1], row[2]
+
+
+def merge_join(snapshot: Iterator[Tuple[str, Dict]],
+               stored: Iterator[Tuple[str, Optional[str], bool]],
+               fingerprint_column: str = 'row_fingerprint') -> Iterator[Tuple[str, str, Optional[Dict]]]:
+    """
+    Compare a sorted snapshot against the sorted stored keys in one pass
+
+    Both inputs must be in ascending key order with unique keys. Only the
+    current item of each side is held, so memory does not grow with either.
+
+    Yields:
+        (action, natural_key, record) where action is
+        INSERT: key only in the snapshot
+        UPDATE: stored with a different fingerprint, or retired and back in
+            the snapshot
+        UNCHANGED: stored, active and with the same fingerprint
+        RETIRE: stored and active but no longer in the snapshot (record is None)
+        Stored keys that are already retired and still absent yield nothing.
+    """
+    done = object()
+    new = next(snapshot, done)
+    old = next(stored, done)
+    while new is not done or old is not done:
+        if old is done or (new is not done and new[0] < old[0]):
+            yield INSERT, new[0], new[1]
+            new = next(snapshot, done)
+        elif new is done or old[0] < new[0]:
+            if not old[2]:
+                yield RETIRE, old[0], None
+            old = next(stored, done)
+        else:
+            key, record = new
+            _, fingerprint, retired = old
+            if retired or fingerprint != record[fingerprint_column]:
+                yield UPDATE, key, record
+            else:
+                yield UNCHANGED, key, record
+            new = next(snapshot, done)
+            old = next(stored, done)
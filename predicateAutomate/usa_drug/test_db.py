@@ -0,0 +1,162 @@
+import threading
+import pytest
+import psycopg2.extensions
+import psycopg2.pool
+from common.db import ConnectionPool, DBSession, PreparedStatement, register_statement
+
+
+class FakeCursor:
+    """Records statements; EXPLAIN reports a fixed planning time"""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.closed = False
+
+    def execute(self, query, params=None):
+        self.conn.executed.append(query)
+
+    def fetchone(self):
+        return {'QUERY PLAN': [{'Planning Time': 0.5}]}
+
+
+class FakeConnection:
+    """Just enough of a psycopg2 connection for the pool's bookkeeping"""
+
+    def __init__(self):
+        self.closed = 0
+        self.rollbacks = 0
+        self.status = psycopg2.extensions.TRANSACTION_STATUS_IDLE
+        self.executed = []
+
+    def cursor(self, cursor_factory=None):
+        return FakeCursor(self)
+
+    @property
+    def info(self):
+        return self
+
+    @property
+    def transaction_status(self):
+        return self.status
+
+    def rollback(self):
+        self.rollbacks += 1
+        self.status = psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+    def close(self):
+        self.closed = 1
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    opened = []
+
+    def connect(self):
+        conn = FakeConnection()
+        opened.append(conn)
+        return conn
+
+    monkeypatch.setattr(ConnectionPool, '_connect', connect)
+    pool = ConnectionPool(max_connections=2)
+    pool.opened = opened
+    return pool
+
+
+def test_returned_connections_are_reused(pool):
+    first = pool.getconn()
+    pool.putconn(first)
+    assert pool.getconn() is first
+    assert len(pool.opened) == 1
+    assert not first.closed
+
+
+def test_open_transaction_is_rolled_back_on_return(pool):
+    conn = pool.getconn()
+    conn.status = psycopg2.extensions.TRANSACTION_STATUS_INTRANS
+    pool.putconn(conn)
+    assert conn.rollbacks == 1
+    assert pool.getconn() is conn
+
+
+def test_checkout_waits_for_a_returned_connection(pool):
+    first, second = pool.getconn(), pool.getconn()
+    with pytest.raises(psycopg2.pool.PoolError):
+        pool.getconn(timeout=0.01)
+
+    threading.Timer(0.05, pool.putconn, (first,)).start()
+    assert pool.getconn(timeout=5) is first
+    pool.discard(second)
+    assert second.closed
+    # The discarded connection's slot is free again
+    assert pool.getconn(timeout=0.01) is not second
+
+
+def test_closed_session_connection_gives_its_slot_back(pool):
+    session = DBSession(pool=pool)
+    first = session.conn
+    first.close()
+    second = session.conn
+    assert second is not first
+    # Both slots would be taken if the closed connection had not been discarded
+    other = pool.getconn(timeout=0.01)
+    pool.putconn(other)
+
+
+def test_closeall_closes_idle_and_later_returned_connections(pool):
+    idle, busy = pool.getconn(), pool.getconn()
+    pool.putconn(idle)
+    pool.closeall()
+    assert idle.closed
+    pool.putconn(busy)
+    assert busy.closed
+
+
+def test_placeholders_are_numbered_for_prepare():
+    statement = PreparedStatement(
+        'test_numbered', "SELECT %s, x LIKE 'a%%' FROM t WHERE y = ANY(%s::uuid[])", types=('integer',)
+    )
+    assert statement.param_count == 2
+    assert statement.prepare_query() == (
+        "PREPARE test_numbered (integer) AS SELECT $1, x LIKE 'a%' FROM t WHERE y = ANY($2::uuid[])"
+    )
+
+
+def test_planning_time_saved_counts_cached_plan_executions():
+    statement = PreparedStatement('test_saved', "SELECT %s")
+    assert statement.planning_ms_saved() == 0.0
+    statement.planning_ms = 2.0
+    for _ in range(8):
+        statement.record_execution()
+    # The first five executions are planned individually
+    assert statement.stats() == {'executions': 8, 'planning_ms': 2.0, 'planning_ms_saved': 6.0}
+
+
+def test_registering_a_name_twice():
+    first = register_statement('test_register', "SELECT %s")
+    assert register_statement('test_register', "SELECT %s") is first
+    with pytest.raises(ValueError):
+        register_statement('test_register', "SELECT %s + 1")
+
+
+def test_statement_is_prepared_once_per_connection(pool):
+    register_statement('test_per_connection', "SELECT %s")
+    first, second = DBSession(pool=pool), DBSession(pool=pool)
+
+    for _ in range(3):
+        first.execute_prepared('test_per_connection', [1])
+    second.execute_prepared('test_per_connection', [2])
+
+    prepare = "PREPARE test_per_connection AS SELECT $1"
+    assert first.conn.executed.count(prepare) == 1
+    assert first.conn.executed.count("EXECUTE test_per_connection (%s)") == 3
+    assert second.conn.executed.count(prepare) == 1
+    with pytest.raises(ValueError):
+        first.execute_prepared('test_per_connection', [1, 2])
+
+    # A replacement connection has to prepare it again
+    conn = first.conn
+    first.release()
+    pool.discard(pool.getconn())
+    assert conn.closed
+    first.execute_prepared('test_per_connection', [3])
+    assert first.conn.executed.count(prepare) == 1
@@ -0,0 +1,50 @@
+import io
+import json
+import pytest
+from json_stream import iter_json_array
+
+
+DOCUMENTS = [
+    # Numbers cut after '.', 'e'/'E' or a sign must not decode as a prefix
+    {'results': [12345678, 1, 2.5e3, -0.125, 6E-2, 1e+10, 0, -7], 'meta': {'total': 8}},
+    # Strings with escapes, including escaped quotes and unicode escapes
+    {'meta': {'note': 'before "results"'},
+     'results': ['plain', 'quote \" inside', 'back\\\\slash', 'tab\there', 'snow ☃', '']},
+    # Nested objects and arrays, literals at the end of a chunk
+    {'results': [
+        {'a': {'b': [1, 2.0, {'c': None}]}, 'd': True, 'e': False},
+        [[], {}, [None, True, 3.75]],
+        {'openfda': {'spl_id': ['x', 'y'], 'n': 10.5e-1}},
+    ]},
+]
+
+
+def _texts(document):
+    yield json.dumps(document)
+    yield json.dumps(document, indent=2)
+    yield json.dumps(document, separators=(',', ':'))
+
+
+@pytest.mark.parametrize('document', DOCUMENTS)
+def test_every_chunk_size_yields_the_same_items(document):
+    for text in _texts(document):
+        for chunk_size in range(1, len(text) + 1):
+            items = list(iter_json_array(io.StringIO(text), chunk_size=chunk_size))
+            assert items == document['results'], f"chunk_size={chunk_size}: {text!r}"
+
+
+def test_number_split_after_decimal_point():
+    # Reported case: chunk sizes 1-4 and 9 cut the numbers mid-token
+    text = '{"results":[12345678, 1, 2.5e3]}'
+    for chunk_size in (1, 2, 3, 4, 9):
+        assert list(iter_json_array(io.StringIO(text), chunk_size=chunk_size)) == [12345678, 1, 2500.0]
+
+
+def test_other_members_are_skipped():
+    text = '{"meta": {"results": [0]}, "results": [1, 2], "tail": 3.5}'
+    assert list(iter_json_array(io.StringIO(text), chunk_size=2)) == [1, 2]
+
+
+def test_unterminated_array_raises():
+    with pytest.raises((ValueError, json.JSONDecodeError)):
+        list(iter_json_array(io.StringIO('{"results": [1, 2'), chunk_size=3))
@@ -0,0 +1,82 @@
+import re
+import pytest
+from common.db import DBSession
+from common.migrations import MIGRATIONS_DIR
+from db_mapper import FDADrugDBMapper
+from key_index import natural_key, natural_key_sql
+
+# Values as transform_record produces them: dates in YYYY-MM-DD
+ROWS = [
+    ('NDA000001', 'TESTOLOL', 'ORIG', '1', '2020-01-01', '5MG'),
+    ('NDA000001', 'TESTOLOL', 'ORIG', '1', None, '5MG'),
+    ('NDA000001', None, None, None, None, None),
+    ('NDA000001', '', 'ORIG', '1', '2020-01-01', ''),
+    ('ANDA0002', 'ÉPÉE ☃ 10%', 'SUPPL', '12', '1999-12-31', '1.5MG/ML; 2MG'),
+]
+
+STAGE_TABLE = """
+    CREATE TEMP TABLE natural_key_parity (
+        n INTEGER,
+        registration_number VARCHAR(100),
+        product_name VARCHAR(255),
+        submission_type VARCHAR(100),
+        submission_number VARCHAR(100),
+        submission_date DATE,
+        strength VARCHAR(1000)
+    ) ON COMMIT DROP
+"""
+
+
+def test_natural_key_distinguishes_null_from_empty():
+    assert natural_key(['a', None]) != natural_key(['a', ''])
+    assert natural_key([None, 'a']) != natural_key(['a', None])
+
+
+def test_natural_key_sql_marks_every_null():
+    # concat_ws skips NULL arguments, so each one must be replaced first
+    assert natural_key_sql(['a', 'b']) == (
+        "md5(concat_ws(E'\\x1f', coalesce(a, E'\\x1e'), coalesce(b, E'\\x1e')))::uuid"
+    )
+
+
+def test_natural_key_sql_covers_the_key_columns():
+    expressions = re.findall(r"coalesce\((.*?), E'\\x1e'\)", FDADrugDBMapper.NATURAL_KEY_SQL)
+    columns = [re.sub(r"to_char\((\w+), 'YYYY-MM-DD'\)", r'\1', e) for e in expressions]
+    assert tuple(columns) == FDADrugDBMapper.NATURAL_KEY_COLUMNS
+
+
+def _migration_key_sql() -> str:
+    """natural_key expression migration 0001 fills existing rows with"""
+    sql = next(MIGRATIONS_DIR.glob('0001_*.sql')).read_text(encoding='utf-8')
+    return re.search(r'SET natural_key = (md5\(.*?\)\)::uuid)', sql, re.DOTALL).group(1)
+
+
+@pytest.fixture
+def cursor():
+    db = DBSession()
+    if not db.check():
+        db.release()
+        pytest.skip('database not reachable')
+    try:
+        yield db.cursor
+    finally:
+        db.rollback()
+        db.release()
+
+
+def test_sql_key_matches_python_key(cursor):
+    cursor.execute(STAGE_TABLE)
+    cursor.executemany(
+        "INSERT INTO natural_key_parity VALUES (%s, %s, %s, %s, %s, %s, %s)",
+        [(n,) + row for n, row in enumerate(ROWS)]
+    )
+    cursor.execute(f"""
+        SELECT ({FDADrugDBMapper.NATURAL_KEY_SQL})::text AS mapper_key,
+               ({_migration_key_sql()})::text AS migration_key
+        FROM natural_key_parity
+        ORDER BY n
+    """)
+    rows = cursor.fetchall()
+
+    assert [row['mapper_key'] for row in rows] == [natural_key(r) for r in ROWS]
+    assert [row['migration_key'] for row in rows] == [row['mapper_key'] for row in rows]
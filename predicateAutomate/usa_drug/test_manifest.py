@@ -0,0 +1,52 @@
+import os
+import pytest
+from config import Config
+from label_fetcher import FDALabelFetcher
+from manifest import DownloadManifest
+
+FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'download.json')
+
+LABEL_PARTS = [
+    ('https://download.open.fda.gov/drug/label/drug-label-0001-of-0003.json.zip', '135.62', 20000),
+    ('https://download.open.fda.gov/drug/label/drug-label-0002-of-0003.json.zip', '129.41', 20000),
+    ('https://download.open.fda.gov/drug/label/drug-label-0003-of-0003.json.zip', '62.07', 7530),
+]
+
+
+@pytest.fixture
+def output_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, 'OUTPUT_DIR', str(tmp_path))
+    monkeypatch.setattr(Config, 'DOWNLOAD_STATE_FILE', str(tmp_path / 'download_validators.json'))
+    monkeypatch.setattr(Config, 'MANIFEST_CACHE_FILE', str(tmp_path / 'download_manifest.json'))
+    monkeypatch.setattr(Config, 'FDA_MANIFEST_FILE', FIXTURE)
+    return tmp_path
+
+
+def test_fixture_endpoints(output_dir):
+    manifest = DownloadManifest()
+
+    [drugsfda] = manifest.partitions('drug', 'drugsfda')
+    assert drugsfda['file'] == 'https://download.open.fda.gov/drug/drugsfda/drug-drugsfda-0001-of-0001.json.zip'
+    assert drugsfda['size_mb'] == '7.38'
+    assert drugsfda['records'] == 28312
+    assert manifest.export_date('drug', 'drugsfda') == '2024-10-22'
+
+    parts = manifest.partitions('drug', 'label')
+    assert [(p['file'], p['size_mb'], p['records']) for p in parts] == LABEL_PARTS
+    assert sum(p['records'] for p in parts) == manifest.endpoint('drug', 'label')['total_records']
+
+    with pytest.raises(ValueError):
+        manifest.endpoint('device', 'udi')
+    # The fixture is served as is: nothing is fetched or cached
+    assert not os.path.exists(Config.MANIFEST_CACHE_FILE)
+
+
+def test_label_parts_from_fixture(output_dir):
+    parts = FDALabelFetcher().discover_label_parts()
+
+    assert [(p['url'], p['size_mb'], p['records']) for p in parts] == LABEL_PARTS
+    assert [p['part_num'] for p in parts] == [1, 2, 3]
+    assert {p['export_date'] for p in parts} == {'2024-10-22'}
+    for part in parts:
+        assert part['filename'] == part['url'].rsplit('/', 1)[-1]
+        assert part['local_path'] == os.path.join(str(output_dir), 'fda_labels', part['filename'])
@@ -0,0 +1,70 @@
+import pytest
+from common.migrations import Migration, load_migrations, split_statements
+
+
+def test_splits_on_top_level_semicolons():
+    assert split_statements("SELECT 1; SELECT 2;\nSELECT 3") == ['SELECT 1', 'SELECT 2', 'SELECT 3']
+
+
+def test_semicolons_inside_quotes_and_comments_do_not_split():
+    sql = """
+        INSERT INTO t VALUES ('a;b', 'it''s; fine');
+        -- a comment; with a semicolon
+        SELECT 1 /* block; comment */ + 1;
+        SELECT "odd;name" FROM t
+    """
+    statements = split_statements(sql)
+    assert len(statements) == 3
+    assert statements[0] == "INSERT INTO t VALUES ('a;b', 'it''s; fine')"
+    assert statements[1].endswith("SELECT 1 /* block; comment */ + 1")
+    assert statements[2] == 'SELECT "odd;name" FROM t'
+
+
+def test_dollar_quoted_bodies_stay_whole():
+    sql = """
+        DO $$
+        BEGIN
+            PERFORM 1;
+            RAISE NOTICE 'done;';
+        END $$;
+        CREATE FUNCTION f() RETURNS int AS $body$ SELECT 1; $body$ LANGUAGE sql;
+    """
+    statements = split_statements(sql)
+    assert len(statements) == 2
+    assert statements[0].startswith('DO $$') and statements[0].endswith('END $$')
+    assert '$body$ SELECT 1; $body$' in statements[1]
+
+
+def test_comment_only_statements_are_dropped():
+    assert split_statements("-- nothing here\n;\n/* or here */;\n") == []
+    assert split_statements("SELECT 1;\n-- trailing comment\n") == ['SELECT 1']
+
+
+def test_migration_files_parse(tmp_path):
+    (tmp_path / '0001_first.sql').write_text("CREATE TABLE a (id int);\nCREATE TABLE b (id int);\n")
+    (tmp_path / '0002_second.sql').write_text(
+        "-- migrate:no-transaction\n"
+        "CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS a_id_idx ON source.a (id);\n"
+        "CREATE INDEX CONCURRENTLY b_id_idx ON b (id);\n"
+    )
+
+    first, second = load_migrations(tmp_path)
+
+    assert (first.version, first.name, first.transactional) == (1, 'first', True)
+    assert len(first.statements()) == 2
+    assert (second.version, second.transactional) == (2, False)
+    assert second.concurrent_indexes() == ['source.a_id_idx', 'public.b_id_idx']
+
+
+def test_bad_file_names_are_rejected(tmp_path):
+    (tmp_path / 'first.sql').write_text("SELECT 1;")
+    with pytest.raises(ValueError):
+        load_migrations(tmp_path)
+
+
+def test_repository_migrations_parse():
+    migrations = load_migrations()
+    assert [m.version for m in migrations] == list(range(1, len(migrations) + 1))
+    for migration in migrations:
+        assert isinstance(migration, Migration)
+        assert migration.statements(), migration.path.name
@@ -0,0 +1,67 @@
+import pytest
+from pg_copy import CopyStream, format_copy_row, format_copy_value
+
+
+@pytest.mark.parametrize('value, expected', [
+    (None, '\\N'),
+    (True, 't'),
+    (False, 'f'),
+    (42, '42'),
+    ('plain', 'plain'),
+    ('tab\there', 'tab\\there'),
+    ('line\nbreak\r', 'line\\nbreak\\r'),
+    ('back\\slash', 'back\\\\slash'),
+    # A literal \N in the data must not read back as NULL
+    ('\\N', '\\\\N'),
+    ({'a': 'x\ty'}, '{"a": "x\\\\ty"}'),
+])
+def test_format_copy_value(value, expected):
+    assert format_copy_value(value) == expected
+
+
+def test_array_elements_are_quoted_then_copy_escaped():
+    # Array literal {"a\"b","c\\d",NULL,""}, then every backslash doubled for COPY
+    assert format_copy_value(['a"b', 'c\\d', None, '']) == '{"a\\\\"b","c\\\\\\\\d",NULL,""}'
+    assert format_copy_value([]) == '{}'
+
+
+def test_format_copy_row():
+    assert format_copy_row(['x', None, 1, ['y']]) == 'x\t\\N\t1\t{"y"}\n'
+
+
+ROWS = [('a', 1), ('b\tc', None), ('multi\nline', 3)]
+EXPECTED = 'a\t1\nb\\tc\t\\N\nmulti\\nline\t3\n'
+
+
+@pytest.mark.parametrize('size', [1, 2, 5, 8192, -1, None])
+def test_read_in_any_size_yields_the_same_text(size):
+    stream = CopyStream(iter(ROWS))
+    chunks = []
+    while True:
+        chunk = stream.read(size)
+        if not chunk:
+            break
+        chunks.append(chunk)
+    assert ''.join(chunks) == EXPECTED
+    assert stream.rows_written == len(ROWS)
+
+
+def test_readline():
+    stream = CopyStream(iter(ROWS))
+    lines = iter(lambda: stream.readline(), '')
+    assert list(lines) == ['a\t1\n', 'b\\tc\t\\N\n', 'multi\\nline\t3\n']
+    assert stream.rows_written == len(ROWS)
+
+
+def test_rows_are_formatted_lazily():
+    pulled = []
+
+    def rows():
+        for row in ROWS:
+            pulled.append(row)
+            yield row
+
+    stream = CopyStream(rows())
+    assert pulled == []
+    stream.read(3)
+    assert pulled == [ROWS[0]]
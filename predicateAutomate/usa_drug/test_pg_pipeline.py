@@ -0,0 +1,109 @@
+import uuid
+import pytest
+from config import Config
+
+psycopg = pytest.importorskip('psycopg', reason='pipeline mode requires psycopg 3')
+
+from db_mapper import FDADrugDBMapper
+
+
+# Compared as text so psycopg2 and psycopg 3 type conversions do not differ
+ROWS_QUERY = """
+    SELECT (to_jsonb(t) - 'id' - 'created_at' - 'updated_at')::text
+    FROM {table} t
+    WHERE registration_number = %s
+    ORDER BY natural_key
+"""
+
+
+def _fda_records(application_number: str, products: int = 8):
+    """One application with several products and two submissions each"""
+    return [{
+        'application_number': application_number,
+        'sponsor_name': 'PIPELINE TEST SPONSOR',
+        'openfda': {'generic_name': ['TESTOLOL'], 'spl_id': [str(uuid.uuid4())]},
+        'products': [{
+            'product_number': f"{n:03d}",
+            'brand_name': f"TESTOLOL {n}",
+            'dosage_form': 'TABLET',
+            'route': 'ORAL',
+            'marketing_status': 'Prescription',
+            'reference_drug': 'No',
+            'active_ingredients': [{'name': 'TESTOLOL', 'strength': f"{n * 5}MG"}],
+        } for n in range(1, products + 1)],
+        'submissions': [
+            {'submission_type': 'ORIG', 'submission_number': '1', 'submission_status_date': '20200101'},
+            {'submission_type': 'SUPPL', 'submission_number': '2', 'submission_status_date': '20210315'},
+        ],
+    }]
+
+
+def _transform(mapper: FDADrugDBMapper, fda_records):
+    records = []
+    for fda_record in fda_records:
+        for product in fda_record['products']:
+            for submission in fda_record['submissions']:
+                records.append(mapper.transform_record(fda_record, product, submission))
+    return records
+
+
+def _rounds(mapper: FDADrugDBMapper, fda_records):
+    """Insert, then upsert again with one product changed, as the two write paths see it"""
+    first = _transform(mapper, fda_records)
+    changed = [dict(fda_records[0], products=[dict(p) for p in fda_records[0]['products']])]
+    changed[0]['products'][0]['marketing_status'] = 'Discontinued'
+    # A duplicate key inside the batch must be collapsed the same way
+    second = _transform(mapper, changed)
+    return first, second + second[:1]
+
+
+@pytest.fixture
+def application_number():
+    return f"TEST-{uuid.uuid4().hex[:12]}"
+
+
+def _mapper(write_mode: str) -> FDADrugDBMapper:
+    mapper = FDADrugDBMapper(use_key_index=False, write_mode=write_mode)
+    if not mapper.connect():
+        mapper.close()
+        pytest.skip('database not reachable or not migrated')
+    return mapper
+
+
+def test_pipeline_matches_batch_upsert(monkeypatch, application_number):
+    # Several statements per batch, the last one shorter
+    monkeypatch.setattr(Config, 'DB_PIPELINE_STATEMENT_ROWS', 3)
+    fda_records = _fda_records(application_number)
+
+    standard = _mapper('standard')
+    try:
+        first, second = _rounds(standard, fda_records)
+        standard_stats = [standard.batch_upsert_records(first), standard.batch_upsert_records(second)]
+        standard.cursor.execute(ROWS_QUERY.format(table=standard.partition), (application_number,))
+        standard_rows = [next(iter(row.values())) for row in standard.cursor.fetchall()]
+    finally:
+        standard.db.rollback()
+        standard.close()
+
+    pipelined = _mapper('pipeline')
+    try:
+        try:
+            pipelined.pipeline_db.conn
+        except psycopg.OperationalError:
+            pytest.skip('psycopg 3 cannot connect to the database')
+        first, second = _rounds(pipelined, fda_records)
+        pipeline_stats = [pipelined.pipeline_upsert_records(first), pipelined.pipeline_upsert_records(second)]
+        [rows] = pipelined.pipeline_db.execute_pipelined(
+            [(ROWS_QUERY.format(table=pipelined.partition), (application_number,))]
+        )
+        pipeline_rows = [row[0] for row in rows]
+    finally:
+        pipelined.pipeline_db.rollback()
+        pipelined.db.rollback()
+        pipelined.close()
+
+    assert standard_stats[0] == {'inserted': len(first), 'updated': 0, 'unchanged': 0}
+    assert standard_stats[1]['updated'] == 2
+    assert pipeline_stats == standard_stats
+    assert len(standard_rows) == len(first)
+    assert pipeline_rows == standard_rows
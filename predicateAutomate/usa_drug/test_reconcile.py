@@ -0,0 +1,96 @@
+import json
+import os
+import random
+import pytest
+from common.external_sort import ExternalSorter
+from reconcile import INSERT, RETIRE, UNCHANGED, UPDATE, iter_snapshot, merge_join, sort_snapshot
+
+
+@pytest.mark.parametrize('chunk_rows', [1, 3, 1000])
+def test_external_sort_spills_and_merges_in_key_order(tmp_path, chunk_rows):
+    rng = random.Random(7)
+    items = [(f"{rng.randrange(50):04d}", str(n)) for n in range(200)]
+
+    with ExternalSorter(chunk_rows, directory=str(tmp_path)) as sorter:
+        for key, payload in items:
+            sorter.add(key, payload)
+        result = list(sorter)
+        stats = sorter.stats()
+
+    # Stable: equal keys keep the order they were added in
+    assert result == sorted(items, key=lambda item: item[0])
+    assert stats['rows'] == 200
+    assert stats['runs'] == -(-200 // chunk_rows)
+    # Run files are removed on exit
+    assert os.listdir(tmp_path) == []
+
+
+def test_external_sort_payloads_keep_tabs(tmp_path):
+    with ExternalSorter(2, directory=str(tmp_path)) as sorter:
+        sorter.add('b', 'x\ty')
+        sorter.add('a', '')
+        sorter.add('c', json.dumps({'k': 'v'}))
+        assert list(sorter) == [('a', ''), ('b', 'x\ty'), ('c', '{"k": "v"}')]
+
+
+def test_snapshot_keeps_last_duplicate(tmp_path):
+    records = [
+        {'natural_key': 'k2', 'row_fingerprint': 'f1', 'n': 1},
+        {'natural_key': 'k1', 'row_fingerprint': 'f1', 'n': 2},
+        {'natural_key': 'k2', 'row_fingerprint': 'f2', 'n': 3},
+        {'natural_key': 'k2', 'row_fingerprint': 'f3', 'n': 4},
+    ]
+    with ExternalSorter(2, directory=str(tmp_path)) as sorter:
+        assert sort_snapshot(records, sorter) == 4
+        assert [(key, record['n']) for key, record in iter_snapshot(sorter)] == [('k1', 2), ('k2', 4)]
+
+
+def _record(key, fingerprint):
+    return key, {'natural_key': key, 'row_fingerprint': fingerprint}
+
+
+def test_merge_join_classifies_every_key():
+    snapshot = [
+        _record('a', 'new'),        # only in the export
+        _record('b', 'same'),       # stored, same fingerprint
+        _record('c', 'changed'),    # stored, different fingerprint
+        _record('d', 'same'),       # stored but retired, back in the export
+        _record('g', 'new'),        # after every stored key
+    ]
+    stored = [
+        ('b', 'same', False),
+        ('c', 'old', False),
+        ('d', 'same', True),
+        ('e', 'gone', False),       # active, missing from the export
+        ('f', 'gone', True),        # already retired and still missing
+    ]
+
+    actions = [(action, key) for action, key, _ in merge_join(iter(snapshot), iter(stored))]
+
+    assert actions == [
+        (INSERT, 'a'),
+        (UNCHANGED, 'b'),
+        (UPDATE, 'c'),
+        (UPDATE, 'd'),
+        (RETIRE, 'e'),
+        (INSERT, 'g'),
+    ]
+
+
+def test_merge_join_passes_records_through():
+    snapshot = [_record('a', 'f'), _record('b', 'f')]
+    stored = [('b', 'f', False), ('c', 'f', False)]
+
+    result = list(merge_join(iter(snapshot), iter(stored)))
+
+    assert result == [
+        (INSERT, 'a', snapshot[0][1]),
+        (UNCHANGED, 'b', snapshot[1][1]),
+        (RETIRE, 'c', None),
+    ]
+
+
+def test_merge_join_empty_sides():
+    assert list(merge_join(iter([]), iter([]))) == []
+    assert [a for a, _, _ in merge_join(iter([_record('a', 'f')]), iter([]))] == [INSERT]
+    assert [a for a, _, _ in merge_join(iter([]), iter([('a', 'f', False)]))] == [RETIRE]
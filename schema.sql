@@ -1,5 +1,10 @@
 -- this sql is for the database schema and for reference only 
 -- the application does not create the schema and tables, it is created by the database administrator
+-- databases created from an earlier version of this file are upgraded by the versioned
+-- migrations in predicateAutomate/migrations (python app.py --migrate), which also create the
+-- indexes the mappers rely on online and record what was applied in source.schema_migrations
+-- this file is the schema after every migration; on a new database created from it, running
+-- the migrations finds nothing to change and only records them
 
 CREATE TABLE IF NOT EXISTS drug.drug_predicate_assessments (
     id SERIAL PRIMARY KEY,
@@ -73,13 +78,18 @@ CREATE INDEX IF NOT EXISTS idx_drug_predicate_generic_name ON drug.drug_predicat
 
 
 
+-- Partitioned by LIST (country_of_origin): one partition per country
+-- (source.usa_drug_data_p<country id>), so a load writes a single partition,
+-- a country can be detached (app.py --detach-partition) and country-scoped
+-- queries prune the others. Keys must include the partition column, so
+-- country_of_origin is NOT NULL and a referenced country cannot be deleted.
 CREATE TABLE IF NOT EXISTS source.usa_drug_data (
-    id SERIAL PRIMARY KEY,
+    id SERIAL,
     spl_id TEXT[],
     spl_set_id TEXT[],
     ingredient_name VARCHAR(1000),
     product_name VARCHAR(255),
-    country_of_origin INTEGER REFERENCES public.country (id) ON UPDATE CASCADE ON DELETE SET NULL,
+    country_of_origin INTEGER NOT NULL REFERENCES public.country (id) ON UPDATE CASCADE,
     application_type VARCHAR(100),
     registration_number VARCHAR(100),
     registration_holder VARCHAR(255),
@@ -96,13 +106,152 @@ CREATE TABLE IF NOT EXISTS source.usa_drug_data (
     json_data JSONB,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    created_by INTEGER
-);
+    created_by INTEGER,
+    natural_key UUID,
+    row_fingerprint UUID,
+    retired_at TIMESTAMP,
+    PRIMARY KEY (country_of_origin, id)
+) PARTITION BY LIST (country_of_origin);
+-- natural_key: md5 of (registration_number, product_name, submission_type,
+-- submission_number, submission_date, strength) joined by \x1f with NULL as \x1e,
+-- computed by the mapper's transform_record and used for ON CONFLICT.
+-- row_fingerprint: md5 over the mapped columns and json_data; an existing row is
+-- only rewritten when it changes. Rows without one are refreshed on the next load.
+-- retired_at: set when an entry is no longer in the FDA export (reconciliation),
+-- cleared when it reappears; current data is WHERE retired_at IS NULL
+
+CREATE TABLE IF NOT EXISTS source.usa_drug_data_p1 PARTITION OF source.usa_drug_data FOR VALUES IN (1);
+
+-- Unique per country: a partitioned table's unique keys must include country_of_origin
+CREATE UNIQUE INDEX IF NOT EXISTS uq_usa_drug_data_natural_key ON source.usa_drug_data(country_of_origin, natural_key);
+
 CREATE INDEX IF NOT EXISTS idx_usa_drug_data_product_name ON source.usa_drug_data(product_name);
 CREATE INDEX IF NOT EXISTS idx_usa_drug_data_country_of_origin ON source.usa_drug_data(country_of_origin);
 CREATE INDEX IF NOT EXISTS idx_usa_drug_data_reg_holder ON source.usa_drug_data(registration_holder);
 CREATE INDEX IF NOT EXISTS idx_usa_drug_data_manufacturer ON source.usa_drug_data(manufacturer);
 CREATE INDEX IF NOT EXISTS idx_usa_drug_data_generic_name ON source.usa_drug_data(generic_name);
+CREATE INDEX IF NOT EXISTS idx_usa_drug_data_spl_id ON source.usa_drug_data USING GIN (spl_id);
+CREATE INDEX IF NOT EXISTS idx_usa_drug_data_retired_at ON source.usa_drug_data(retired_at) WHERE retired_at IS NOT NULL;
+
+
+
+-- Normalized drug storage (DRUG_STORAGE_MODE=normalized): one row per
+-- application, product and submission, and each distinct openfda block stored
+-- once, instead of one wide row per submission x product pair.
+CREATE TABLE IF NOT EXISTS source.usa_drug_openfda (
+    openfda_hash UUID PRIMARY KEY,
+    openfda JSONB NOT NULL,
+    spl_id TEXT[],
+    spl_set_id TEXT[],
+    generic_name VARCHAR(255),
+    manufacturer VARCHAR(255),
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS source.usa_drug_application (
+    registration_number VARCHAR(100) PRIMARY KEY,
+    country_of_origin INTEGER REFERENCES public.country (id) ON UPDATE CASCADE ON DELETE SET NULL,
+    application_type VARCHAR(100),
+    registration_holder VARCHAR(255),
+    openfda_hash UUID REFERENCES source.usa_drug_openfda (openfda_hash),
+    created_by INTEGER,
+    row_fingerprint UUID,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS source.usa_drug_product (
+    registration_number VARCHAR(100) REFERENCES source.usa_drug_application (registration_number) ON DELETE CASCADE,
+    product_number VARCHAR(20),
+    product_name VARCHAR(255),
+    ingredient_name VARCHAR(1000),
+    reference_drug VARCHAR(255),
+    dosage_form VARCHAR(255),
+    strength VARCHAR(1000),
+    route_administration VARCHAR(255),
+    marketing_status VARCHAR(100),
+    product JSONB,
+    row_fingerprint UUID,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (registration_number, product_number)
+);
+
+CREATE TABLE IF NOT EXISTS source.usa_drug_submission (
+    registration_number VARCHAR(100) REFERENCES source.usa_drug_application (registration_number) ON DELETE CASCADE,
+    submission_type VARCHAR(100),
+    submission_number VARCHAR(100),
+    submission_date DATE,
+    submission JSONB,
+    row_fingerprint UUID,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    -- Same submission columns as the wide natural key; submission_date may be
+    -- NULL, so this is a NULLS NOT DISTINCT unique key rather than a primary key
+    CONSTRAINT uq_usa_drug_submission_key
+        UNIQUE NULLS NOT DISTINCT (registration_number, submission_type, submission_number, submission_date)
+);
+
+CREATE INDEX IF NOT EXISTS idx_usa_drug_application_openfda_hash ON source.usa_drug_application(openfda_hash);
+CREATE INDEX IF NOT EXISTS idx_usa_drug_application_reg_holder ON source.usa_drug_application(registration_holder);
+CREATE INDEX IF NOT EXISTS idx_usa_drug_product_product_name ON source.usa_drug_product(product_name);
+CREATE INDEX IF NOT EXISTS idx_usa_drug_openfda_generic_name ON source.usa_drug_openfda(generic_name);
+CREATE INDEX IF NOT EXISTS idx_usa_drug_openfda_manufacturer ON source.usa_drug_openfda(manufacturer);
+
+-- Same columns as source.usa_drug_data (except row_fingerprint), rebuilt
+-- from the normalized tables: one row per submission x product.
+-- id is the first 64 bits of natural_key, so it is stable across reloads.
+-- retired_at is always NULL: reconciliation only runs on the wide table.
+-- id and retired_at come last so CREATE OR REPLACE can add them to an
+-- existing view.
+CREATE OR REPLACE VIEW source.usa_drug_data_normalized AS
+SELECT
+    o.spl_id,
+    o.spl_set_id,
+    p.ingredient_name,
+    p.product_name,
+    a.country_of_origin,
+    a.application_type,
+    a.registration_number,
+    a.registration_holder,
+    o.manufacturer,
+    o.generic_name,
+    p.reference_drug,
+    p.dosage_form,
+    p.strength,
+    p.route_administration,
+    p.marketing_status,
+    s.submission_type,
+    s.submission_number,
+    s.submission_date,
+    jsonb_build_object(
+        'application_number', a.registration_number,
+        'product_number', p.product_number,
+        'submission', s.submission,
+        'product', p.product,
+        'openfda', o.openfda,
+        'sponsor_name', a.registration_holder
+    ) AS json_data,
+    GREATEST(a.created_at, p.created_at, s.created_at) AS created_at,
+    GREATEST(a.updated_at, p.updated_at, s.updated_at) AS updated_at,
+    a.created_by,
+    k.key_md5::uuid AS natural_key,
+    ('x' || left(k.key_md5, 16))::bit(64)::bigint AS id,
+    NULL::timestamp AS retired_at
+FROM source.usa_drug_application a
+JOIN source.usa_drug_product p ON p.registration_number = a.registration_number
+JOIN source.usa_drug_submission s ON s.registration_number = a.registration_number
+LEFT JOIN source.usa_drug_openfda o ON o.openfda_hash = a.openfda_hash
+CROSS JOIN LATERAL (
+    SELECT md5(concat_ws(E'\x1f',
+        coalesce(a.registration_number, E'\x1e'),
+        coalesce(p.product_name, E'\x1e'),
+        coalesce(s.submission_type, E'\x1e'),
+        coalesce(s.submission_number, E'\x1e'),
+        coalesce(to_char(s.submission_date, 'YYYY-MM-DD'), E'\x1e'),
+        coalesce(p.strength, E'\x1e')
+    )) AS key_md5
+) k;
 
 
 
@@ -114,10 +263,12 @@ CREATE TABLE IF NOT EXISTS source.usa_drug_label (
     manufacturer_label VARCHAR(255),
     brand_name VARCHAR(255),
     indications_and_usage TEXT,
+    effective_time VARCHAR(8),
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
-CREATE INDEX IF NOT EXISTS idx_usa_drug_label_spl_ids ON source.usa_drug_label(spl_id, spl_set_id);
+-- effective_time: label version date (YYYYMMDD); when a batch holds several
+-- records for one key, the newest is kept
 CREATE INDEX IF NOT EXISTS idx_usa_drug_label_registration_number ON source.usa_drug_label(registration_number);
 CREATE INDEX IF NOT EXISTS idx_usa_drug_label_generic_name_label ON source.usa_drug_label(generic_name_label);
 CREATE INDEX IF NOT EXISTS idx_usa_drug_label_manufacturer_label ON source.usa_drug_label(manufacturer_label);
@@ -128,3 +279,14 @@ ALTER TABLE source.usa_drug_label
 ADD CONSTRAINT uk_usa_drug_label_spl_ids
 UNIQUE (spl_id, spl_set_id, registration_number);
 
+
+-- Exact row counts for ROW_COUNT_MODE=counter: slot 0 holds a table's seeded
+-- COUNT(*), each writer thread adds its inserts to its own slot, and a read
+-- sums the slots
+CREATE TABLE IF NOT EXISTS source.table_row_counts (
+    table_name VARCHAR(255) NOT NULL,
+    slot INTEGER NOT NULL,
+    row_count BIGINT NOT NULL,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (table_name, slot)
+);